@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark suite for fastqsplitter. It generates a deterministic synthetic
+FASTQ file and times fastqsplitter over a matrix of settings. Results are
+written as JSON and can be compared against a stored baseline to detect
+regressions.
+"""
+
+# Copyright (c) 2019 Leiden University Medical Center
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+
+import fastqsplitter
+
+import xopen
+
+# Read lengths of the synthetic read profiles. Long reads get a random length
+# between the minimum and the maximum.
+READ_PROFILES = {"short": (150, 150), "long": (1000, 20000)}
+# Sequences and qualities are taken from a pool of random strings, so a large
+# file can be generated quickly while it still compresses like real data.
+POOL_SIZE = 4096
+DEFAULT_SEED = 1
+DEFAULT_TOLERANCE = 0.10
+
+
+def comma_separated(converter):
+    """Return an argparse type that converts a comma separated list."""
+    def convert(value: str) -> list:
+        return [converter(item) for item in value.split(",")]
+    return convert
+
+
+def argument_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=str, default="100M",
+                        help="Size of the synthetic FASTQ file. "
+                             "Default=100M.")
+    parser.add_argument("--profile", choices=READ_PROFILES.keys(),
+                        default="short",
+                        help="Short (150bp) or long (1-20kb) reads. "
+                             "Default=short.")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED,
+                        help="Seed for the synthetic FASTQ file. The same "
+                             "seed, size and profile always give the same "
+                             "file. Default={0}.".format(DEFAULT_SEED))
+    parser.add_argument("--input-compression-level", type=int,
+                        help="Gzip compress the synthetic input file with "
+                             "this level. Default: uncompressed.")
+    parser.add_argument("--buffer-sizes", type=comma_separated(str),
+                        default=["16K", "64K", "128K", "256K"],
+                        help="Comma separated buffer sizes. "
+                             "Default=16K,64K,128K,256K.")
+    parser.add_argument("--numbers", type=comma_separated(int),
+                        default=[3, 10],
+                        help="Comma separated numbers of output files. "
+                             "Default=3,10.")
+    parser.add_argument("--compression-levels", type=comma_separated(int),
+                        default=[0, 1],
+                        help="Comma separated compression levels. 0 writes "
+                             "uncompressed output files, other levels write "
+                             "gzip files. Default=0,1.")
+    parser.add_argument("--threads-per-file", type=comma_separated(int),
+                        default=[0, 1],
+                        help="Comma separated values for threads per file. "
+                             "Default=0,1.")
+    parser.add_argument("--modes", type=comma_separated(str),
+                        default=["round-robin", "sequential"],
+                        help="Comma separated split modes. "
+                             "Default=round-robin,sequential.")
+    parser.add_argument("-r", "--repeats", type=int, default=3,
+                        help="How often each benchmark is run. The fastest "
+                             "run is used for comparisons. Default=3.")
+    parser.add_argument("-o", "--output", type=str,
+                        help="Write the results as JSON to this file.")
+    parser.add_argument("--baseline", type=str,
+                        help="Compare the results with this earlier JSON "
+                             "output. Exits with 1 if a benchmark is slower "
+                             "than the tolerance allows.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="Allowed slowdown compared to the baseline as "
+                             "a fraction. Default={0}."
+                             "".format(DEFAULT_TOLERANCE))
+    parser.add_argument("--workdir", type=str,
+                        help="Directory for the input and output files. Use "
+                             "the filesystem that is of interest. Default: a "
+                             "temporary directory.")
+    return parser
+
+
+def generate_fastq(filename: str, size: int, profile: str = "short",
+                   seed: int = DEFAULT_SEED,
+                   compression_level: Optional[int] = None) -> int:
+    """
+    Write a synthetic FASTQ file of at least size bytes. The output only
+    depends on the size, profile and seed.
+    :param filename: The file to write.
+    :param size: The minimum number of uncompressed bytes.
+    :param profile: A key of READ_PROFILES.
+    :param seed: The seed of the random generator.
+    :param compression_level: If given, gzip compress with this level.
+    :return: The number of records written.
+    """
+    min_length, max_length = READ_PROFILES[profile]
+    rng = random.Random(seed)
+    bases = "ACGT"
+    qualities = "".join(chr(33 + score) for score in range(2, 42))
+    sequence_pool = "".join(rng.choice(bases) for _ in range(
+        POOL_SIZE + max_length)).encode("ascii")
+    quality_pool = "".join(rng.choice(qualities) for _ in range(
+        POOL_SIZE + max_length)).encode("ascii")
+    written = 0
+    records = 0
+    if compression_level is None:
+        output = open(filename, "wb")  # type: Any
+    else:
+        output = xopen.xopen(filename, "wb",
+                             compresslevel=compression_level)
+    with output:
+        while written < size:
+            length = rng.randint(min_length, max_length)
+            sequence_start = rng.randrange(POOL_SIZE)
+            quality_start = rng.randrange(POOL_SIZE)
+            record = b"".join([
+                "@synthetic:{0}:{1} 1:N:0:1\n".format(seed, records).encode(
+                    "ascii"),
+                sequence_pool[sequence_start:sequence_start + length],
+                b"\n+\n",
+                quality_pool[quality_start:quality_start + length],
+                b"\n"])
+            output.write(record)
+            written += len(record)
+            records += 1
+    return records
+
+
+def benchmark_name(case: Dict[str, object]) -> str:
+    """A stable name for a benchmark case, used to match baselines."""
+    return ("{mode} n={number} b={buffer_size} c={compression_level} "
+            "t={threads_per_file}".format(**case))
+
+
+def run_case(input_file: str, input_size: int, output_dir: str,
+             case: Dict[str, object], repeats: int) -> Dict[str, object]:
+    """Time a benchmark case repeats times and return the result."""
+    number = case["number"]  # type: Any
+    compression_level = case["compression_level"]  # type: Any
+    round_robin = case["mode"] == "round-robin"
+    suffix = ".fq.gz" if compression_level > 0 else ".fq"
+    buffer_size = fastqsplitter.human_readable_to_int(
+        str(case["buffer_size"]))
+    times = []
+    for _ in range(repeats):
+        prefix = os.path.join(output_dir, "split.")
+        start = time.perf_counter()
+        output_files = fastqsplitter.fastqsplitter(
+            input=input_file,
+            number=number,
+            # Sequential mode creates number files of this size.
+            max_size=None if round_robin else input_size // number + 1,
+            prefix=prefix,
+            suffix=suffix,
+            buffer_size=buffer_size,
+            # Level 0 means uncompressed output files.
+            compression_level=max(compression_level, 1),
+            threads_per_file=case["threads_per_file"],  # type: ignore
+            round_robin=round_robin)
+        times.append(time.perf_counter() - start)
+        for output_file in output_files:
+            os.remove(output_file)
+    best = min(times)
+    return {"name": benchmark_name(case),
+            "parameters": case,
+            "times": times,
+            "best": best,
+            "mean": statistics.mean(times),
+            "throughput_mb_s": input_size / best / 1024 ** 2}
+
+
+def compare_with_baseline(results: List[Dict[str, Any]],
+                          baseline: Dict[str, Any],
+                          tolerance: float) -> List[str]:
+    """
+    Compare the best times with the baseline and print a table.
+    :return: The names of the benchmarks that are slower than the tolerance
+    allows.
+    """
+    baseline_times = {result["name"]: result["best"]
+                      for result in baseline["results"]}
+    regressions = []
+    for result in results:
+        baseline_time = baseline_times.get(result["name"])
+        if baseline_time is None:
+            print("{0:<50} {1:>8.3f}s {2:>9}".format(
+                result["name"], result["best"], "new"))
+            continue
+        ratio = result["best"] / baseline_time
+        print("{0:<50} {1:>8.3f}s {2:>8.2f}x".format(
+            result["name"], result["best"], ratio))
+        if ratio > 1 + tolerance:
+            regressions.append(result["name"])
+    return regressions
+
+
+def main(args: Optional[List[str]] = None) -> int:
+    parsed_args = argument_parser().parse_args(args)
+    workdir = tempfile.mkdtemp(dir=parsed_args.workdir)
+    try:
+        input_file = os.path.join(workdir, "synthetic.fq")
+        if parsed_args.input_compression_level is not None:
+            input_file += ".gz"
+        records = generate_fastq(
+            input_file, fastqsplitter.human_readable_to_int(parsed_args.size),
+            parsed_args.profile, parsed_args.seed,
+            parsed_args.input_compression_level)
+        with xopen.xopen(input_file, "rb") as input_handle:
+            input_size = sum(len(block) for block in iter(
+                lambda: input_handle.read(1024 * 1024), b""))
+        results = []
+        for mode, number, buffer_size, level, threads in itertools.product(
+                parsed_args.modes, parsed_args.numbers,
+                parsed_args.buffer_sizes, parsed_args.compression_levels,
+                parsed_args.threads_per_file):
+            case = {"mode": mode, "number": number,
+                    "buffer_size": buffer_size, "compression_level": level,
+                    "threads_per_file": threads}  # type: Dict[str, Any]
+            result = run_case(input_file, input_size, workdir, case,
+                              parsed_args.repeats)
+            print("{0:<50} {1:>8.3f}s {2:>8.1f} MiB/s".format(
+                result["name"], result["best"], result["throughput_mb_s"]),
+                file=sys.stderr)
+            results.append(result)
+    finally:
+        shutil.rmtree(workdir)
+
+    report = {
+        "machine": {"platform": platform.platform(),
+                    "processor": platform.processor(),
+                    "cpu_count": os.cpu_count(),
+                    "python": platform.python_version()},
+        "input": {"size": input_size, "records": records,
+                  "profile": parsed_args.profile, "seed": parsed_args.seed,
+                  "compression_level": parsed_args.input_compression_level},
+        "defaults": {"buffer_size": fastqsplitter.DEFAULT_BUFFER_SIZE,
+                     "threads_per_file":
+                         fastqsplitter.DEFAULT_THREADS_PER_FILE},
+        "results": results}
+    if parsed_args.output:
+        with open(parsed_args.output, "wt") as output_handle:
+            json.dump(report, output_handle, indent=2)
+    if parsed_args.baseline:
+        with open(parsed_args.baseline, "rt") as baseline_handle:
+            baseline = json.load(baseline_handle)
+        regressions = compare_with_baseline(results, baseline,
+                                            parsed_args.tolerance)
+        if regressions:
+            print("Slower than the baseline: {0}".format(
+                ", ".join(regressions)), file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
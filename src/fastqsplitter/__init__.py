@@ -26,16 +26,47 @@ algorith.
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import abc
 import argparse
+import bisect
+import bz2
+import collections
 import contextlib
+import errno
 import io
+import itertools
+import json
+import lzma
+import mmap
 import os
-from typing import List, Optional
+import queue
+import re
+import stat
+import struct
+import subprocess
+import sys
+import threading
+import time
+import warnings
+import zlib
+from concurrent import futures
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, \
+    Union
 
 # xopen opens files as normal files, gzip files, bzip2 files or xz files
 # depending on extension.
 import xopen
 
+try:
+    from isal import isal_zlib
+except ImportError:  # pragma: no cover
+    isal_zlib = None  # type: ignore
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
 # Choose 1 as default compression level. Speed is more important than filesize
 # in this application.
 DEFAULT_COMPRESSION_LEVEL = 1
@@ -51,15 +82,89 @@ DEFAULT_BUFFER_SIZE = 64 * 1024
 # TT. Default compression is 1. So default threads 1 makes the most sense.
 DEFAULT_THREADS_PER_FILE = 1
 DEFAULT_SUFFIX = ".fastq.gz"
+# Input is read in large chunks which are cut into blocks in memory.
+DEFAULT_READ_SIZE = 256 * 1024
+# Buffer sizes that are tried with --buffer-size auto, and the number of
+# bytes that is split with each of them.
+AUTO_BUFFER_SIZES = (16 * 1024, 32 * 1024, 64 * 1024, 128 * 1024,
+                     256 * 1024, 512 * 1024)
+AUTO_SAMPLE_SIZE = 8 * 1024 * 1024
+# Lines are counted in steps of this size before they are searched.
+COUNT_STEP_SIZE = 16 * 1024
+INDEX_SUFFIX = ".fqi"
+INDEX_VERSION = 1
+DEFAULT_INDEX_INTERVAL = 10000
+MANIFEST_VERSION = 1
+# When planning a split of compressed input, at most this many record aligned
+# positions are kept. When there are more, every other one is dropped.
+MAX_PLAN_POSITIONS = 64 * 1024
+# Passthrough splitting decompresses the gzip members at the edges of each
+# output file. It is only used when an output file is at least this many
+# members in size, or the members are not larger than the buffer size.
+PASSTHROUGH_MIN_MEMBERS_PER_FILE = 16
 STDIN = "/dev/stdin" if os.name == "posix" else None
+# The start of the input is compressed to estimate the compression ratio of
+# the output files when max_size is the compressed size.
+COMPRESSION_SAMPLE_SIZE = 4 * 1024 * 1024
+# Compressed file sizes are estimated, so aim slightly below max_size.
+COMPRESSED_SIZE_MARGIN = 0.97
+# Compression level assumed for compressed input files. This is the default
+# of gzip, bzip2 and xz.
+INPUT_COMPRESSION_LEVEL = 6
+# Records with a barcode that is not in the barcode table go to this sample.
+UNDETERMINED_SAMPLE = "undetermined"
+# A '/1' or '/2' mate suffix at the end of a read name, one name per line.
+MATE_SUFFIX = re.compile(rb"/[12]$", re.MULTILINE)
+# One input file or a list of input files that are read as one.
+InputFiles = Union[str, List[str]]
 SIZE_SUFFIXES = {"K": 1024 ** 1, "M": 1024 ** 2, "G": 1024 ** 3}
+# BGZF blocks should have at most 64K of compressed data. htslib uses 0xff00
+# as uncompressed block size to ensure this.
+BGZF_BLOCK_SIZE = 0xff00
+BGZF_HEADER_FORMAT = "<4BI2BH2BHH"
+BGZF_HEADER_SIZE = struct.calcsize(BGZF_HEADER_FORMAT)
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000"
+                         "000000")
+# When splitting multiple input files, this many files after the current one
+# are decompressed in the background.
+DEFAULT_PREFETCH_FILES = 1
+# The maximum number of chunks of DEFAULT_READ_SIZE that are decompressed
+# ahead per file.
+PREFETCH_CHUNKS = 16
+# Queue depth used for the least busy distribution when none is given.
+DEFAULT_QUEUE_DEPTH = 8
+# Seconds between attempts to open a named pipe while waiting for a reader.
+FIFO_POLL_INTERVAL = 0.01
+# How far the number of records in an output may be above the lowest number
+# of records in any output, as a fraction of the mean, when distributing
+# blocks to the least busy output.
+DEFAULT_BALANCE_TOLERANCE = 0.05
+COMPRESSED_EXTENSIONS = (".gz", ".bgz", ".bz2", ".xz", ".zst")
+# When decompressing BGZF input in parallel, each thread decompresses about
+# this many compressed bytes of blocks at a time.
+PARALLEL_DECOMPRESSION_BATCH_SIZE = 1024 * 1024
+# bzip2 input is only decompressed in parallel when a second stream starts
+# within this many bytes. pbzip2 starts a stream every 900K of input.
+BZIP2_DETECTION_SIZE = 4 * 1024 * 1024
 
 
 def argument_parser() -> argparse.ArgumentParser:
     """Argument parser for the fastqsplitter application"""
     parser = argparse.ArgumentParser()
-    parser.add_argument("input", type=str, default=STDIN, nargs="?",
-                        help="The fastq file to be scattered.")
+    parser.add_argument("input", type=str, default=[STDIN], nargs="*",
+                        help="The fastq file to be scattered. When multiple "
+                             "files are given, they are split as if they "
+                             "were concatenated. The next file is "
+                             "decompressed in the background while the "
+                             "current file is split.")
+    parser.add_argument("-2", "--input-r2", type=str, action="append",
+                        help="The second read (R2) fastq file of a paired-end "
+                             "pair. The records of both files are split in "
+                             "lockstep. Output files will be named "
+                             "<prefix><number>.R1<suffix> and "
+                             "<prefix><number>.R2<suffix>. With multiple "
+                             "input files, give this option once for each "
+                             "input file.")
     parser.add_argument("-p", "--prefix", type=str,
                         help="The prefix for the output files.")
     parser.add_argument("-s", "--suffix", type=str, default=DEFAULT_SUFFIX,
@@ -79,6 +184,11 @@ def argument_parser() -> argparse.ArgumentParser:
              "used. '.gz' for gzip, '.bz2' for bzip2, '.xz' for xz. Other "
              "extensions will use no compression. Fastq records will be "
              "distributed using a round-robin method.")
+    output_group.add_argument(
+        "-R", "--records", type=int,
+        help="Write this many fastq records to each output file. Output "
+             "files are created sequentially. The last file may contain "
+             "less records.")
     output_group.add_argument(
         "-m", "--max-size", type=str,
         help="In round robin mode, determines the number of output files by "
@@ -88,8 +198,50 @@ def argument_parser() -> argparse.ArgumentParser:
              "between input and output files, this will not work properly. "
              "In sequential mode this is the maximum number of bytes written "
              "to each output file. NOTE: This is the size *before* "
-             "compression (if applied). As a rule of thumb multiply by 0.38 "
-             "to get the actual filesize when using gzip compression.")
+             "compression (if applied), unless --compressed-max-size is "
+             "used.")
+
+    parser.add_argument(
+        "--compressed-max-size", action="store_true",
+        help="Use --max-size as the size of the output files on disk, after "
+             "compression. The compression ratio is estimated by compressing "
+             "the start of the input. In sequential mode the real ratio of "
+             "each written file is used for the next file, and files are "
+             "aimed at {0:.0f}%% of the maximum size to stay below it. "
+             "Requires --max-size."
+             "".format(COMPRESSED_SIZE_MARGIN * 100))
+
+    parser.add_argument(
+        "--output-r2", action="append", type=str,
+        help="R2 output files when -o is used in paired-end mode. Must be "
+             "given as many times as -o.")
+
+    parser.add_argument("--barcodes", type=str,
+                        help="Demultiplex and split in one pass. A table "
+                             "with a barcode and a sample name on each line. "
+                             "The barcode of each record is read from the "
+                             "last ':' separated field of its header. The "
+                             "records of each sample are split over -n "
+                             "files, or files of at most -m bytes, named "
+                             "<prefix><sample>.<number><suffix>. Records "
+                             "with an unknown barcode go to the sample "
+                             "'{0}'.".format(UNDETERMINED_SAMPLE))
+    parser.add_argument("--hash-by-name", action="store_true",
+                        help="Write each record to output number "
+                             "crc32(read name) %% number of outputs. A read "
+                             "always goes to the same output number, so R1 "
+                             "and R2 files, or the same file on different "
+                             "machines, can be split independently. A '/1' "
+                             "or '/2' suffix of the read name is ignored. "
+                             "Only in round-robin mode and not with "
+                             "--records or --least-busy.")
+    parser.add_argument("-r", "--byte-ranges", action="store_true",
+                        help="Split an uncompressed input file into "
+                             "contiguous byte ranges, one per output file, "
+                             "which are written in parallel by separate "
+                             "processes. Records are not distributed "
+                             "round-robin in this mode. Cannot be combined "
+                             "with --sequential.")
 
     # What is a good one-letter symbol for --no-round-robin?
     parser.add_argument("-S", "--sequential", action="store_false",
@@ -110,14 +262,227 @@ def argument_parser() -> argparse.ArgumentParser:
                              "fastqsplitter in single-threaded mode choose "
                              "0. Default={0}."
                              "".format(DEFAULT_THREADS_PER_FILE))
+    parser.add_argument("-j", "--compression-threads", type=int, default=0,
+                        help="Compress '.gz' output files in-process on a "
+                             "shared pool of this many threads instead of "
+                             "using one compression process per output file. "
+                             "Each block is written as a separate gzip "
+                             "member. This uses far less memory and processes "
+                             "when splitting over many files. Default=0 "
+                             "(disabled).")
+    parser.add_argument("--decompression-threads", type=int, default=0,
+                        help="Decompress the input on this many threads in "
+                             "parallel when it consists of independently "
+                             "compressed blocks: BGZF files, such as those "
+                             "written by bcl2fastq, and bzip2 files with "
+                             "multiple streams, such as those written by "
+                             "pbzip2. Other input files are decompressed as "
+                             "usual. Default=0 (disabled).")
+    parser.add_argument("-q", "--queue-depth", type=int, default=0,
+                        help="In round-robin mode, write each output file "
+                             "from its own thread. Blocks of records are "
+                             "passed to each thread through a queue of at "
+                             "most this many blocks, so a slow output only "
+                             "stalls the splitting when its queue is full. "
+                             "Memory use is at most the queue depth times "
+                             "the number of output files times the block "
+                             "size. Default=0 (disabled).")
+    parser.add_argument("--least-busy", action="store_true",
+                        help="Instead of round-robin, write each block of "
+                             "records to the output with the least blocks "
+                             "waiting in its queue. The split then runs at "
+                             "the combined speed of all outputs instead of "
+                             "the speed of the slowest one. Uses a queue "
+                             "depth of {0} unless --queue-depth is given. "
+                             "Only available in round-robin mode."
+                             "".format(DEFAULT_QUEUE_DEPTH))
+    parser.add_argument("--balance-tolerance", type=float,
+                        default=DEFAULT_BALANCE_TOLERANCE,
+                        help="With --least-busy, the number of records in "
+                             "each output stays within this fraction of the "
+                             "mean of the output with the least records. "
+                             "Default={0}.".format(DEFAULT_BALANCE_TOLERANCE))
+    parser.add_argument("--max-open-files", type=int, default=0,
+                        metavar="K",
+                        help="In round-robin mode, keep at most K output "
+                             "files open. When another output is written, "
+                             "the least recently written one is closed. It "
+                             "is opened again in append mode when needed, "
+                             "so gzip output files then consist of multiple "
+                             "members. The files are compressed in-process, "
+                             "or on the --compression-threads, instead of "
+                             "by separate processes. Useful when splitting "
+                             "into thousands of files. Default=0 (all files "
+                             "open).")
+    parser.add_argument("--fifo", action="store_true",
+                        help="Create the output files as named pipes, so "
+                             "other programs can read the parts while they "
+                             "are written. Each pipe is written by its own "
+                             "thread, so the readers can connect in any "
+                             "order. Round-robin mode only. Uses a queue "
+                             "depth of {0} unless --queue-depth is given."
+                             "".format(DEFAULT_QUEUE_DEPTH))
+    parser.add_argument("--exec", type=str, dest="exec_command",
+                        metavar="COMMAND",
+                        help="Instead of writing output files, start a "
+                             "shell command for every output and write its "
+                             "records uncompressed to the stdin of the "
+                             "command. {} in the command is replaced with "
+                             "the output number. For example: --exec 'bwa "
+                             "mem ref.fa - > out.{}.sam'. Round-robin mode "
+                             "only. Exits with the exit status of a failed "
+                             "command.")
+    parser.add_argument("--journal", type=str, metavar="FILE",
+                        help="In sequential mode, record every completed "
+                             "output file with its input offsets and number "
+                             "of records in this file.")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue an interrupted sequential split after "
+                             "the last output file in --journal instead of "
+                             "starting over. Use the same input and "
+                             "settings as the interrupted run.")
+    parser.add_argument("--passthrough", action="store_true",
+                        help="In sequential mode, for a gzip input file "
+                             "with multiple members, such as a BGZF file, "
+                             "and gzip output files: copy the members that "
+                             "are completely inside an output file as they "
+                             "are. Only the members at the edges of the "
+                             "output files are decompressed and compressed "
+                             "again. The compression level only applies to "
+                             "those members. Cannot be combined with "
+                             "--stats or with compression or decompression "
+                             "threads.")
+    parser.add_argument("--bgzf", action="store_true",
+                        help="Write '.gz' output files in BGZF (blocked "
+                             "gzip) format. A '.gzi' index of block offsets "
+                             "that start at a fastq record is written next "
+                             "to each output file. The index format is the "
+                             "same as that of 'bgzip --reindex'.")
+    parser.add_argument("-I", "--use-index", action="store_true",
+                        help="Use the index created with 'fastqsplitter "
+                             "index'. Uncompressed input files are split in "
+                             "contiguous parts with an equal number of "
+                             "records without reading the whole input. With "
+                             "--max-size the number of output files is based "
+                             "on the number of records and the uncompressed "
+                             "size in the index. In round-robin mode "
+                             "compressed input files are then split "
+                             "sequentially in files of whole index intervals "
+                             "that are at most --max-size.")
+    parser.add_argument("--stats", type=str,
+                        help="Write statistics of the split as JSON to this "
+                             "file. These are the bytes and records read, "
+                             "the bytes, compressed bytes, blocks and records "
+                             "per output file, the time spent reading, "
+                             "finding record boundaries and writing "
+                             "(including waiting for compression) and the "
+                             "overall throughput. Uncompressed files are "
+                             "then not copied by the kernel, which can make "
+                             "the split slower.")
     parser.add_argument("-P", "--print", action="store_true",
                         help="Print output files to stdout for easier usage "
                              "in scripts.")
 
-    # BELOW ARGUMENTS ARE FOR BENCHMARKING AND TESTING PURPOSES
     parser.add_argument("-b", "--buffer-size", type=str,
                         default=str(DEFAULT_BUFFER_SIZE),
-                        help=argparse.SUPPRESS)
+                        help="The granularity with which records are "
+                             "distributed and the size of reads and writes, "
+                             "for example 64K. 'auto' tries several sizes on "
+                             "the first part of the input and uses the "
+                             "fastest for the rest. The chosen size is "
+                             "printed to stderr. Uncompressed input that the "
+                             "kernel copies directly to uncompressed output "
+                             "files is not read through a buffer, so no size "
+                             "is chosen. Default={0}."
+                             "".format(DEFAULT_BUFFER_SIZE))
+    return parser
+
+
+def index_argument_parser() -> argparse.ArgumentParser:
+    """Argument parser for the fastqsplitter index command"""
+    parser = argparse.ArgumentParser(
+        prog="fastqsplitter index",
+        description="Create an index of a fastq file with the number of "
+                    "records and the offsets of every Nth record. The index "
+                    "is used by fastqsplitter with --use-index.")
+    parser.add_argument("input", type=str,
+                        help="The fastq file to be indexed.")
+    parser.add_argument("-o", "--output", type=str,
+                        help="The index file. Default: <input>{0}."
+                             "".format(INDEX_SUFFIX))
+    parser.add_argument("-i", "--interval", type=int,
+                        default=DEFAULT_INDEX_INTERVAL,
+                        help="Store the offset of every Nth record. Smaller "
+                             "values make the index larger and splitting "
+                             "faster. Default={0}."
+                             "".format(DEFAULT_INDEX_INTERVAL))
+    parser.add_argument("-t", "--threads", type=int,
+                        default=DEFAULT_THREADS_PER_FILE,
+                        help="The number of threads used for decompressing "
+                             "the input. Default={0}."
+                             "".format(DEFAULT_THREADS_PER_FILE))
+    return parser
+
+
+def plan_argument_parser() -> argparse.ArgumentParser:
+    """Argument parser for the fastqsplitter plan command"""
+    parser = argparse.ArgumentParser(
+        prog="fastqsplitter plan",
+        description="Plan a split of a fastq file into contiguous, record "
+                    "aligned ranges and write them to a manifest. Each range "
+                    "can be extracted independently with 'fastqsplitter "
+                    "extract', for instance on different nodes of a "
+                    "cluster. Uncompressed and BGZF files are not read "
+                    "completely, other files are read once.")
+    parser.add_argument("input", type=str,
+                        help="The fastq file to be split. Use a path that "
+                             "is valid wherever the ranges are extracted.")
+    parser.add_argument("-o", "--output", type=str, required=True,
+                        help="The manifest file.")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("-n", "--number", type=int,
+                       help="The number of ranges.")
+    group.add_argument("-m", "--max-size", type=str,
+                       help="The maximum uncompressed size of each range. "
+                            "Accepts K, M and G suffixes.")
+    parser.add_argument("-t", "--threads", type=int,
+                        default=DEFAULT_THREADS_PER_FILE,
+                        help="The number of threads used for decompressing "
+                             "the input. Default={0}."
+                             "".format(DEFAULT_THREADS_PER_FILE))
+    return parser
+
+
+def extract_argument_parser() -> argparse.ArgumentParser:
+    """Argument parser for the fastqsplitter extract command"""
+    parser = argparse.ArgumentParser(
+        prog="fastqsplitter extract",
+        description="Write one range of a manifest created with "
+                    "'fastqsplitter plan' to a file.")
+    parser.add_argument("--manifest", type=str, required=True,
+                        help="The manifest file.")
+    parser.add_argument("--shard", type=int, required=True,
+                        help="The number of the range, starting at 0.")
+    parser.add_argument("-o", "--output", type=str, required=True,
+                        help="The output file. '.gz' files are gzip "
+                             "compressed.")
+    parser.add_argument("-c", "--compression-level", type=int,
+                        default=DEFAULT_COMPRESSION_LEVEL,
+                        help="Only applicable when output files have a '.gz' "
+                             "extension. Default={0}."
+                             "".format(DEFAULT_COMPRESSION_LEVEL))
+    parser.add_argument("-t", "--threads-per-file", type=int,
+                        default=DEFAULT_THREADS_PER_FILE,
+                        help="Set the number of compression threads per "
+                             "output file. Default={0}."
+                             "".format(DEFAULT_THREADS_PER_FILE))
+    parser.add_argument("--bgzf", action="store_true",
+                        help="Write a '.gz' output file in BGZF format with "
+                             "a '.gzi' index.")
+    parser.add_argument("--passthrough", action="store_true",
+                        help="For BGZF input and a '.gz' output file, copy "
+                             "the blocks inside the range as they are. Only "
+                             "the blocks at the edges are compressed again.")
     return parser
 
 
@@ -132,6 +497,89 @@ def human_readable_to_int(number_string: str) -> int:
     return int(number_string)
 
 
+class BufferSizeTuner(object):
+    """
+    Finds the buffer size with the highest throughput at the start of a run.
+    Every candidate size is used for sample_size bytes, after a warm-up with
+    the default buffer size. Then the fastest size is used for the rest of
+    the run. Pass an instance as buffer_size to the splitting functions and
+    read chosen_size afterwards.
+    """
+
+    def __init__(self, candidates: Tuple[int, ...] = AUTO_BUFFER_SIZES,
+                 sample_size: int = AUTO_SAMPLE_SIZE):
+        self.candidates = candidates
+        self.sample_size = sample_size
+        self.throughputs = {}  # type: dict
+        self.size = DEFAULT_BUFFER_SIZE
+        # -1 is the warm-up.
+        self.candidate_index = -1
+        self.done = False
+        self.sample_bytes = 0
+        self.sample_start = None  # type: Optional[float]
+
+    def update(self, size: int) -> int:
+        """
+        Register that a buffer of size bytes was processed.
+        :return: The buffer size that should be used next.
+        """
+        if self.done:
+            return self.size
+        now = time.perf_counter()
+        if self.sample_start is None:
+            # The time before the first buffer is unknown.
+            self.sample_start = now
+            return self.size
+        self.sample_bytes += size
+        if self.sample_bytes >= self.sample_size:
+            if self.candidate_index >= 0:
+                self.throughputs[self.size] = (
+                    self.sample_bytes / max(now - self.sample_start, 1e-9))
+            self.candidate_index += 1
+            if self.candidate_index == len(self.candidates):
+                self.size = self.chosen_size
+                self.done = True
+            else:
+                self.size = self.candidates[self.candidate_index]
+            self.sample_bytes = 0
+            self.sample_start = now
+        return self.size
+
+    def limit(self, maximum: int) -> None:
+        """Do not use buffer sizes larger than maximum."""
+        self.candidates = tuple(candidate for candidate in self.candidates
+                                if candidate <= maximum)
+        self.size = min(self.size, maximum)
+
+    @property
+    def tuned(self) -> bool:
+        """
+        Whether the throughput of a candidate was measured. This is not the
+        case if the input was too small or not read through the buffer, for
+        instance because the kernel copied it.
+        """
+        return bool(self.throughputs)
+
+    @property
+    def chosen_size(self) -> int:
+        """The fastest size so far. The default size if none was measured."""
+        if not self.throughputs:
+            return self.size
+        return max(self.throughputs, key=lambda size: self.throughputs[size])
+
+
+# A fixed buffer size or a tuner that determines it during the run.
+BufferSize = Union[int, BufferSizeTuner]
+
+
+def _buffer_size_tuner(buffer_size: BufferSize
+                       ) -> Tuple[int, Optional[BufferSizeTuner]]:
+    """Return the initial buffer size and the tuner, if any."""
+    if isinstance(buffer_size, BufferSizeTuner):
+        return buffer_size.size, buffer_size
+    return buffer_size, None
+
+
 def _read_until_new_fastq_record(input_handle: io.BufferedReader) -> bytes:
     """
     Reads the input handle until the start of a fastq record or has
@@ -167,212 +615,3622 @@ def _read_until_new_fastq_record(input_handle: io.BufferedReader) -> bytes:
                         return b"".join(missing_record_lines)
 
 
-def split_fastqs_round_robin(
-        input_file: str, output_files: List[str],
-        compression_level: int = DEFAULT_COMPRESSION_LEVEL,
-        buffer_size: int = DEFAULT_BUFFER_SIZE,
-        threads_per_file: int = DEFAULT_THREADS_PER_FILE) -> None:
+# Byte values for checking single characters in bytes, mmaps and memoryviews.
+AT = ord("@")
+PLUS = ord("+")
+
+
+def _find_record_boundary(data: Any, position: int, eof: bool = True) -> int:
     """
-    Split a fastq file over multiple output files in a round robin fashion.
-    :param input_file: The file to be split.
-    :param output_files: The files receiving the split parts
-    :param compression_level: Which compression level to use if applicable
-    :param buffer_size: The buffer size. The granularity at which fastq records
-    are distributed.
-    :param threads_per_file: How many threads xopen should use to open the
-    file.
+    Find the start of a new fastq record in data, starting the search at
+    position. The same rules as in _read_until_new_fastq_record are used, so
+    the same position is found. Lines are searched with find and no objects
+    are created for them, so this is much faster.
+    :param data: bytes, a memoryview or a mmap.
+    :param position: The position where to start searching.
+    :param eof: Whether the end of data is the end of the file.
+    :return: The position of the new record. The end of data if no record is
+    found and eof is True. -1 if more data is needed to find the record.
     """
-    if len(output_files) < 1:
-        raise ValueError("The number of output files should be at least 1.")
-    if buffer_size < 1024:
-        # This value is arbitrary, but really low values such as 5 or 30 don't
-        # make sense.
-        raise ValueError("The buffer size should be at least 1024.")
+    size = len(data)
+    need_more = size if eof else -1
+    while True:
+        if position >= size:
+            return need_more
+        if data[position] != AT:
+            # Skip all lines that do not start with '@' at once.
+            position = data.find(b"\n@", position) + 1
+            if position == 0:
+                return need_more
+        sequence_start = data.find(b"\n", position) + 1
+        plus_start = data.find(b"\n", sequence_start) + 1
+        if sequence_start == 0 or plus_start == 0:
+            return need_more
+        if not data[sequence_start:plus_start].strip().isalpha():
+            position = plus_start
+            continue
+        quality_start = data.find(b"\n", plus_start) + 1
+        if quality_start == 0:
+            return need_more
+        if data[plus_start] != PLUS:
+            position = quality_start
+            continue
+        record_end = data.find(b"\n", quality_start) + 1
+        if record_end == 0:
+            return need_more
+        if record_end == size and not eof:
+            return -1  # We need to know whether a new record starts here.
+        lengths_match = (record_end - quality_start ==
+                         plus_start - sequence_start)
+        if lengths_match and record_end < size and data[record_end] == AT:
+            return record_end
+        position = record_end
 
-    # contextlib.Exitstack allows us to open multiple files at once which
-    # are automatically closed on error.
-    # https://stackoverflow.com/questions/19412376/open-a-list-of-files-using-with-as-context-manager
-    with contextlib.ExitStack() as stack:
-        input_handle = stack.enter_context(
-            xopen.xopen(input_file, mode='rb', threads=threads_per_file))
-        output_handles = [stack.enter_context(xopen.xopen(
-                filename=output_file,
-                mode='wb',
-                compresslevel=compression_level,
-                threads=threads_per_file
-            )) for output_file in output_files
-        ]  # type: List[io.BufferedWriter]
 
-        group_number = 0
-        number_of_output_files = len(output_files)
+class _FastqBlockReader(object):
+    """
+    Reads record aligned blocks from a file handle. The input is read in
+    large chunks and cut with _find_record_boundary.
+    """
+
+    def __init__(self, input_handle: io.BufferedReader,
+                 read_size: int = DEFAULT_READ_SIZE,
+                 stats: Optional["SplitStatistics"] = None):
+        self.input_handle = input_handle
+        self.read_size = read_size
+        self.data = b""
+        self.position = 0
+        self.eof = False
+        self.stats = stats
+
+    def _read_more(self) -> bool:
+        """Read a new chunk. Returns False at EOF."""
+        if self.eof:
+            return False
+        chunk = self.input_handle.read(self.read_size)
+        if chunk == b"":
+            self.eof = True
+            return False
+        self.data = self.data[self.position:] + chunk
+        self.position = 0
+        return True
 
+    def read(self, size: int) -> bytes:
+        """Read size bytes or less at EOF. No record boundaries are used."""
+        while len(self.data) - self.position < size and self._read_more():
+            pass
+        block = self.data[self.position:self.position + size]
+        self.position += len(block)
+        return block
+
+    def read_block(self, size: int) -> bytes:
+        """
+        Read size bytes and all the bytes until the start of the next record.
+        This is the same as a read of size bytes followed by
+        _read_until_new_fastq_record.
+        """
+        data, start, end = self.next_block(size)
+        return data[start:end]
+
+    def next_block(self, size: int) -> Tuple[bytes, int, int]:
+        """
+        Like read_block, but return the data that contains the block and the
+        start and end of the block in it, so the block does not have to be
+        copied. The data is not changed by later reads.
+        """
         while True:
-            read_buffer = input_handle.read(buffer_size)
-            if read_buffer == b"":
-                return
+            start = time.perf_counter() if self.stats is not None else 0.0
+            boundary = _find_record_boundary(
+                self.data, self.position + size, self.eof)
+            if self.stats is not None:
+                self.stats.scan_time = (self.stats.scan_time or 0.0) + (
+                    time.perf_counter() - start)
+            if boundary != -1:
+                break
+            self._read_more()
+        start = self.position
+        self.position = boundary
+        return self.data, start, boundary
 
-            # Read the input until the start of a new record.
-            completed_record = _read_until_new_fastq_record(input_handle)
-            output_handles[group_number].write(read_buffer + completed_record)
-            # Set the group number for the next group to be written.
-            group_number += 1
-            # cycle back to the start when we have written the last file.
-            if group_number == number_of_output_files:
-                group_number = 0
+    def at_eof(self) -> bool:
+        """Return True if all data has been read."""
+        return self.position == len(self.data) and not self._read_more()
 
 
-def _sequential_splitter(input_handle: io.BufferedReader,
-                         output_handle: io.BufferedReader,
-                         max_size: int,
-                         buffer_size: int = DEFAULT_BUFFER_SIZE) -> int:
+@contextlib.contextmanager
+def _mmap_file(file_handle: io.BufferedReader) -> Iterator[Any]:
     """
-    Reads max_size bytes from an input_handle and writes it to output_handle
-    reading buffer_size bytes at the time. Ensures a complete fastq record
-    is at the end of each file.
-    :return: The number of bytes written.
+    Memory map a file for reading. Empty files can not be mapped, for those
+    an empty bytes object is used.
     """
-    target_size = max_size - buffer_size
-    total_size = 0
+    if os.fstat(file_handle.fileno()).st_size == 0:
+        yield b""
+        return
+    with mmap.mmap(file_handle.fileno(), 0,
+                   access=mmap.ACCESS_READ) as mapped:
+        yield mapped
+
+
+class _MateReader(object):
+    """
+    Reads the mate (R2) file of a paired-end pair in lockstep with the R1
+    file. Instead of checking records, lines are counted, so the records in
+    R1 and R2 are always cut at the same record index. Bytes read beyond the
+    cut are kept for the next block.
+    """
+
+    def __init__(self, input_handle: io.BufferedReader):
+        self.input_handle = input_handle
+        self.leftover = b""
+        # The number of bytes returned by read_matching.
+        self.offset = 0
+        # R2 reads can have a different length than R1 reads. The ratio of
+        # the previous block is used to estimate how much should be read.
+        self.size_ratio = 1.0
+
+    def read_matching(self, block: bytes, at_eof: bool = False) -> bytes:
+        """
+        Read as many complete lines from the mate file as there are in block.
+        :param block: A block from the R1 file.
+        :param at_eof: Whether the R1 file is at EOF after this block. In that
+        case a final line without a newline is counted as well.
+        :return: The corresponding lines from the R2 file.
+        """
+        number_of_lines = block.count(b"\n")
+        if at_eof and block and not block.endswith(b"\n"):
+            number_of_lines += 1
+        data = self.leftover
+        size_hint = int(len(block) * self.size_ratio)
+        if len(data) < size_hint:
+            data += self.input_handle.read(size_hint - len(data))
+        line_count = data.count(b"\n")
+        while line_count < number_of_lines:
+            # Read in small steps, so only a few lines have to be pushed back.
+            extra = self.input_handle.read(len(block) // 16 + 1024)
+            if extra == b"":  # EOF
+                if data and not data.endswith(b"\n"):
+                    line_count += 1
+                if line_count < number_of_lines:
+                    raise ValueError("The R2 file contains fewer records than "
+                                     "the R1 file.")
+                self.leftover = b""
+                self.offset += len(data)
+                return data
+            line_count += extra.count(b"\n")
+            data += extra
+        # Find the cut position by searching back from the end. There are
+        # usually only a few excess lines.
+        cut = len(data)
+        for _ in range(line_count - number_of_lines + 1):
+            cut = data.rfind(b"\n", 0, cut)
+        cut += 1
+        self.leftover = data[cut:]
+        if block:
+            self.size_ratio = cut / len(block)
+        self.offset += cut
+        return data[:cut]
+
+    def check_eof(self) -> None:
+        """Raise an error if the mate file has data left."""
+        if self.leftover or self.input_handle.read(1) != b"":
+            raise ValueError("The R2 file contains more records than the R1 "
+                             "file.")
+
+
+def paired_filenames(prefix: str, number: int, suffix: str
+                     ) -> Tuple[str, str]:
+    """
+    Return the R1 and R2 output filenames for a paired-end split part.
+    """
+    return (prefix + str(number) + ".R1" + suffix,
+            prefix + str(number) + ".R2" + suffix)
+
+
+def _zlib_module(compression_level: int) -> Any:
+    """
+    Return the module used for compression. ISA-L only has levels 0-3 but is
+    much faster than zlib. Both release the GIL while compressing.
+    """
+    if isal_zlib is not None and compression_level <= 3:
+        return isal_zlib
+    return zlib
+
+
+class _ChunkedReader(abc.ABC):
+    """
+    Base class for readers that produce their data in chunks. Subclasses
+    implement _next_chunk. The unread part of the last chunk starts at
+    offset in buffer, so small reads do not copy the rest of the chunk.
+    """
+    buffer = b""
+    offset = 0
+
+    @abc.abstractmethod
+    def _next_chunk(self) -> bytes:
+        """Return the next chunk of data, or b"" at the end of the data."""
+
+    def read(self, size: int = -1) -> bytes:
+        if 0 <= size <= len(self.buffer) - self.offset:
+            data = self.buffer[self.offset:self.offset + size]
+            self.offset += size
+            return data
+        parts = [self.buffer[self.offset:]]
+        available = len(parts[0])
+        while size < 0 or available < size:
+            chunk = self._next_chunk()
+            if chunk == b"":
+                break
+            parts.append(chunk)
+            available += len(chunk)
+        if size < 0 or available <= size:
+            self.buffer = b""
+            self.offset = 0
+            return b"".join(parts)
+        # Only the start of the last chunk is returned.
+        self.buffer = parts.pop()
+        self.offset = len(self.buffer) - (available - size)
+        parts.append(self.buffer[:self.offset])
+        return b"".join(parts)
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class _ConcatenatedReader(_ChunkedReader):
+    """
+    Reads multiple files as if they were one concatenated file. Every file is
+    read and decompressed in a background thread into a bounded queue. The
+    next files are started before the current one is finished, so their
+    decompression runs in parallel with the splitting of the current file.
+    """
+
+    def __init__(self, input_files: List[str],
+                 threads: int = DEFAULT_THREADS_PER_FILE,
+                 prefetch_files: int = DEFAULT_PREFETCH_FILES,
+                 chunk_size: int = DEFAULT_READ_SIZE,
+                 decompression_threads: int = 0):
+        self.input_files = collections.deque(input_files)
+        self.threads = threads
+        self.decompression_threads = decompression_threads
+        self.chunk_size = chunk_size
+        self.queues = collections.deque()  # type: collections.deque
+        self.closed = False
+        for _ in range(prefetch_files + 1):
+            self._start_next_file()
+
+    def _start_next_file(self) -> None:
+        if not self.input_files:
+            return
+        chunk_queue = queue.Queue(PREFETCH_CHUNKS)  # type: queue.Queue
+        thread = threading.Thread(
+            target=self._read_file, args=(self.input_files.popleft(),
+                                          chunk_queue), daemon=True)
+        thread.start()
+        self.queues.append(chunk_queue)
+
+    def _read_file(self, input_file: str, chunk_queue: queue.Queue) -> None:
+        """Put the chunks of the file on the queue. b"" marks the end."""
+        try:
+            with _open_input_file(input_file, self.threads,
+                                  self.decompression_threads
+                                  ) as input_handle:
+                while not self.closed:
+                    chunk = input_handle.read(self.chunk_size)
+                    chunk_queue.put(chunk)
+                    if chunk == b"":
+                        return
+        except Exception as error:  # Raised again in the reading thread.
+            chunk_queue.put(error)
+
+    def _next_chunk(self) -> bytes:
+        """Get the next chunk of data. Returns b"" when all files are read."""
+        while self.queues:
+            chunk = self.queues[0].get()
+            if isinstance(chunk, Exception):
+                raise chunk
+            if chunk:
+                return chunk
+            self.queues.popleft()
+            self._start_next_file()
+        return b""
+
+    def close(self) -> None:
+        self.closed = True
+        # Empty the queues so the threads are not blocked and can stop.
+        for chunk_queue in self.queues:
+            while not chunk_queue.empty():
+                chunk_queue.get_nowait()
+
+
+def _decompress_bgzf_blocks(data: bytes) -> bytes:
+    """Decompress consecutive complete BGZF blocks and check them."""
+    zlib_module = isal_zlib or zlib
+    view = memoryview(data)
+    parts = []
+    offset = 0
+    while offset < len(data):
+        block_end = offset + struct.unpack_from(
+            BGZF_HEADER_FORMAT, data, offset)[11] + 1
+        # The block ends with the crc32 and the uncompressed size.
+        crc, size = struct.unpack_from("<II", data, block_end - 8)
+        block = zlib_module.decompress(
+            view[offset + BGZF_HEADER_SIZE:block_end - 8], -15)
+        if len(block) != size or zlib_module.crc32(block) != crc:
+            raise ValueError("BGZF block with an incorrect checksum or size.")
+        parts.append(block)
+        offset = block_end
+    return b"".join(parts)
+
+
+def _bgzf_batches(input_handle: io.BufferedReader) -> Iterator[bytes]:
+    """
+    Read complete BGZF blocks in batches of about
+    PARALLEL_DECOMPRESSION_BATCH_SIZE compressed bytes. Only the headers are
+    parsed, nothing is decompressed.
+    """
+    data = b""
     while True:
-        read_buffer = input_handle.read(buffer_size)
-        if read_buffer == b"":
-            return total_size
-        output_handle.write(read_buffer)
-        total_size += buffer_size
-        if total_size >= target_size:
-            # Complete the record
-            completed_record = _read_until_new_fastq_record(input_handle)
-            output_handle.write(completed_record)
-            return total_size + len(completed_record)
+        chunk = input_handle.read(PARALLEL_DECOMPRESSION_BATCH_SIZE)
+        data += chunk
+        offset = 0
+        while offset + BGZF_HEADER_SIZE <= len(data):
+            fields = struct.unpack_from(BGZF_HEADER_FORMAT, data, offset)
+            if (fields[:4] != (31, 139, 8, 4) or
+                    fields[8:10] != (ord("B"), ord("C"))):
+                raise ValueError("No BGZF block at this position. Only "
+                                 "files that consist of BGZF blocks can be "
+                                 "decompressed in parallel.")
+            block_end = offset + fields[11] + 1
+            if block_end > len(data):
+                break
+            offset = block_end
+        if offset:
+            yield data[:offset]
+            data = data[offset:]
+        if chunk == b"":
+            if data:
+                raise EOFError("The file ends in the middle of a BGZF "
+                               "block.")
+            return
 
 
-def split_fastqs_sequentially(
-        input_file: str,
-        max_size: int,
-        prefix: str = "split.",
-        suffix: str = DEFAULT_SUFFIX,
-        buffer_size: int = DEFAULT_BUFFER_SIZE,
-        compression_level: int = DEFAULT_COMPRESSION_LEVEL,
-        threads_per_file: int = DEFAULT_THREADS_PER_FILE) -> List[str]:
+def _bzip2_stream_start(data: bytes, start: int) -> int:
     """
-    Read an input file and create a new split output file for every
-    max_size bytes read.
-    :param input_file: The input fastq
-    :param max_size: The maximum size of bytes that should be in the output
-    files.
-    :param prefix: Prefix for the output files.
-    :param suffix: Suffix for the output files.
-    :param buffer_size: How much data should be read at once.
-    :param compression_level: The compression level if a '.gz' suffix is used.
-    :param threads_per_file: The number of compressen threads per file.
-    :return: A list of written files.
+    Find the offset of the first bzip2 stream at or after start, or -1. A
+    stream starts with 'BZh', the block size and the magic number of its
+    first block.
     """
-    if max_size < buffer_size:
-        raise ValueError("Maximum size {0} should be larger than buffer size "
-                         "{1}.".format(max_size, buffer_size))
+    while True:
+        magic = data.find(b"1AY&SY", start + 4)
+        if magic == -1:
+            return -1
+        if (data[magic - 4:magic - 1] == b"BZh" and
+                data[magic - 1:magic] in b"123456789"):
+            return magic - 4
+        start = magic - 3
 
-    with xopen.xopen(input_file, mode="rb", threads=threads_per_file
-                     ) as input_fastq:
-        group_number = 0
-        written_files = []  # type: List[str]
+
+def _bzip2_streams(input_handle: io.BufferedReader) -> Iterator[bytes]:
+    """
+    Read concatenated bzip2 streams, as written by pbzip2, one at a time.
+    The streams are found by their start, nothing is decompressed.
+    """
+    data = b""
+    # No stream starts before this offset, except the one at offset 0.
+    searched = 1
+    while True:
+        chunk = input_handle.read(DEFAULT_READ_SIZE)
+        data += chunk
         while True:
-            if input_fastq.peek(0) == b"":  # Quit if there are no bytes left
-                return written_files
-            filename = prefix + str(group_number) + suffix
-            group_number += 1  # Increase group_number for the next file
-            with xopen.xopen(filename, mode="wb",
-                             compresslevel=compression_level,
-                             threads=threads_per_file) as output_fastq:
-                _sequential_splitter(input_fastq, output_fastq,
-                                     max_size,
-                                     buffer_size=buffer_size)
-                written_files.append(filename)
+            stream_end = _bzip2_stream_start(data, searched)
+            if stream_end == -1:
+                break
+            yield data[:stream_end]
+            data = data[stream_end:]
+            searched = 1
+        # The start of a stream may be cut off at the end of the data.
+        searched = max(len(data) - 9, 1)
+        if chunk == b"":
+            if data:
+                yield data
+            return
 
 
-def fastqsplitter(input: str,
-                  output: Optional[List[str]] = None,
-                  number: Optional[int] = None,
-                  max_size: Optional[int] = None,
-                  prefix: Optional[str] = None,
-                  suffix: str = DEFAULT_SUFFIX,
-                  buffer_size: int = DEFAULT_BUFFER_SIZE,
-                  compression_level: int = DEFAULT_COMPRESSION_LEVEL,
-                  threads_per_file: int = DEFAULT_THREADS_PER_FILE,
-                  round_robin: bool = True) -> List[str]:
+def _parallel_decompression_format(input_file: str) -> Optional[str]:
     """
-    Splits fastq files sequentially or round_robin depending on the given
-    parameters. Creates files of the from <prefix><number><suffix>.
-    :param input: The input fastq file.
-    :param output: An optional list of output files if filenames should be
-    determined before hand.
-    :param number: Optional number of output files.
-    :param max_size: Try to determine the number of output files by the size
-    of the input file and the maximum size. Or if round_robin = false this is
-    the maximum amount of bytes written.
-    :param prefix: The prefix for the output files.
-    :param suffix: The suffix for the output files. ".gz" files are gzip
-    compressed, ".xz" xz compressed and ".bzip2" bzip2 compressed.
-    :param buffer_size: The granularity with which the fastq files should be
-    distributed.
-    :param compression_level: The compression level to use, if applicable.
-    :param threads_per_file: The amount of threads xopen should use to open
-    the file.
-    :param round_robin: If set to false will force the sequential method if
-    a file is given.
-    :return: The list of output files written.
+    The format of input_file if it consists of independently compressed
+    units that can be decompressed in parallel: 'bgzf' or 'bzip2'. None
+    otherwise.
     """
-    default_prefix = os.path.basename(
-        input).rstrip(".gz").rstrip(".fastq").rstrip(".fq") + "."
-    prefix = prefix if prefix is not None else default_prefix
+    if not os.path.isfile(input_file):
+        return None
+    if _is_bgzf(input_file):
+        return "bgzf"
+    with open(input_file, "rb") as input_handle:
+        start = input_handle.read(BZIP2_DETECTION_SIZE)
+    # A single bzip2 stream can only be decompressed as a whole.
+    if (_bzip2_stream_start(start, 0) == 0 and
+            _bzip2_stream_start(start, 1) != -1):
+        return "bzip2"
+    return None
 
-    if not round_robin or (input == STDIN and max_size is not None):
-        if max_size is None:
-            raise ValueError("Maximum size must be set when splitting files "
-                             "sequentially (not using round-robin).")
-        return split_fastqs_sequentially(
-            input_file=input,
-            max_size=max_size,
-            prefix=prefix,
-            suffix=suffix,
-            buffer_size=buffer_size,
-            compression_level=compression_level,
-            threads_per_file=threads_per_file)
 
-    if output:
-        output_files = output
+class _ParallelDecompressingReader(_ChunkedReader):
+    """
+    Reads a file of independently compressed units, BGZF blocks or
+    concatenated bzip2 streams, and decompresses the units on a pool of
+    threads. Both zlib and bz2 release the GIL while decompressing. The
+    units are returned in order. At most two units per thread are
+    decompressed ahead.
+    """
+
+    def __init__(self, input_file: str, threads: int):
+        self.raw = open(input_file, "rb")
+        if _parallel_decompression_format(input_file) == "bgzf":
+            self.units = _bgzf_batches(self.raw)
+            self.decompress = _decompress_bgzf_blocks  # type: Callable
+        else:
+            self.units = _bzip2_streams(self.raw)
+            self.decompress = bz2.decompress
+        self.executor = futures.ThreadPoolExecutor(threads)
+        self.max_pending = 2 * threads
+        self.pending = collections.deque()  # type: collections.deque
+
+    def _next_chunk(self) -> bytes:
+        while True:
+            for unit in itertools.islice(
+                    self.units, self.max_pending - len(self.pending)):
+                self.pending.append(
+                    self.executor.submit(self.decompress, unit))
+            if not self.pending:
+                return b""
+            chunk = self.pending.popleft().result()
+            # The BGZF end of file marker is an empty block.
+            if chunk:
+                return chunk
+
+    def close(self) -> None:
+        for future in self.pending:
+            future.cancel()
+        self.executor.shutdown()
+        self.raw.close()
+
+
+class SplitStatistics(object):
+    """
+    Statistics of a split. Pass an instance to fastqsplitter to collect them.
+    Times are in seconds. When statistics are collected, uncompressed files
+    are not copied by the kernel, so that the records can be counted.
+    Values that could not be
+    measured, for instance because the data was written by other processes
+    or split with an index or in byte ranges, are None.
+    """
+
+    def __init__(self):
+        self.input_bytes = 0
+        # None until something is read or scanned in this process.
+        self.read_time = None  # type: Optional[float]
+        self.scan_time = None  # type: Optional[float]
+        self.wall_time = 0.0
+        self.buffer_size = None  # type: Optional[int]
+        self.outputs = collections.OrderedDict(
+        )  # type: collections.OrderedDict
+
+    def output(self, filename: str) -> dict:
+        """Return the statistics of an output file."""
+        if filename not in self.outputs:
+            self.outputs[filename] = {
+                "filename": filename, "bytes": 0, "compressed_bytes": None,
+                "blocks": 0, "records": 0, "write_time": 0.0}
+        return self.outputs[filename]
+
+    def finish(self, output_files: List[str], wall_time: float) -> None:
+        """
+        Add the sizes of the written files. Outputs which were not written
+        through _open_output get the sizes of the files, when uncompressed.
+        Named pipes and commands have no size.
+        """
+        self.wall_time = wall_time
+        for filename in output_files:
+            if not os.path.isfile(filename):
+                continue
+            if filename not in self.outputs:
+                uncompressed = not filename.endswith(COMPRESSED_EXTENSIONS)
+                self.outputs[filename] = {
+                    "filename": filename,
+                    "bytes": (os.path.getsize(filename) if uncompressed
+                              else None),
+                    "compressed_bytes": None, "blocks": None,
+                    "records": None, "write_time": None}
+            self.outputs[filename]["compressed_bytes"] = os.path.getsize(
+                filename)
+
+    def to_dict(self) -> dict:
+        """Return the statistics as a JSON serializable dictionary."""
+        outputs = list(self.outputs.values())
+
+        def total(key: str) -> Optional[float]:
+            values = [output[key] for output in outputs]
+            return None if None in values else sum(values)
+
+        input_bytes = self.input_bytes or total("bytes")
+        return {
+            "input_bytes": input_bytes,
+            "input_records": total("records"),
+            "output_bytes": total("bytes"),
+            "output_compressed_bytes": total("compressed_bytes"),
+            "read_time": self.read_time,
+            "scan_time": self.scan_time,
+            "write_time": total("write_time"),
+            "wall_time": self.wall_time,
+            "buffer_size": self.buffer_size,
+            "throughput_mb_s": (input_bytes / self.wall_time / 1024 ** 2
+                                if input_bytes and self.wall_time else None),
+            "outputs": outputs}
+
+
+class _TimedReader(object):
+    """Counts the bytes read from a handle and the time spent reading."""
+
+    def __init__(self, input_handle: Any, stats: SplitStatistics):
+        self.input_handle = input_handle
+        self.stats = stats
+
+    def read(self, size: int = -1) -> bytes:
+        start = time.perf_counter()
+        data = self.input_handle.read(size)
+        self.stats.read_time = (self.stats.read_time or 0.0) + (
+            time.perf_counter() - start)
+        self.stats.input_bytes += len(data)
+        return data
+
+    def seek(self, offset: int) -> int:
+        return self.input_handle.seek(offset)
+
+    def close(self) -> None:
+        self.input_handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class _CountingWriter(object):
+    """
+    Counts the bytes, blocks and records written to a handle and the time
+    spent writing, including the time blocked on compression.
+    """
+
+    def __init__(self, output_handle: Any, output_stats: dict):
+        self.output_handle = output_handle
+        self.output_stats = output_stats
+        self.lines = 0
+        self.in_line = False
+
+    def write(self, data: bytes) -> int:
+        start = time.perf_counter()
+        self.output_handle.write(data)
+        self.output_stats["write_time"] += time.perf_counter() - start
+        if data:
+            self.lines += data.count(b"\n")
+            self.in_line = not data.endswith(b"\n")
+            self.output_stats["bytes"] += len(data)
+            self.output_stats["blocks"] += 1
+            # A final record without a newline is counted as well.
+            self.output_stats["records"] = (self.lines + self.in_line) // 4
+        return len(data)
+
+    def close(self) -> None:
+        start = time.perf_counter()
+        self.output_handle.close()
+        self.output_stats["write_time"] += time.perf_counter() - start
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _compress_sample(data: bytes, filename: str, compression_level: int
+                     ) -> bytes:
+    """Compress data as it would be in a file with this filename."""
+    if filename.endswith((".gz", ".bgz")):
+        return zlib.compress(data, compression_level)
+    if filename.endswith(".bz2"):
+        return bz2.compress(data, max(compression_level, 1))
+    if filename.endswith(".xz"):
+        return lzma.compress(data, preset=compression_level)
+    if filename.endswith(".zst"):
+        if zstandard is None:
+            # Without the zstandard module, xopen uses the zstd program. At
+            # the same level, zstd compresses FASTQ about as well as gzip.
+            return zlib.compress(data, min(max(compression_level, 1), 9))
+        return zstandard.ZstdCompressor(compression_level).compress(data)
+    return data
+
+
+def _compression_ratio(sample: bytes, filename: str,
+                       compression_level: int) -> float:
+    """The compressed size divided by the uncompressed size of sample."""
+    if not sample or not filename.endswith(COMPRESSED_EXTENSIONS):
+        return 1.0
+    return len(_compress_sample(sample, filename, compression_level)
+               ) / len(sample)
+
+
+def estimate_compression_ratio(
+        input_file: InputFiles, filename: str,
+        compression_level: int = DEFAULT_COMPRESSION_LEVEL,
+        sample_size: int = COMPRESSION_SAMPLE_SIZE) -> float:
+    """
+    Estimate the compressed size divided by the uncompressed size of the
+    input when it is written to a file with this filename, by compressing
+    the first sample_size bytes of the input.
+    :param input_file: The input fastq. Or a list of files, of which only the
+    first is sampled.
+    :param filename: A filename or suffix that determines the compression.
+    :param compression_level: The compression level.
+    :param sample_size: How many uncompressed bytes are compressed.
+    """
+    if not filename.endswith(COMPRESSED_EXTENSIONS):
+        return 1.0
+    return _compression_ratio(_compression_sample(input_file, sample_size),
+                              filename, compression_level)
+
+
+def _compression_sample(input_file: InputFiles,
+                        sample_size: int = COMPRESSION_SAMPLE_SIZE) -> bytes:
+    """Read the first sample_size bytes of the first input file."""
+    first_file = input_file if isinstance(input_file, str) else input_file[0]
+    with _open_input(first_file) as input_handle:
+        return input_handle.read(sample_size)
+
+
+def _open_input_file(input_file: str,
+                     threads_per_file: int = DEFAULT_THREADS_PER_FILE,
+                     decompression_threads: int = 0) -> Any:
+    """
+    Open an input file for reading. If decompression_threads is larger
+    than 0 and the file consists of BGZF blocks or multiple bzip2 streams,
+    it is decompressed in parallel on this many threads.
+    """
+    if (decompression_threads > 0 and
+            _parallel_decompression_format(input_file) is not None):
+        return _ParallelDecompressingReader(input_file, decompression_threads)
+    return xopen.xopen(input_file, mode="rb", threads=threads_per_file)
+
+
+def _open_input(input_file: InputFiles,
+                threads_per_file: int = DEFAULT_THREADS_PER_FILE,
+                stats: Optional[SplitStatistics] = None,
+                decompression_threads: int = 0) -> Any:
+    """
+    Open one or more input files for reading. Multiple files are read as
+    one concatenated file. If stats is given, reads are counted and timed.
+    """
+    if isinstance(input_file, str):
+        input_handle = _open_input_file(input_file, threads_per_file,
+                                        decompression_threads)
+    elif len(input_file) == 1:
+        input_handle = _open_input_file(input_file[0], threads_per_file,
+                                        decompression_threads)
     else:
-        if max_size is not None:
-            input_size = os.stat(input).st_size
-            if input_size == 0:
-                raise OSError("Cannot determine size of input file or "
-                              "empty input file: {0}.".format(input))
-            number = input_size // max_size + 1
-        elif not number:
-            raise ValueError("Either a maximum size or a number of files or "
-                             "a list of output files must be defined.")
-        output_files = [prefix + str(i) + suffix for i in range(number)]
+        input_handle = _ConcatenatedReader(
+            input_file, threads_per_file,
+            decompression_threads=decompression_threads)
+    if stats is not None:
+        return _TimedReader(input_handle, stats)
+    return input_handle
 
-    split_fastqs_round_robin(input, output_files,
-                             compression_level=compression_level,
-                             threads_per_file=threads_per_file,
-                             buffer_size=buffer_size)
-    return output_files
 
+def _compress_gzip_member(data: bytes, compression_level: int) -> bytes:
+    """Compress data into a complete gzip member."""
+    zlib_module = _zlib_module(compression_level)
+    # 16 + MAX_WBITS creates a gzip header and trailer.
+    compressor = zlib_module.compressobj(
+        compression_level, zlib_module.DEFLATED, 16 + zlib_module.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
 
-def main():
-    """Fastqsplitter program"""
-    parser = argument_parser()
-    # convert argparse.Namespace to dictionary
-    kwargs = vars(parser.parse_args())
-    max_size = kwargs.pop("max_size")
-    if max_size is not None:
-        max_size = human_readable_to_int(max_size)
-    buffer_size = human_readable_to_int(kwargs.pop("buffer_size"))
-    print_to_stdout = kwargs.pop("print")
-    # kwargs correspond to fastqsplitter function inputs.
-    output_files = fastqsplitter(max_size=max_size,
+
+def _compress_bgzf_block(data: bytes, compression_level: int) -> bytes:
+    """
+    Compress data into a BGZF block. This is a gzip member with the
+    compressed block size in the 'BC' extra field. See the SAM specification.
+    """
+    zlib_module = _zlib_module(compression_level)
+    # Negative wbits creates a raw deflate stream.
+    compressor = zlib_module.compressobj(
+        compression_level, zlib_module.DEFLATED, -zlib_module.MAX_WBITS)
+    deflated = compressor.compress(data) + compressor.flush()
+    block_size = BGZF_HEADER_SIZE + len(deflated) + 8
+    return (struct.pack(BGZF_HEADER_FORMAT, 31, 139, 8, 4, 0, 0, 255, 6,
+                        ord("B"), ord("C"), 2, block_size - 1) +
+            deflated +
+            struct.pack("<II", zlib_module.crc32(data), len(data)))
+
+
+class _ThreadedGzipWriter(object):
+    """
+    Writes a gzip file by compressing each written block as a separate gzip
+    member on a shared thread pool. Members are written in order. At most
+    max_pending blocks are waiting for compression at any time. Without an
+    executor the blocks are compressed directly.
+    """
+    compress_function = staticmethod(_compress_gzip_member)
+
+    def __init__(self, filename: str, compression_level: int,
+                 executor: Optional[futures.Executor] = None,
+                 max_pending: int = 2, append: bool = False):
+        self.raw = open(filename, "ab" if append else "wb")
+        self.compression_level = compression_level
+        self.executor = executor
+        self.max_pending = max_pending
+        self.pending = collections.deque()  # type: collections.deque
+
+    def _submit(self, data: bytes, index_offset: Optional[int] = None
+                ) -> None:
+        """
+        Compress data and write it when ready. If index_offset is given, it
+        is the uncompressed offset of the block, which is added to the index.
+        """
+        if self.executor is not None:
+            future = self.executor.submit(
+                self.compress_function, data, self.compression_level)
+        else:
+            future = futures.Future()
+            future.set_result(
+                self.compress_function(data, self.compression_level))
+        self.pending.append((future, index_offset))
+        # Write all finished members, but block only when too many members
+        # are waiting.
+        while self.pending and (len(self.pending) > self.max_pending or
+                                self.pending[0][0].done()):
+            self._write_member(*self.pending.popleft())
+
+    def _write_member(self, future: futures.Future,
+                      index_offset: Optional[int]) -> None:
+        self.raw.write(future.result())
+
+    def write(self, data: bytes) -> int:
+        self._submit(data)
+        return len(data)
+
+    def flush(self) -> None:
+        while self.pending:
+            self._write_member(*self.pending.popleft())
+        self.raw.flush()
+
+    def close(self) -> None:
+        if self.raw.closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self.raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class _BgzfWriter(_ThreadedGzipWriter):
+    """
+    Writes a BGZF file and a '.gzi' index next to it. The index has the same
+    format as the one created by 'bgzip --reindex'. Written data is buffered
+    and a block is only cut when the buffer holds more than a full block.
+    The block is then cut at the last record start that fits in it, so that
+    the next block starts at a record and its offset is added to the index.
+    So all offsets in the index point to the start of a fastq record. Record
+    starts are found by counting lines. Only a record that does not fit in a
+    block is cut at the block size.
+    """
+    compress_function = staticmethod(_compress_bgzf_block)
+
+    def __init__(self, filename: str, compression_level: int,
+                 executor: Optional[futures.Executor] = None,
+                 max_pending: int = 2):
+        super().__init__(filename, compression_level, executor, max_pending)
+        self.index_file = filename + ".gzi"
+        self.index = []  # type: List[Tuple[int, int]]
+        self.compressed_offset = 0
+        self.uncompressed_offset = 0
+        self.buffer = bytearray()
+        # The number of finished lines of the record at the start of the
+        # buffer and whether the buffer starts at a record.
+        self.open_lines = 0
+        self.at_record_start = True
+
+    def write(self, data: bytes) -> int:
+        self.buffer += data
+        while len(self.buffer) > BGZF_BLOCK_SIZE:
+            self._submit_block(self._block_end())
+        return len(data)
+
+    def _block_end(self) -> int:
+        """Return the last record start in the first block of the buffer."""
+        newlines = self.buffer.count(b"\n", 0, BGZF_BLOCK_SIZE)
+        # A record starts after the newline that finishes its fourth line.
+        newlines_after_record_start = (self.open_lines + newlines) % 4
+        if newlines_after_record_start >= newlines:
+            return BGZF_BLOCK_SIZE  # No record starts in the block.
+        position = BGZF_BLOCK_SIZE
+        for _ in range(newlines_after_record_start + 1):
+            position = self.buffer.rfind(b"\n", 0, position)
+        return position + 1
+
+    def _submit_block(self, block_end: int) -> None:
+        block = bytes(self.buffer[:block_end])
+        del self.buffer[:block_end]
+        self._submit(block, self.uncompressed_offset
+                     if self.at_record_start else None)
+        self.uncompressed_offset += len(block)
+        self.open_lines = (self.open_lines + block.count(b"\n")) % 4
+        self.at_record_start = self.open_lines == 0 and block.endswith(b"\n")
+
+    def flush(self) -> None:
+        if self.buffer:
+            self._submit_block(len(self.buffer))
+        super().flush()
+
+    def _write_member(self, future: futures.Future,
+                      index_offset: Optional[int]) -> None:
+        member = future.result()
+        # The first block is not stored in the index.
+        if index_offset is not None and index_offset > 0:
+            self.index.append((self.compressed_offset, index_offset))
+        self.raw.write(member)
+        self.compressed_offset += len(member)
+
+    def close(self) -> None:
+        if self.raw.closed:
+            return
+        try:
+            self.flush()
+            self.raw.write(BGZF_EOF)
+        finally:
+            self.raw.close()
+        with open(self.index_file, "wb") as index_handle:
+            index_handle.write(struct.pack("<Q", len(self.index)))
+            for compressed_offset, uncompressed_offset in self.index:
+                index_handle.write(struct.pack(
+                    "<QQ", compressed_offset, uncompressed_offset))
+
+
+class _QueuedWriter(object):
+    """
+    Writes to an output handle from a separate thread. Written blocks are
+    put on a queue of at most depth blocks, so writing only blocks when the
+    queue of this output is full. Errors in the writer thread are raised on
+    the next write or on close. If close_output is True, the writer thread
+    also closes the output handle.
+    """
+
+    def __init__(self, output_handle: Any, depth: int,
+                 close_output: bool = False):
+        self.output_handle = output_handle
+        self.close_output = close_output
+        self.queue = queue.Queue(depth)  # type: queue.Queue
+        self.error = None  # type: Optional[BaseException]
+        self.aborted = False
+        self.thread = threading.Thread(target=self._write_blocks,
+                                       daemon=True)
+        self.thread.start()
+
+    def _write_blocks(self) -> None:
+        while True:
+            block = self.queue.get()
+            if block is None:
+                if self.close_output:
+                    try:
+                        self.output_handle.close()
+                    except BaseException as error:
+                        self.error = self.error or error
+                return
+            # After an error the blocks are discarded, so the queue does not
+            # fill up.
+            if self.error is None and not self.aborted:
+                try:
+                    self.output_handle.write(block)
+                except BaseException as error:
+                    self.error = error
+
+    def _check_error(self) -> None:
+        if self.error is not None:
+            raise self.error
+
+    def pending(self) -> int:
+        """The number of blocks waiting to be written."""
+        return self.queue.qsize()
+
+    def write(self, data: bytes) -> int:
+        self._check_error()
+        self.queue.put(data)
+        return len(data)
+
+    def abort(self) -> None:
+        """
+        Discard the blocks that are not written yet. If the output handle
+        can be aborted, it is aborted as well, so the writer thread does not
+        keep waiting for it.
+        """
+        self.aborted = True
+        abort = getattr(self.output_handle, "abort", None)
+        if abort is not None:
+            abort()
+
+    def close(self) -> None:
+        if not self.thread.is_alive():
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self._check_error()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # On an error the output may never be read, for instance a named
+        # pipe without a reader.
+        if exc_type is not None:
+            self.abort()
+        self.close()
+
+
+class _FifoWriter(object):
+    """
+    Writes to a named pipe. A named pipe can only be opened for writing when
+    a reader has opened it, so the pipe is only opened on the first write.
+    Until then opening is retried, until a reader connects or the writer is
+    aborted. Used behind a _QueuedWriter, the writer thread waits for the
+    reader instead of the splitting loop. A pipe that receives no data and
+    has no reader when it is closed is removed.
+    """
+
+    def __init__(self, filename: str, open_output: Callable[[str], Any]):
+        self.filename = filename
+        self.open_output = open_output
+        self.output_handle = None  # type: Any
+        self.aborted = False
+
+    def _wait_for_reader(self) -> Optional[int]:
+        """
+        Return a non-blocking descriptor of the pipe once a reader has
+        opened it, or None when the writer is aborted first.
+        """
+        while not self.aborted:
+            try:
+                return os.open(self.filename, os.O_WRONLY | os.O_NONBLOCK)
+            except OSError as error:
+                if error.errno != errno.ENXIO:  # ENXIO: there is no reader.
+                    raise
+            time.sleep(FIFO_POLL_INTERVAL)
+        return None
+
+    def write(self, data: bytes) -> int:
+        if self.output_handle is None:
+            reader_check = self._wait_for_reader()
+            if reader_check is None:
+                return 0
+            # Keeping the descriptor open until the output is opened makes
+            # sure the reader does not get an end of file in between.
+            try:
+                self.output_handle = self.open_output(self.filename)
+            finally:
+                os.close(reader_check)
+        return self.output_handle.write(data)
+
+    def abort(self) -> None:
+        """Stop waiting for a reader."""
+        self.aborted = True
+
+    def close(self) -> None:
+        if self.output_handle is not None:
+            self.output_handle.close()
+            return
+        # Nothing was written. A reader that is waiting for the pipe gets
+        # an end of file.
+        try:
+            os.close(os.open(self.filename, os.O_WRONLY | os.O_NONBLOCK))
+            return
+        except OSError as error:
+            if error.errno != errno.ENXIO:  # ENXIO: there is no reader.
+                return
+        # Without a reader, the pipe is removed so that a reader that comes
+        # later does not wait forever. Opening it for reading and writing
+        # never blocks and gives an end of file to a reader that opens it
+        # before it is removed.
+        descriptor = os.open(self.filename, os.O_RDWR | os.O_NONBLOCK)
+        try:
+            os.unlink(self.filename)
+        finally:
+            os.close(descriptor)
+
+
+class _ProcessWriter(object):
+    """
+    Writes to the stdin of a shell command. When a pipe buffer is full,
+    writing blocks until the command has read more. Closing waits for the
+    command to finish. A command that exits successfully before it has read
+    all its input, such as 'head', chose to stop reading. The rest of the
+    data is then discarded.
+    :raises subprocess.CalledProcessError: if the command fails.
+    """
+
+    def __init__(self, command: str):
+        self.command = command
+        self.process = subprocess.Popen(command, shell=True,
+                                        stdin=subprocess.PIPE)
+        self.stopped_reading = False
+
+    def _check_returncode(self) -> None:
+        if self.process.wait() != 0:
+            raise subprocess.CalledProcessError(self.process.returncode,
+                                                self.command)
+
+    def write(self, data: bytes) -> int:
+        if self.stopped_reading:
+            return len(data)
+        try:
+            return self.process.stdin.write(data)  # type: ignore
+        except BrokenPipeError:
+            # The command stopped reading. Its exit status is more useful.
+            self._check_returncode()
+            self.stopped_reading = True
+            return len(data)
+
+    def close(self) -> None:
+        try:
+            self.process.stdin.close()  # type: ignore
+        except BrokenPipeError:
+            pass
+        self._check_returncode()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class _WriterPool(object):
+    """
+    Keeps at most max_open output files open. Writing to an output that is
+    not open closes the least recently written one first. An output that
+    was closed this way is opened again in append mode, so a compressed
+    output gets a new gzip member (or bzip2, xz or zstd stream). This keeps
+    the number of open files and compression processes bounded, regardless
+    of the number of outputs.
+    """
+
+    def __init__(self, open_output: Callable[[str, bool], Any],
+                 max_open: int):
+        self.open_output = open_output
+        self.max_open = max_open
+        # The open outputs, from the least to the most recently written.
+        self.handles = collections.OrderedDict(
+        )  # type: collections.OrderedDict
+        self.opened = set()  # type: set
+
+    def output(self, filename: str) -> "_PooledWriter":
+        """A writer for an output file of this pool."""
+        return _PooledWriter(self, filename)
+
+    def _open(self, filename: str) -> None:
+        if len(self.handles) >= self.max_open:
+            self.handles.popitem(last=False)[1].close()
+        self.handles[filename] = self.open_output(
+            filename, filename in self.opened)
+        self.opened.add(filename)
+
+    def write(self, filename: str, data: bytes) -> int:
+        if filename in self.handles:
+            self.handles.move_to_end(filename)
+        else:
+            self._open(filename)
+        return self.handles[filename].write(data)
+
+    def close(self, filename: str) -> None:
+        """Close an output. An output that was never written is created."""
+        if filename not in self.opened:
+            self._open(filename)
+        handle = self.handles.pop(filename, None)
+        if handle is not None:
+            handle.close()
+
+
+class _PooledWriter(object):
+    """An output file of a _WriterPool."""
+
+    def __init__(self, pool: _WriterPool, filename: str):
+        self.pool = pool
+        self.filename = filename
+
+    def write(self, data: bytes) -> int:
+        return self.pool.write(self.filename, data)
+
+    def close(self) -> None:
+        self.pool.close(self.filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def make_fifo(filename: str) -> None:
+    """
+    Create a named pipe. An existing named pipe is reused.
+    :raises FileExistsError: if filename exists and is not a named pipe.
+    """
+    try:
+        os.mkfifo(filename)
+    except FileExistsError:
+        if not stat.S_ISFIFO(os.stat(filename).st_mode):
+            raise
+
+
+def _open_output(filename: str,
+                 compression_level: int = DEFAULT_COMPRESSION_LEVEL,
+                 threads_per_file: int = DEFAULT_THREADS_PER_FILE,
+                 compression_pool: Optional[futures.Executor] = None,
+                 max_pending: int = 2,
+                 bgzf: bool = False,
+                 stats: Optional[SplitStatistics] = None,
+                 append: bool = False) -> Any:
+    """
+    Open an output file for writing. When a compression pool is given,
+    '.gz' files are compressed on that pool, otherwise xopen is used.
+    If bgzf is True, '.gz' files are written in BGZF format with an index.
+    If stats is given, writes are counted and timed. If append is True the
+    data is appended, '.gz' files then get a new gzip member.
+    :return: A writable binary file-like object that can be used as a context
+    manager.
+    """
+    if bgzf and filename.endswith(".gz"):
+        output_handle = _BgzfWriter(filename, compression_level,
+                                    compression_pool, max_pending
+                                    )  # type: Any
+    elif compression_pool is not None and filename.endswith(".gz"):
+        output_handle = _ThreadedGzipWriter(filename, compression_level,
+                                            compression_pool, max_pending,
+                                            append)
+    else:
+        output_handle = xopen.xopen(filename=filename,
+                                    mode="ab" if append else "wb",
+                                    compresslevel=compression_level,
+                                    threads=threads_per_file)
+    if stats is not None:
+        return _CountingWriter(output_handle, stats.output(filename))
+    return output_handle
+
+
+def _compression_pool(stack: contextlib.ExitStack, compression_threads: int
+                      ) -> Optional[futures.Executor]:
+    """
+    Create a thread pool for compression if compression_threads > 0. The
+    pool is registered on the stack before any output is opened, so it is
+    shut down after all outputs have been closed.
+    """
+    if compression_threads < 1:
+        return None
+    return stack.enter_context(
+        futures.ThreadPoolExecutor(compression_threads))
+
+
+def _record_boundary(data: Any, position: int) -> int:
+    """
+    Find the start of a fastq record in a memory mapped file. The boundary is
+    the position where _read_until_new_fastq_record ends when starting at
+    position. This only depends on position, so adjacent byte ranges always
+    agree on the boundary between them.
+    :return: The offset of the record start or the file size.
+    """
+    if position == 0:
+        return 0
+    return _find_record_boundary(data, position)
+
+
+def _zero_copy_possible(input_file: InputFiles, output_files: List[str]
+                        ) -> bool:
+    """
+    Data can be copied by the kernel when the input is a single uncompressed
+    regular file and none of the output files is compressed.
+    """
+    return (isinstance(input_file, str) and
+            os.path.isfile(input_file) and
+            not input_file.endswith(COMPRESSED_EXTENSIONS) and
+            not any(output_file.endswith(COMPRESSED_EXTENSIONS)
+                    for output_file in output_files))
+
+
+def _copy_range(input_fd: int, output_fd: int, offset: int, count: int
+                ) -> None:
+    """
+    Copy count bytes starting at offset from input_fd to the current position
+    of output_fd. os.copy_file_range and os.sendfile copy the data inside the
+    kernel. If neither is available or supported for these files, a normal
+    read and write is used.
+    """
+    end = offset + count
+    if hasattr(os, "copy_file_range"):
+        try:
+            while offset < end:
+                copied = os.copy_file_range(input_fd, output_fd,
+                                            end - offset, offset)
+                if copied == 0:  # EOF
+                    return
+                offset += copied
+            return
+        except OSError:  # For example a pipe, or not supported on this fs.
+            pass
+    if hasattr(os, "sendfile"):
+        try:
+            while offset < end:
+                copied = os.sendfile(output_fd, input_fd, offset,
+                                     end - offset)
+                if copied == 0:
+                    return
+                offset += copied
+            return
+        except OSError:
+            pass
+    while offset < end:
+        data = os.pread(input_fd, min(DEFAULT_BUFFER_SIZE, end - offset),
+                        offset)
+        if data == b"":
+            return
+        view = memoryview(data)
+        while view:
+            view = view[os.write(output_fd, view):]
+        offset += len(data)
+
+
+def _split_round_robin_zero_copy(input_file: str, output_files: List[str],
+                                 buffer_size: int = DEFAULT_BUFFER_SIZE,
+                                 tuner: Optional[BufferSizeTuner] = None
+                                 ) -> None:
+    """
+    Round-robin splitting for uncompressed files. Only the bytes around each
+    cut are read to find the record boundary. The blocks are copied by the
+    kernel. The output is the same as with the normal method.
+    """
+    with contextlib.ExitStack() as stack:
+        input_handle = stack.enter_context(open(input_file, "rb"))
+        input_fd = input_handle.fileno()
+        input_data = stack.enter_context(_mmap_file(input_handle))
+        output_fds = [stack.enter_context(open(output_file, "wb")).fileno()
+                      for output_file in output_files]
+        input_size = os.fstat(input_fd).st_size
+        number_of_output_files = len(output_files)
+        group_number = 0
+        start = 0
+        while start < input_size:
+            end = _record_boundary(input_data,
+                                   min(start + buffer_size, input_size))
+            _copy_range(input_fd, output_fds[group_number], start,
+                        end - start)
+            if tuner is not None:
+                buffer_size = tuner.update(end - start)
+            start = end
+            group_number += 1
+            if group_number == number_of_output_files:
+                group_number = 0
+
+
+def _least_busy_output(pending: List[int], records: List[int],
+                       tolerance: float, block_records: int) -> int:
+    """
+    Return the output that should receive the next block. This is the
+    output with the least pending blocks among the outputs whose number of
+    records is within tolerance times the mean number of records of the
+    output with the least records. Ties go to the output with the least
+    records.
+    :param pending: The number of blocks waiting to be written per output.
+    :param records: The number of records written per output.
+    :param tolerance: The allowed imbalance as a fraction of the mean.
+    :param block_records: The number of records in the next block. An
+    output is allowed to be this many records ahead so all outputs are used
+    at the start.
+    """
+    allowed = min(records) + max(tolerance * sum(records) / len(records),
+                                 block_records)
+    return min((pending[i], records[i], i) for i in range(len(records))
+               if records[i] <= allowed)[2]
+
+
+def split_fastqs_round_robin(
+        input_file: InputFiles, output_files: List[str],
+        compression_level: int = DEFAULT_COMPRESSION_LEVEL,
+        buffer_size: BufferSize = DEFAULT_BUFFER_SIZE,
+        threads_per_file: int = DEFAULT_THREADS_PER_FILE,
+        input_file_r2: Optional[InputFiles] = None,
+        output_files_r2: Optional[List[str]] = None,
+        compression_threads: int = 0,
+        bgzf: bool = False,
+        queue_depth: int = 0,
+        least_busy: bool = False,
+        balance_tolerance: float = DEFAULT_BALANCE_TOLERANCE,
+        stats: Optional[SplitStatistics] = None,
+        fifo: bool = False,
+        execute: bool = False,
+        decompression_threads: int = 0,
+        max_open_files: int = 0) -> None:
+    """
+    Split a fastq file over multiple output files in a round robin fashion.
+    :param input_file: The file to be split. Or a list of files which are
+    split as if they were concatenated.
+    :param output_files: The files receiving the split parts
+    :param compression_level: Which compression level to use if applicable
+    :param buffer_size: The buffer size. The granularity at which fastq records
+    are distributed. Or a BufferSizeTuner to determine it during the run.
+    :param threads_per_file: How many threads xopen should use to open the
+    file.
+    :param input_file_r2: Optional R2 file of a paired-end pair. It is split
+    in lockstep with input_file.
+    :param output_files_r2: The files receiving the R2 parts. Must be as many
+    as output_files.
+    :param compression_threads: If larger than 0, '.gz' output files are
+    compressed on a shared pool of this many threads.
+    :param bgzf: Write '.gz' output files in BGZF format with a '.gzi' index
+    of record aligned block offsets.
+    :param queue_depth: If larger than 0, each output file is written by its
+    own thread from a queue of at most this many blocks. A slow output then
+    only stalls the splitting when its queue is full.
+    :param least_busy: Instead of round-robin, write each block to the output
+    with the least blocks in its queue. Uses a queue depth of
+    DEFAULT_QUEUE_DEPTH if queue_depth is not set.
+    :param balance_tolerance: With least_busy, the number of records in an
+    output stays within this fraction of the mean (plus one block) of the
+    output with the least records.
+    :param stats: If given, statistics of the split are added to it.
+    :param fifo: Create the outputs as named pipes. Each pipe is opened and
+    written by its own thread, so a reader that has not connected yet only
+    stalls the split when the queue of its pipe is full. Uses a queue depth
+    of DEFAULT_QUEUE_DEPTH if queue_depth is not set.
+    :param execute: The output files are shell commands. The records of
+    each output are written uncompressed to the stdin of its command. Uses
+    a queue depth of DEFAULT_QUEUE_DEPTH if queue_depth is not set, so a
+    slow command only stalls the split when its queue is full.
+    :param decompression_threads: If larger than 0, BGZF input and bzip2
+    input of multiple streams, as written by pbzip2, is decompressed in
+    parallel on this many threads.
+    :param max_open_files: If larger than 0, at most this many output files
+    are open at the same time. Writing to another output closes the least
+    recently written one, which is opened again in append mode when it is
+    written to next. The outputs are then compressed in-process, or on the
+    compression threads, instead of with threads_per_file.
+    :raises subprocess.CalledProcessError: if a command fails.
+    """
+    buffer_size, tuner = _buffer_size_tuner(buffer_size)
+    if len(output_files) < 1:
+        raise ValueError("The number of output files should be at least 1.")
+    if buffer_size < 1024:
+        # This value is arbitrary, but really low values such as 5 or 30 don't
+        # make sense.
+        raise ValueError("The buffer size should be at least 1024.")
+    if input_file_r2 is not None and (
+            output_files_r2 is None or
+            len(output_files_r2) != len(output_files)):
+        raise ValueError("The number of R2 output files should be equal to "
+                         "the number of output files.")
+    if queue_depth < 0:
+        raise ValueError("The queue depth should not be negative.")
+    if balance_tolerance < 0:
+        raise ValueError("The balance tolerance should not be negative.")
+    if execute and input_file_r2 is not None:
+        raise ValueError("Commands cannot be executed in paired-end mode.")
+    if max_open_files < 0:
+        raise ValueError("The maximum number of open files should not be "
+                         "negative.")
+    if max_open_files > 0 and (fifo or execute or bgzf or queue_depth > 0 or
+                               least_busy):
+        raise ValueError("A maximum number of open files cannot be combined "
+                         "with named pipes, commands, BGZF output or "
+                         "queues.")
+    # A queue also prevents zero-copy splitting, which needs output files.
+    if (least_busy or fifo or execute) and queue_depth == 0:
+        queue_depth = DEFAULT_QUEUE_DEPTH
+    if fifo:
+        for output_file in output_files + (output_files_r2 or []):
+            make_fifo(output_file)
+    # Zero-copy splitting keeps all output files open. The kernel copies
+    # the data, so records cannot be counted for the statistics.
+    if (isinstance(input_file, str) and input_file_r2 is None and
+            queue_depth == 0 and max_open_files == 0 and stats is None and
+            _zero_copy_possible(input_file, output_files)):
+        _split_round_robin_zero_copy(input_file, output_files, buffer_size,
+                                     tuner)
+        return
+
+    # contextlib.Exitstack allows us to open multiple files at once which
+    # are automatically closed on error.
+    # https://stackoverflow.com/questions/19412376/open-a-list-of-files-using-with-as-context-manager
+    with contextlib.ExitStack() as stack:
+        compression_pool = _compression_pool(stack, compression_threads)
+        # Allow enough blocks in flight to keep all compression threads busy.
+        max_pending = max(2, 2 * compression_threads // len(output_files))
+        input_handle = stack.enter_context(
+            _open_input(input_file, threads_per_file, stats,
+                        decompression_threads=decompression_threads))
+
+        def open_output(output_file: str) -> Any:
+            return _open_output(output_file, compression_level,
+                                threads_per_file, compression_pool,
+                                max_pending, bgzf, stats)
+
+        if fifo:
+            # Opening blocks until the reader connects, so the pipe is
+            # opened, written and closed by the writer thread of its queue.
+            def open_output_handle(output_file: str) -> Any:
+                return _QueuedWriter(_FifoWriter(output_file, open_output),
+                                     queue_depth, close_output=True)
+        elif execute:
+            def open_output_handle(output_file: str) -> Any:
+                if stats is not None:
+                    return _CountingWriter(_ProcessWriter(output_file),
+                                           stats.output(output_file))
+                return _ProcessWriter(output_file)
+        elif max_open_files > 0:
+            # With round-robin an output is reopened for nearly every block,
+            # so outputs are compressed in-process instead of starting a
+            # compression process each time.
+            def open_pooled_output(output_file: str, append: bool) -> Any:
+                return _open_output(output_file, compression_level, 0,
+                                    compression_pool, max_pending,
+                                    append=append)
+
+            writer_pool = _WriterPool(open_pooled_output, max_open_files)
+
+            # Writes are counted per output, not per opening of the file.
+            def open_output_handle(output_file: str) -> Any:
+                if stats is not None:
+                    return _CountingWriter(writer_pool.output(output_file),
+                                           stats.output(output_file))
+                return writer_pool.output(output_file)
+        else:
+            open_output_handle = open_output
+
+        output_handles = [
+            stack.enter_context(open_output_handle(output_file))
+            for output_file in output_files
+        ]  # type: List[Any]
+        mate_reader = None  # type: Optional[_MateReader]
+        mate_output_handles = []  # type: List[Any]
+        if input_file_r2 is not None and output_files_r2 is not None:
+            mate_reader = _MateReader(stack.enter_context(
+                _open_input(input_file_r2, threads_per_file, stats,
+                            decompression_threads=decompression_threads)))
+            mate_output_handles = [
+                stack.enter_context(open_output_handle(output_file))
+                for output_file in output_files_r2
+            ]
+        if queue_depth > 0 and not fifo:
+            # Registered after the outputs, so the queues are emptied before
+            # the outputs are closed.
+            output_handles = [
+                stack.enter_context(_QueuedWriter(handle, queue_depth))
+                for handle in output_handles]
+            mate_output_handles = [
+                stack.enter_context(_QueuedWriter(handle, queue_depth))
+                for handle in mate_output_handles]
+
+        block_reader = _FastqBlockReader(
+            input_handle, max(DEFAULT_READ_SIZE, buffer_size * 4), stats)
+        group_number = 0
+        number_of_output_files = len(output_files)
+        records = [0] * number_of_output_files
+
+        while True:
+            # Read buffer_size bytes and until the start of a new record.
+            block = block_reader.read_block(buffer_size)
+            if block == b"":
+                if mate_reader is not None:
+                    mate_reader.check_eof()
+                return
+
+            if least_busy:
+                # A block only lacks a final newline at the end of the file.
+                block_records = -(-block.count(b"\n") // 4)
+                pending = [handle.pending() for handle in output_handles]
+                for i, handle in enumerate(mate_output_handles):
+                    pending[i] += handle.pending()
+                group_number = _least_busy_output(
+                    pending, records, balance_tolerance, block_records)
+                records[group_number] += block_records
+            output_handles[group_number].write(block)
+            if mate_reader is not None:
+                # Blocks only lack a final newline at the end of the file.
+                mate_output_handles[group_number].write(
+                    mate_reader.read_matching(block, at_eof=True))
+            if tuner is not None:
+                buffer_size = tuner.update(len(block))
+                block_reader.read_size = max(DEFAULT_READ_SIZE,
+                                             buffer_size * 4)
+            if least_busy:
+                continue
+            # Set the group number for the next group to be written.
+            group_number += 1
+            # cycle back to the start when we have written the last file.
+            if group_number == number_of_output_files:
+                group_number = 0
+
+
+def iter_fastq_chunks(input_file: InputFiles,
+                      buffer_size: int = DEFAULT_BUFFER_SIZE,
+                      threads_per_file: int = DEFAULT_THREADS_PER_FILE,
+                      count_records: bool = False,
+                      memoryviews: bool = False,
+                      decompression_threads: int = 0) -> Iterator[Any]:
+    """
+    Iterate over record aligned chunks of a fastq file without writing any
+    output files. The chunks can be given to a thread or process pool
+    directly.
+    :param input_file: The fastq file. Or a list of files which are read as
+    if they were concatenated.
+    :param buffer_size: Each chunk is buffer_size bytes plus the bytes until
+    the start of the next record.
+    :param threads_per_file: How many threads xopen should use to open the
+    file.
+    :param count_records: Yield (chunk, number of records) tuples instead of
+    chunks.
+    :param memoryviews: Yield memoryviews instead of bytes, so the chunks are
+    not copied. An uncompressed input file is memory mapped and the chunks
+    are views of the mapping. Memoryviews can not be pickled, so use bytes
+    for process pools.
+    :param decompression_threads: If larger than 0, BGZF input and bzip2
+    input of multiple streams, as written by pbzip2, is decompressed in
+    parallel on this many threads.
+    """
+    if buffer_size < 1024:
+        raise ValueError("The buffer size should be at least 1024.")
+
+    def chunk(data: Any, start: int, end: int) -> Any:
+        block = memoryview(data)[start:end] if memoryviews else data[start:end]
+        if count_records:
+            # A chunk only lacks a final newline at the end of the file.
+            return block, -(-_count_newlines(data, start, end) // 4)
+        return block
+
+    if (memoryviews and isinstance(input_file, str) and
+            _zero_copy_possible(input_file, [])):
+        with open(input_file, "rb") as input_handle:
+            if os.fstat(input_handle.fileno()).st_size == 0:
+                return
+            # The mapping is not closed explicitly. It is released together
+            # with the last chunk that refers to it.
+            mapping = mmap.mmap(input_handle.fileno(), 0,
+                                access=mmap.ACCESS_READ)
+        position = 0
+        while position < len(mapping):
+            end = _find_record_boundary(mapping, position + buffer_size)
+            yield chunk(mapping, position, end)
+            position = end
+        return
+
+    with _open_input(input_file, threads_per_file,
+                     decompression_threads=decompression_threads
+                     ) as input_handle:
+        block_reader = _FastqBlockReader(
+            input_handle, max(DEFAULT_READ_SIZE, buffer_size * 4))
+        while True:
+            data, start, end = block_reader.next_block(buffer_size)
+            if start == end:
+                return
+            yield chunk(data, start, end)
+
+
+def _split_byte_range(input_file: str, output_file: str,
+                      start: int, end: int,
+                      compression_level: int = DEFAULT_COMPRESSION_LEVEL,
+                      buffer_size: int = DEFAULT_BUFFER_SIZE,
+                      threads_per_file: int = DEFAULT_THREADS_PER_FILE,
+                      bgzf: bool = False, align: bool = True) -> int:
+    """
+    Write the records of input_file between the record boundaries at start
+    and end to output_file.
+    :param align: If False, start and end are already record boundaries.
+    :return: The number of bytes written.
+    """
+    with open(input_file, "rb") as input_handle:
+        range_start, range_end = start, end
+        if align:
+            with _mmap_file(input_handle) as input_data:
+                range_end = _record_boundary(input_data, end)
+                range_start = _record_boundary(input_data, start)
+        remaining = max(range_end - range_start, 0)
+        if not output_file.endswith(COMPRESSED_EXTENSIONS):
+            with open(output_file, "wb") as output_handle:
+                _copy_range(input_handle.fileno(), output_handle.fileno(),
+                            range_start, remaining)
+            return remaining
+        input_handle.seek(range_start)
+        with _open_output(output_file, compression_level,
+                          threads_per_file, bgzf=bgzf) as output_handle:
+            while remaining > 0:
+                read_buffer = input_handle.read(min(buffer_size, remaining))
+                if read_buffer == b"":
+                    break
+                output_handle.write(read_buffer)
+                remaining -= len(read_buffer)
+    return max(range_end - range_start, 0)
+
+
+def split_fastqs_byte_ranges(
+        input_file: str, output_files: List[str],
+        compression_level: int = DEFAULT_COMPRESSION_LEVEL,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        threads_per_file: int = DEFAULT_THREADS_PER_FILE,
+        workers: Optional[int] = None,
+        bgzf: bool = False) -> None:
+    """
+    Split an uncompressed fastq file into contiguous parts of about equal
+    size. Each part is written by a separate process that seeks to its
+    part of the input.
+    :param input_file: The uncompressed, seekable file to be split.
+    :param output_files: The files receiving the split parts.
+    :param compression_level: Which compression level to use if applicable
+    :param buffer_size: How much data should be read at once.
+    :param threads_per_file: How many threads xopen should use to open the
+    file.
+    :param workers: The number of processes. Defaults to the number of output
+    files or the number of CPUs if that is less.
+    :param bgzf: Write '.gz' output files in BGZF format with a '.gzi' index
+    of record aligned block offsets.
+    """
+    if len(output_files) < 1:
+        raise ValueError("The number of output files should be at least 1.")
+    if input_file.endswith(COMPRESSED_EXTENSIONS) or not os.path.isfile(
+            input_file):
+        raise ValueError("Splitting in byte ranges requires an uncompressed "
+                         "regular file as input: {0}.".format(input_file))
+    input_size = os.stat(input_file).st_size
+    number_of_output_files = len(output_files)
+    boundaries = [input_size * i // number_of_output_files
+                  for i in range(number_of_output_files + 1)]
+    _write_ranges_in_parallel(input_file, output_files, boundaries,
+                              compression_level=compression_level,
+                              buffer_size=buffer_size,
+                              threads_per_file=threads_per_file,
+                              workers=workers, bgzf=bgzf)
+
+
+def _write_ranges_in_parallel(
+        input_file: str, output_files: List[str], boundaries: List[int],
+        compression_level: int = DEFAULT_COMPRESSION_LEVEL,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        threads_per_file: int = DEFAULT_THREADS_PER_FILE,
+        workers: Optional[int] = None,
+        bgzf: bool = False, align: bool = True) -> None:
+    """
+    Write the range between boundaries[i] and boundaries[i + 1] to
+    output_files[i] using a pool of processes.
+    :param align: Whether the boundaries should be moved to a record start.
+    """
+    if workers is None:
+        workers = min(len(output_files), os.cpu_count() or 1)
+    with futures.ProcessPoolExecutor(workers) as executor:
+        jobs = [executor.submit(_split_byte_range, input_file, output_file,
+                                start, end, compression_level, buffer_size,
+                                threads_per_file, bgzf, align)
+                for output_file, start, end in zip(
+                    output_files, boundaries, boundaries[1:])]
+        # Retrieve the results so errors in the workers are raised.
+        for job in jobs:
+            job.result()
+
+
+def _count_newlines(data: Any, start: int, end: int) -> int:
+    """Count the newlines in data[start:end]."""
+    if isinstance(data, (bytes, bytearray)):
+        return data.count(b"\n", start, end)
+    # mmap has no count method, so a slice is counted.
+    return data[start:end].count(b"\n")
+
+
+def _nth_newline(data: Any, number: int, start: int = 0,
+                 end: Optional[int] = None) -> int:
+    """
+    Find the position after the number-th newline in data[start:end]. Lines
+    are counted in bulk with count, first in large steps and then in small
+    steps, so only the last few lines are searched one by one.
+    :return: The position after the newline, or -1 if there are fewer lines.
+    """
+    if number < 1:
+        return start
+    end = len(data) if end is None else end
+    for step in (COUNT_STEP_SIZE * 64, COUNT_STEP_SIZE):
+        while start < end:
+            step_end = min(start + step, end)
+            lines = _count_newlines(data, start, step_end)
+            if lines >= number:
+                # The newline is in this step. Search it with smaller steps.
+                end = step_end
+                break
+            number -= lines
+            start = step_end
+        else:
+            return -1
+    for _ in range(number):
+        start = data.find(b"\n", start, end) + 1
+    return start
+
+
+def _index_file(input_file: str) -> str:
+    return input_file + INDEX_SUFFIX
+
+
+def create_index(input_file: str, index_file: Optional[str] = None,
+                 interval: int = DEFAULT_INDEX_INTERVAL,
+                 threads: int = DEFAULT_THREADS_PER_FILE) -> dict:
+    """
+    Create an index of a fastq file. The index contains the number of
+    records, the uncompressed size, and the uncompressed offset of every
+    interval-th record. It is written as JSON.
+    :param input_file: The fastq file. It may be compressed.
+    :param index_file: Where to write the index. Defaults to
+    <input_file>.fqi.
+    :param interval: The number of records between stored offsets.
+    :param threads: The number of threads xopen uses for decompression.
+    :return: The index.
+    """
+    if interval < 1:
+        raise ValueError("The index interval should be at least 1.")
+    lines_per_offset = interval * 4
+    offsets = [0]
+    # The number of lines before the next offset in the index.
+    lines_needed = lines_per_offset
+    total_lines = 0
+    uncompressed_size = 0
+    last_byte = b"\n"
+    with xopen.xopen(input_file, "rb", threads=threads) as input_handle:
+        while True:
+            chunk = input_handle.read(DEFAULT_READ_SIZE)
+            if chunk == b"":
+                break
+            lines = chunk.count(b"\n")
+            position = 0
+            remaining_lines = lines
+            while remaining_lines >= lines_needed:
+                position = _nth_newline(chunk, lines_needed, position)
+                offsets.append(uncompressed_size + position)
+                remaining_lines -= lines_needed
+                lines_needed = lines_per_offset
+            lines_needed -= remaining_lines
+            total_lines += lines
+            uncompressed_size += len(chunk)
+            last_byte = chunk[-1:]
+    if last_byte != b"\n":  # The last line has no newline.
+        total_lines += 1
+    if offsets[-1] == uncompressed_size:
+        offsets.pop()  # No record starts at the end of the file.
+    stat = os.stat(input_file)
+    index = {
+        "version": INDEX_VERSION,
+        "input_size": stat.st_size,
+        "input_mtime": stat.st_mtime,
+        "uncompressed_size": uncompressed_size,
+        "records": total_lines // 4,
+        "interval": interval,
+        "offsets": offsets
+    }
+    with open(index_file or _index_file(input_file), "wt") as index_handle:
+        json.dump(index, index_handle)
+    return index
+
+
+def read_index(input_file: str, index_file: Optional[str] = None) -> dict:
+    """
+    Read the index of input_file created with create_index. Raises a
+    ValueError if the input file has changed since the index was created.
+    """
+    index_file = index_file or _index_file(input_file)
+    with open(index_file, "rt") as index_handle:
+        index = json.load(index_handle)
+    stat = os.stat(input_file)
+    if (index.get("version") != INDEX_VERSION or
+            index["input_size"] != stat.st_size or
+            index["input_mtime"] != stat.st_mtime):
+        raise ValueError("Index {0} is out of date. Recreate it with "
+                         "'fastqsplitter index'.".format(index_file))
+    return index
+
+
+def _indexed_records_per_file(index: dict, max_size: int) -> int:
+    """
+    The number of records per file for files of at most about max_size
+    bytes, based on the average record size in the index.
+    """
+    return max(1, max_size * index["records"] //
+               max(index["uncompressed_size"], 1))
+
+
+def _indexed_intervals_per_file(index: dict, max_size: int) -> int:
+    """
+    The largest number of index intervals per file for which no file is
+    larger than max_size bytes. The files start and end at offsets in the
+    index, so their sizes are known exactly. Raises a ValueError if a single
+    interval is larger than max_size.
+    """
+    offsets = index["offsets"] + [index["uncompressed_size"]]
+    sizes = [end - start for start, end in zip(offsets, offsets[1:])]
+    if max(sizes) > max_size:
+        raise ValueError(
+            "The index has an offset every {0} records, which is too few to "
+            "keep the output files below {1} bytes. Recreate it with a "
+            "smaller interval.".format(index["interval"], max_size))
+    # Start from the number of intervals that fits on average.
+    intervals = max(1, max_size * len(sizes) // max(offsets[-1], 1))
+    while not all(offsets[min(start + intervals, len(sizes))] -
+                  offsets[start] <= max_size
+                  for start in range(0, len(sizes), intervals)):
+        intervals -= 1
+    return intervals
+
+
+def _record_offset(data: Any, index: dict, record: int) -> int:
+    """Find the offset of a record using the nearest offset in the index."""
+    if record >= index["records"]:
+        return index["uncompressed_size"]
+    sample, lines = divmod(record, index["interval"])
+    return _nth_newline(data, lines * 4, index["offsets"][sample])
+
+
+def split_fastqs_with_index(
+        input_file: str, output_files: List[str],
+        index_file: Optional[str] = None,
+        compression_level: int = DEFAULT_COMPRESSION_LEVEL,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        threads_per_file: int = DEFAULT_THREADS_PER_FILE,
+        workers: Optional[int] = None,
+        bgzf: bool = False) -> None:
+    """
+    Split an uncompressed fastq file into contiguous parts that have the same
+    number of records (plus or minus one) using its index. Only the part of
+    the input between an indexed offset and a boundary is scanned. The parts
+    are written in parallel.
+    :param input_file: The uncompressed, seekable file to be split.
+    :param output_files: The files receiving the split parts.
+    :param index_file: The index. Defaults to <input_file>.fqi.
+    :param compression_level: Which compression level to use if applicable
+    :param buffer_size: How much data should be read at once.
+    :param threads_per_file: How many threads xopen should use to open the
+    file.
+    :param workers: The number of processes. Defaults to the number of output
+    files or the number of CPUs if that is less.
+    :param bgzf: Write '.gz' output files in BGZF format with a '.gzi' index
+    of record aligned block offsets.
+    """
+    if len(output_files) < 1:
+        raise ValueError("The number of output files should be at least 1.")
+    if input_file.endswith(COMPRESSED_EXTENSIONS) or not os.path.isfile(
+            input_file):
+        raise ValueError("Splitting with an index requires an uncompressed "
+                         "regular file as input: {0}.".format(input_file))
+    index = read_index(input_file, index_file)
+    number_of_output_files = len(output_files)
+    with open(input_file, "rb") as input_handle, \
+            _mmap_file(input_handle) as input_data:
+        boundaries = [
+            _record_offset(input_data, index,
+                           index["records"] * i // number_of_output_files)
+            for i in range(number_of_output_files + 1)]
+    _write_ranges_in_parallel(input_file, output_files, boundaries,
+                              compression_level=compression_level,
+                              buffer_size=buffer_size,
+                              threads_per_file=threads_per_file,
+                              workers=workers, bgzf=bgzf, align=False)
+
+
+def _is_bgzf(input_file: str) -> bool:
+    """Whether input_file starts with a BGZF block."""
+    with open(input_file, "rb") as input_handle:
+        header = input_handle.read(BGZF_HEADER_SIZE)
+    if len(header) < BGZF_HEADER_SIZE:
+        return False
+    fields = struct.unpack(BGZF_HEADER_FORMAT, header)
+    return (fields[:4] == (31, 139, 8, 4) and
+            fields[8:10] == (ord("B"), ord("C")))
+
+
+def _bgzf_block_offsets(input_file: str, compressed_offset: int = 0,
+                        uncompressed_offset: int = 0,
+                        until: Optional[int] = None
+                        ) -> Tuple[List[int], List[int]]:
+    """
+    Find the compressed and uncompressed offsets of BGZF blocks. Only the
+    block headers and sizes are read, nothing is decompressed.
+    :param compressed_offset: The offset of the first block.
+    :param uncompressed_offset: The uncompressed offset of the first block.
+    :param until: Stop after the block that contains this uncompressed
+    offset. Defaults to the end of the file.
+    :return: Lists of the compressed and uncompressed offsets of each block.
+    Both end with the offset of the end of the last block.
+    """
+    compressed_offsets = []  # type: List[int]
+    uncompressed_offsets = []  # type: List[int]
+    with open(input_file, "rb") as input_handle:
+        file_size = os.fstat(input_handle.fileno()).st_size
+        while compressed_offset < file_size and (
+                until is None or uncompressed_offset <= until):
+            input_handle.seek(compressed_offset)
+            fields = struct.unpack(BGZF_HEADER_FORMAT,
+                                   input_handle.read(BGZF_HEADER_SIZE))
+            if fields[8:10] != (ord("B"), ord("C")):
+                raise ValueError("No BGZF block at offset {0} of {1}.".format(
+                    compressed_offset, input_file))
+            block_size = fields[11] + 1
+            # The uncompressed size is stored in the last 4 bytes.
+            input_handle.seek(compressed_offset + block_size - 4)
+            compressed_offsets.append(compressed_offset)
+            uncompressed_offsets.append(uncompressed_offset)
+            compressed_offset += block_size
+            uncompressed_offset += struct.unpack(
+                "<I", input_handle.read(4))[0]
+    compressed_offsets.append(compressed_offset)
+    uncompressed_offsets.append(uncompressed_offset)
+    return compressed_offsets, uncompressed_offsets
+
+
+def _gzip_member_offsets(input_file: str,
+                         max_member_size: Optional[int] = None
+                         ) -> Optional[Tuple[List[int], List[int]]]:
+    """
+    Find the compressed and uncompressed offsets of all gzip members. For
+    BGZF files only the block headers are read, other files are decompressed
+    once.
+    :param max_member_size: Stop and return None as soon as a member is
+    larger than this.
+    :return: Lists of the compressed and uncompressed offsets of each member.
+    Both end with the offsets of the end of the file.
+    """
+    if _is_bgzf(input_file):
+        compressed_offsets, uncompressed_offsets = _bgzf_block_offsets(
+            input_file)
+        if max_member_size is not None and any(
+                end - start > max_member_size for start, end in zip(
+                    uncompressed_offsets, uncompressed_offsets[1:])):
+            return None
+        return compressed_offsets, uncompressed_offsets
+    zlib_module = isal_zlib or zlib
+    compressed_offsets = [0]
+    uncompressed_offsets = [0]
+    compressed_offset = 0
+    uncompressed_offset = 0
+    decompressor = zlib_module.decompressobj(16 + zlib_module.MAX_WBITS)
+    with open(input_file, "rb") as input_handle:
+        for chunk in iter(lambda: input_handle.read(DEFAULT_READ_SIZE), b""):
+            while chunk:
+                uncompressed_offset += len(decompressor.decompress(chunk))
+                if (max_member_size is not None and uncompressed_offset -
+                        uncompressed_offsets[-1] > max_member_size):
+                    return None
+                if not decompressor.eof:
+                    compressed_offset += len(chunk)
+                    break
+                # The end of a member. The rest belongs to the next one.
+                compressed_offset += len(chunk) - len(
+                    decompressor.unused_data)
+                compressed_offsets.append(compressed_offset)
+                uncompressed_offsets.append(uncompressed_offset)
+                chunk = decompressor.unused_data
+                decompressor = zlib_module.decompressobj(
+                    16 + zlib_module.MAX_WBITS)
+    if compressed_offset != compressed_offsets[-1]:
+        raise ValueError("Incomplete gzip member at the end of {0}.".format(
+            input_file))
+    return compressed_offsets, uncompressed_offsets
+
+
+def _read_gzip_member(input_handle: io.BufferedReader,
+                      compressed_offsets: List[int], member: int) -> bytes:
+    """Decompress a gzip member using the offsets of all members."""
+    zlib_module = isal_zlib or zlib
+    input_handle.seek(compressed_offsets[member])
+    return zlib_module.decompress(
+        input_handle.read(compressed_offsets[member + 1] -
+                          compressed_offsets[member]),
+        16 + zlib_module.MAX_WBITS)
+
+
+def _read_bgzf_blocks(input_handle: io.BufferedReader) -> Iterator[bytes]:
+    """Decompress BGZF blocks from the current position of input_handle."""
+    decompress = (isal_zlib or zlib).decompress
+    while True:
+        header = input_handle.read(BGZF_HEADER_SIZE)
+        if len(header) < BGZF_HEADER_SIZE:
+            return
+        block_size = struct.unpack(BGZF_HEADER_FORMAT, header)[11] + 1
+        block = input_handle.read(block_size - BGZF_HEADER_SIZE)
+        # The block ends with the crc32 and the uncompressed size.
+        yield decompress(block[:-8], -15)
+
+
+def _member_record_boundary(input_handle: io.BufferedReader,
+                            compressed_offsets: List[int],
+                            uncompressed_offsets: List[int],
+                            position: int) -> int:
+    """
+    Find the uncompressed offset of the record start at or after position
+    in a file of gzip members, using the same rules as _record_boundary.
+    Only the members from position onward that are needed to find it are
+    decompressed.
+    """
+    if position == 0 or position >= uncompressed_offsets[-1]:
+        return min(position, uncompressed_offsets[-1])
+    first_member = bisect.bisect_right(uncompressed_offsets, position) - 1
+    start = uncompressed_offsets[first_member]
+    data = b""
+    for member in range(first_member, len(compressed_offsets) - 1):
+        data += _read_gzip_member(input_handle, compressed_offsets, member)
+        boundary = _find_record_boundary(data, position - start, eof=False)
+        if boundary != -1:
+            return start + boundary
+    return start + _find_record_boundary(data, position - start)
+
+
+def _write_gzip_range(input_handle: io.BufferedReader,
+                      output_handle: io.BufferedWriter,
+                      compressed_offsets: List[int],
+                      uncompressed_offsets: List[int],
+                      start: int, end: int,
+                      compression_level: int = DEFAULT_COMPRESSION_LEVEL
+                      ) -> None:
+    """
+    Write the uncompressed range from start to end of a file of gzip members
+    as gzip members. Members that are completely in the range are copied
+    without decompressing them. Only the data of the members at the edges of
+    the range is decompressed and compressed again.
+    """
+    if start >= end:
+        return
+    first_member = bisect.bisect_right(uncompressed_offsets, start) - 1
+    # The members from first_copied up to last_copied are copied.
+    first_copied = (first_member if uncompressed_offsets[first_member] ==
+                    start else first_member + 1)
+    last_copied = bisect.bisect_right(uncompressed_offsets, end) - 1
+    if first_copied > first_member:
+        data = _read_gzip_member(input_handle, compressed_offsets,
+                                 first_member)
+        member_start = uncompressed_offsets[first_member]
+        output_handle.write(_compress_gzip_member(
+            data[start - member_start:end - member_start],
+            compression_level))
+    if last_copied > first_copied:
+        output_handle.flush()
+        _copy_range(input_handle.fileno(), output_handle.fileno(),
+                    compressed_offsets[first_copied],
+                    compressed_offsets[last_copied] -
+                    compressed_offsets[first_copied])
+    # Unless the range ends in the first member, the last member is cut.
+    if (last_copied >= first_copied and
+            end > uncompressed_offsets[last_copied]):
+        data = _read_gzip_member(input_handle, compressed_offsets,
+                                 last_copied)
+        output_handle.write(_compress_gzip_member(
+            data[:end - uncompressed_offsets[last_copied]],
+            compression_level))
+
+
+def _plan_uncompressed(input_file: str, targets: Callable[[int], List[int]]
+                       ) -> Tuple[int, List[dict]]:
+    """Plan record aligned ranges in an uncompressed file."""
+    with open(input_file, "rb") as input_handle, \
+            _mmap_file(input_handle) as input_data:
+        uncompressed_size = len(input_data)
+        boundaries = [_record_boundary(input_data, target)
+                      for target in targets(uncompressed_size)]
+    return uncompressed_size, [
+        {"start": start, "end": end}
+        for start, end in zip(boundaries, boundaries[1:])]
+
+
+def _plan_bgzf(input_file: str, targets: Callable[[int], List[int]]
+               ) -> Tuple[int, List[dict]]:
+    """
+    Plan record aligned ranges in a BGZF file. Each range also contains the
+    offset of the BGZF block where it starts and its offset in that block.
+    """
+    compressed_offsets, uncompressed_offsets = _bgzf_block_offsets(
+        input_file)
+    uncompressed_size = uncompressed_offsets[-1]
+    with open(input_file, "rb") as input_handle:
+        boundaries = [
+            _member_record_boundary(input_handle, compressed_offsets,
+                                    uncompressed_offsets, target)
+            for target in targets(uncompressed_size)]
+    shards = []
+    for start, end in zip(boundaries, boundaries[1:]):
+        block = bisect.bisect_right(uncompressed_offsets, start) - 1
+        shards.append({"start": start, "end": end,
+                       "block_start": compressed_offsets[block],
+                       "block_offset": start - uncompressed_offsets[block]})
+    return uncompressed_size, shards
+
+
+def _plan_stream(input_file: str, targets: Callable[[int], List[int]],
+                 threads: int = DEFAULT_THREADS_PER_FILE
+                 ) -> Tuple[int, List[dict]]:
+    """
+    Plan record aligned ranges by reading the whole input once. The input
+    is cut into record aligned blocks and the block ends closest after the
+    targets are used. The records in each range are counted.
+    """
+    position = 0
+    records = 0
+    block_ends = [0]
+    block_records = [0]
+    step = COUNT_STEP_SIZE
+    with _open_input(input_file, threads) as input_handle:
+        block_reader = _FastqBlockReader(input_handle)
+        while True:
+            data, start, end = block_reader.next_block(step)
+            if start == end:
+                break
+            position += end - start
+            # A block only lacks a final newline at the end of the file.
+            records -= -_count_newlines(data, start, end) // 4
+            block_ends.append(position)
+            block_records.append(records)
+            if len(block_ends) > MAX_PLAN_POSITIONS:
+                # Halve the resolution to limit memory use.
+                block_ends = block_ends[::2]
+                block_records = block_records[::2]
+                step *= 2
+    if block_ends[-1] != position:
+        block_ends.append(position)
+        block_records.append(records)
+    indexes = [bisect.bisect_left(block_ends, target)
+               for target in targets(position)]
+    return position, [
+        {"start": block_ends[start], "end": block_ends[end],
+         "records": block_records[end] - block_records[start]}
+        for start, end in zip(indexes, indexes[1:])]
+
+
+def plan_split(input_file: str, manifest_file: str,
+               number: Optional[int] = None,
+               max_size: Optional[int] = None,
+               threads: int = DEFAULT_THREADS_PER_FILE) -> dict:
+    """
+    Plan a split of input_file into contiguous, record aligned ranges of
+    about equal size and write them to a manifest. Each range can then be
+    extracted independently with extract_shard, for instance on different
+    nodes of a cluster. Uncompressed files and BGZF files are not read
+    completely: uncompressed files are memory mapped and of BGZF files only
+    the block headers and the blocks around the boundaries are read. Other
+    files are read once.
+    :param input_file: The fastq file.
+    :param manifest_file: Where to write the manifest as JSON.
+    :param number: The number of ranges.
+    :param max_size: Determine the number of ranges from the uncompressed
+    size of the input instead.
+    :param threads: The number of threads xopen uses for decompression.
+    :return: The manifest.
+    """
+    if number is None and max_size is None:
+        raise ValueError("Either a number of ranges or a maximum size must "
+                         "be defined.")
+    if number is not None and number < 1:
+        raise ValueError("The number of ranges should be at least 1.")
+
+    def targets(uncompressed_size: int) -> List[int]:
+        parts = number or uncompressed_size // max_size + 1  # type: ignore
+        return [uncompressed_size * i // parts for i in range(parts + 1)]
+
+    if _is_bgzf(input_file):
+        input_format = "bgzf"
+        uncompressed_size, shards = _plan_bgzf(input_file, targets)
+    elif _zero_copy_possible(input_file, []):
+        input_format = "uncompressed"
+        uncompressed_size, shards = _plan_uncompressed(input_file, targets)
+    else:
+        input_format = "stream"
+        uncompressed_size, shards = _plan_stream(input_file, targets,
+                                                 threads)
+    stat = os.stat(input_file)
+    manifest = {
+        "version": MANIFEST_VERSION,
+        # Other nodes may use another working directory.
+        "input": os.path.abspath(input_file),
+        "input_size": stat.st_size,
+        "input_mtime": stat.st_mtime,
+        "format": input_format,
+        "uncompressed_size": uncompressed_size,
+        "shards": shards
+    }
+    with open(manifest_file, "wt") as manifest_handle:
+        json.dump(manifest, manifest_handle, indent=2)
+    return manifest
+
+
+def read_manifest(manifest_file: str) -> dict:
+    """
+    Read a manifest created with plan_split. Raises a ValueError if the
+    input file has changed since the manifest was created.
+    """
+    with open(manifest_file, "rt") as manifest_handle:
+        manifest = json.load(manifest_handle)
+    stat = os.stat(manifest["input"])
+    if (manifest.get("version") != MANIFEST_VERSION or
+            manifest["input_size"] != stat.st_size or
+            manifest["input_mtime"] != stat.st_mtime):
+        raise ValueError("Manifest {0} is out of date. Recreate it with "
+                         "'fastqsplitter plan'.".format(manifest_file))
+    return manifest
+
+
+def extract_shard(manifest_file: str, shard: int, output_file: str,
+                  compression_level: int = DEFAULT_COMPRESSION_LEVEL,
+                  buffer_size: int = DEFAULT_BUFFER_SIZE,
+                  threads_per_file: int = DEFAULT_THREADS_PER_FILE,
+                  bgzf: bool = False,
+                  passthrough: bool = False) -> int:
+    """
+    Write one range of a manifest created with plan_split to output_file.
+    Uncompressed input files are seeked to the start of the range, BGZF
+    files to the block where it starts. Other files are decompressed up to
+    the start of the range.
+    :param manifest_file: The manifest.
+    :param shard: The number of the range, starting at 0.
+    :param output_file: The file receiving the records of the range.
+    :param compression_level: Which compression level to use if applicable
+    :param buffer_size: How much data should be read at once.
+    :param threads_per_file: How many threads xopen should use to open the
+    files.
+    :param bgzf: Write a '.gz' output file in BGZF format with a '.gzi'
+    index of record aligned block offsets.
+    :param passthrough: For BGZF input and a '.gz' output file, copy the
+    blocks that are completely inside the range instead of decompressing and
+    compressing them.
+    :return: The number of bytes written.
+    """
+    manifest = read_manifest(manifest_file)
+    shards = manifest["shards"]
+    if not 0 <= shard < len(shards):
+        raise ValueError("Shard {0} does not exist, the manifest has {1} "
+                         "shards.".format(shard, len(shards)))
+    input_file = manifest["input"]
+    start = shards[shard]["start"]
+    end = shards[shard]["end"]
+    if passthrough:
+        if manifest["format"] != "bgzf" or bgzf or not output_file.endswith(
+                ".gz"):
+            raise ValueError("Passthrough requires BGZF input and a gzip "
+                             "output file that is not BGZF.")
+        compressed_offsets, uncompressed_offsets = _bgzf_block_offsets(
+            input_file, shards[shard]["block_start"],
+            start - shards[shard]["block_offset"], until=end)
+        with open(input_file, "rb") as input_handle, \
+                open(output_file, "wb") as output_handle:
+            _write_gzip_range(input_handle, output_handle,
+                              compressed_offsets, uncompressed_offsets,
+                              start, end, compression_level)
+        return end - start
+    if manifest["format"] == "uncompressed":
+        return _split_byte_range(input_file, output_file, start, end,
+                                 compression_level, buffer_size,
+                                 threads_per_file, bgzf, align=False)
+    with contextlib.ExitStack() as stack:
+        if manifest["format"] == "bgzf":
+            input_handle = stack.enter_context(open(input_file, "rb"))
+            input_handle.seek(shards[shard]["block_start"])
+            blocks = _read_bgzf_blocks(input_handle)  # type: Iterator[bytes]
+            skip = shards[shard]["block_offset"]
+        else:
+            input_handle = stack.enter_context(
+                _open_input(input_file, threads_per_file))
+            _skip_input(input_handle, start, False)
+            blocks = iter(lambda: input_handle.read(buffer_size), b"")
+            skip = 0
+        output_handle = stack.enter_context(_open_output(
+            output_file, compression_level, threads_per_file, bgzf=bgzf))
+        remaining = end - start
+        for block in blocks:
+            # The range starts in the first block.
+            block = block[skip:skip + remaining]
+            skip = 0
+            output_handle.write(block)
+            remaining -= len(block)
+            if remaining == 0:
+                break
+    return end - start - remaining
+
+
+def _fsync_path(path: str) -> None:
+    """Flush a closed file, or the entries of a directory, to disk."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class _SplitJournal(object):
+    """
+    A journal of the parts that a sequential split has completed. Every line
+    is a JSON object with the files of a part, the start and end offset of
+    the part in the uncompressed input, the end offset in the R2 input for
+    paired-end data, and the number of records. A line is only written after
+    the files of the part are closed, so an interrupted split can be resumed
+    at the end of the last part.
+    """
+
+    def __init__(self, path: str, resume: bool = False):
+        self.entries = []  # type: List[dict]
+        if resume and os.path.exists(path):
+            with open(path, "rb") as journal_handle:
+                data = journal_handle.read()
+            # A line without a newline was interrupted while being written.
+            complete = data[:data.rfind(b"\n") + 1]
+            self.entries = [json.loads(line.decode("utf-8"))
+                            for line in complete.splitlines()]
+            for filename in self.files:
+                if not os.path.exists(filename):
+                    raise ValueError("Cannot resume, file in journal does "
+                                     "not exist: {0}".format(filename))
+            self.handle = open(path, "ab")
+            self.handle.truncate(len(complete))
+        else:
+            self.handle = open(path, "wb")
+
+    @property
+    def files(self) -> List[str]:
+        """The files of all completed parts."""
+        return [filename for entry in self.entries
+                for filename in entry["files"]]
+
+    @property
+    def end(self) -> int:
+        """The input offset at which the split continues."""
+        return self.entries[-1]["end"] if self.entries else 0
+
+    @property
+    def end_r2(self) -> int:
+        """The R2 input offset at which the split continues."""
+        return self.entries[-1].get("end_r2", 0) if self.entries else 0
+
+    def add(self, files: List[str], start: int, end: int, records: int,
+            end_r2: Optional[int] = None) -> None:
+        """
+        Record a completed part and flush it to disk. The files of the part
+        and their directory entries are flushed first, so the journal never
+        lists a file that could be incomplete after a crash.
+        """
+        for filename in files:
+            _fsync_path(filename)
+        if os.name == "posix":
+            for directory in {os.path.dirname(os.path.abspath(filename))
+                              for filename in files}:
+                _fsync_path(directory)
+        entry = {"files": files, "start": start, "end": end,
+                 "records": records}  # type: Dict[str, Any]
+        if end_r2 is not None:
+            entry["end_r2"] = end_r2
+        self.handle.write(json.dumps(entry).encode("utf-8") + b"\n")
+        self.handle.flush()
+        os.fsync(self.handle.fileno())
+        self.entries.append(entry)
+
+    def close(self) -> None:
+        self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _skip_input(input_handle: Any, offset: int, seekable: bool) -> None:
+    """
+    Skip the first offset bytes of an input. A seekable input is seeked,
+    other inputs are read and the data is discarded.
+    """
+    if seekable:
+        input_handle.seek(offset)
+        return
+    while offset > 0:
+        skipped = len(input_handle.read(min(offset, DEFAULT_READ_SIZE * 4)))
+        if skipped == 0:
+            raise ValueError("The input is shorter than the journal.")
+        offset -= skipped
+
+
+def _sequential_splitter(block_reader: _FastqBlockReader,
+                         output_handle: io.BufferedWriter,
+                         max_size: int,
+                         buffer_size: int = DEFAULT_BUFFER_SIZE,
+                         mate_reader: Optional[_MateReader] = None,
+                         mate_output_handle: Optional[
+                             io.BufferedWriter] = None,
+                         tuner: Optional[BufferSizeTuner] = None
+                         ) -> int:
+    """
+    Reads max_size bytes from a block_reader and writes it to output_handle
+    reading buffer_size bytes at the time. Ensures a complete fastq record
+    is at the end of each file. If a mate_reader is given, the matching R2
+    records are written to mate_output_handle. If a tuner is given, the
+    buffer size is updated after each buffer.
+    :return: The number of bytes written.
+    """
+    total_size = 0
+    while True:
+        # The buffer size can change during the file, so the check is done
+        # with the current size.
+        last_buffer = total_size + 2 * buffer_size >= max_size
+        if last_buffer:
+            # Complete the record. Never read past max_size, also not when
+            # the buffer size has grown since the previous buffer.
+            read_buffer = block_reader.read_block(
+                min(buffer_size, max_size - total_size - 1))
+        else:
+            read_buffer = block_reader.read(buffer_size)
+        if read_buffer == b"":
+            return total_size
+        output_handle.write(read_buffer)
+        if mate_reader is not None and mate_output_handle is not None:
+            at_eof = (not read_buffer.endswith(b"\n") and
+                      block_reader.at_eof())
+            mate_output_handle.write(
+                mate_reader.read_matching(read_buffer, at_eof=at_eof))
+        total_size += len(read_buffer)
+        if tuner is not None:
+            buffer_size = tuner.update(len(read_buffer))
+        if last_buffer:
+            return total_size
+
+
+def _split_sequentially_zero_copy(input_file: str, max_size: int,
+                                  prefix: str, suffix: str,
+                                  buffer_size: int = DEFAULT_BUFFER_SIZE,
+                                  journal: Optional[_SplitJournal] = None
+                                  ) -> List[str]:
+    """
+    Sequential splitting for uncompressed files. The output files are the same
+    as those created by _sequential_splitter, but the data is copied by the
+    kernel. If a journal is given, the split continues after its last part
+    and every new part is added to it.
+    """
+    target_size = max_size - buffer_size
+    # _sequential_splitter reads this many buffers before completing the
+    # record.
+    buffers_per_file = max(1, -(-target_size // buffer_size))
+    written_files = journal.files if journal else []  # type: List[str]
+    with open(input_file, "rb") as input_handle, \
+            _mmap_file(input_handle) as input_data:
+        input_fd = input_handle.fileno()
+        input_size = os.fstat(input_fd).st_size
+        start = journal.end if journal else 0
+        while start < input_size:
+            end = _record_boundary(input_data, min(
+                start + buffers_per_file * buffer_size, input_size))
+            filename = prefix + str(len(written_files)) + suffix
+            with open(filename, "wb") as output_handle:
+                _copy_range(input_fd, output_handle.fileno(), start,
+                            end - start)
+            written_files.append(filename)
+            if journal is not None:
+                # A final record without a newline is counted as well.
+                journal.add([filename], start, end, -(-_count_newlines(
+                    input_data, start, end) // 4))
+            start = end
+    return written_files
+
+
+def _split_sequentially_passthrough(
+        input_file: str, max_size: int, prefix: str, suffix: str,
+        buffer_size: int, compression_level: int,
+        compressed_offsets: List[int], uncompressed_offsets: List[int]
+) -> List[str]:
+    """
+    Sequential splitting of a gzip file with multiple members. The output
+    files contain the same records as those created by _sequential_splitter,
+    but members that are completely inside an output file are copied
+    without decompressing and compressing them.
+    """
+    target_size = max_size - buffer_size
+    buffers_per_file = max(1, -(-target_size // buffer_size))
+    input_size = uncompressed_offsets[-1]
+    written_files = []  # type: List[str]
+    with open(input_file, "rb") as input_handle:
+        start = 0
+        while start < input_size:
+            end = _member_record_boundary(
+                input_handle, compressed_offsets, uncompressed_offsets,
+                min(start + buffers_per_file * buffer_size, input_size))
+            filename = prefix + str(len(written_files)) + suffix
+            with open(filename, "wb") as output_handle:
+                _write_gzip_range(input_handle, output_handle,
+                                  compressed_offsets, uncompressed_offsets,
+                                  start, end, compression_level)
+            written_files.append(filename)
+            start = end
+    return written_files
+
+
+def _split_by_records_zero_copy(input_file: str, records: int,
+                                prefix: str, suffix: str) -> List[str]:
+    """
+    Split an uncompressed file into files with a fixed number of records.
+    The records are counted in a reused buffer and the data is copied by the
+    kernel.
+    """
+    written_files = []  # type: List[str]
+    lines_needed = records * 4
+    read_buffer = bytearray(DEFAULT_READ_SIZE * 4)
+    with open(input_file, "rb", buffering=0) as input_handle:
+        input_fd = input_handle.fileno()
+
+        def write_part(start: int, end: int):
+            filename = prefix + str(len(written_files)) + suffix
+            with open(filename, "wb") as output_handle:
+                _copy_range(input_fd, output_handle.fileno(), start,
+                            end - start)
+            written_files.append(filename)
+
+        part_start = 0
+        offset = 0
+        while True:
+            size = input_handle.readinto(read_buffer)
+            if not size:
+                break
+            position = 0
+            while True:
+                lines = read_buffer.count(b"\n", position, size)
+                if lines < lines_needed:
+                    lines_needed -= lines
+                    break
+                position = _nth_newline(read_buffer, lines_needed, position,
+                                        size)
+                write_part(part_start, offset + position)
+                part_start = offset + position
+                lines_needed = records * 4
+            offset += size
+        if part_start < offset:
+            write_part(part_start, offset)
+    return written_files
+
+
+def split_fastqs_by_records(
+        input_file: InputFiles,
+        records: int,
+        prefix: str = "split.",
+        suffix: str = DEFAULT_SUFFIX,
+        buffer_size: BufferSize = DEFAULT_BUFFER_SIZE,
+        compression_level: int = DEFAULT_COMPRESSION_LEVEL,
+        threads_per_file: int = DEFAULT_THREADS_PER_FILE,
+        input_file_r2: Optional[InputFiles] = None,
+        compression_threads: int = 0,
+        bgzf: bool = False,
+        stats: Optional[SplitStatistics] = None,
+        decompression_threads: int = 0) -> List[str]:
+    """
+    Read an input file and create a new output file for every records
+    records. Records are not parsed, but newlines are counted in bulk.
+    :param input_file: The input fastq. Or a list of files which are split as
+    if they were concatenated.
+    :param records: The number of records in each output file. The last file
+    may have less.
+    :param prefix: Prefix for the output files.
+    :param suffix: Suffix for the output files.
+    :param buffer_size: How much data should be read at once. Or a
+    BufferSizeTuner to determine it during the run.
+    :param compression_level: The compression level if a '.gz' suffix is used.
+    :param threads_per_file: The number of compression threads per file.
+    :param input_file_r2: Optional R2 file of a paired-end pair. It is split
+    in lockstep with input_file. Output files are named
+    <prefix><number>.R1<suffix> and <prefix><number>.R2<suffix>.
+    :param compression_threads: If larger than 0, '.gz' output files are
+    compressed on a shared pool of this many threads.
+    :param bgzf: Write '.gz' output files in BGZF format with a '.gzi' index
+    of record aligned block offsets.
+    :param stats: If given, statistics of the split are added to it.
+    :param decompression_threads: If larger than 0, BGZF input and bzip2
+    input of multiple streams, as written by pbzip2, is decompressed in
+    parallel on this many threads.
+    :return: A list of written files. For paired-end input the R1 and R2 file
+    of each part follow each other.
+    """
+    buffer_size, tuner = _buffer_size_tuner(buffer_size)
+    if records < 1:
+        raise ValueError("The number of records per file should be at least "
+                         "1.")
+    if (isinstance(input_file, str) and input_file_r2 is None and
+            stats is None and _zero_copy_possible(input_file, [suffix])):
+        return _split_by_records_zero_copy(input_file, records, prefix,
+                                           suffix)
+    lines_per_file = records * 4
+    written_files = []  # type: List[str]
+    with contextlib.ExitStack() as stack:
+        compression_pool = _compression_pool(stack, compression_threads)
+        input_handle = stack.enter_context(
+            _open_input(input_file, threads_per_file, stats,
+                        decompression_threads=decompression_threads))
+        mate_reader = None  # type: Optional[_MateReader]
+        if input_file_r2 is not None:
+            mate_reader = _MateReader(stack.enter_context(
+                _open_input(input_file_r2, threads_per_file, stats,
+                            decompression_threads=decompression_threads)))
+        # A separate stack for the output files of the current part.
+        output_stack = stack.enter_context(contextlib.ExitStack())
+        output_handles = []  # type: List[Any]
+        # Lines that still fit in the current part.
+        lines_needed = 0
+        chunk = input_handle.read(buffer_size)
+        while chunk:
+            next_chunk = input_handle.read(buffer_size)
+            position = 0
+            while position < len(chunk):
+                if lines_needed == 0:
+                    # Start a new part.
+                    output_stack.close()
+                    if mate_reader is None:
+                        filenames = [prefix + str(len(written_files)) + suffix]
+                    else:
+                        filenames = list(paired_filenames(
+                            prefix, len(written_files) // 2, suffix))
+                    output_handles = [output_stack.enter_context(
+                        _open_output(filename, compression_level,
+                                     threads_per_file, compression_pool,
+                                     max(2, 2 * compression_threads), bgzf,
+                                     stats))
+                        for filename in filenames]
+                    written_files.extend(filenames)
+                    lines_needed = lines_per_file
+                start = time.perf_counter() if stats is not None else 0.0
+                lines = chunk.count(b"\n", position)
+                if lines < lines_needed:
+                    end = len(chunk)
+                    lines_needed -= lines
+                else:
+                    end = _nth_newline(chunk, lines_needed, position)
+                    lines_needed = 0
+                if stats is not None:
+                    stats.scan_time = (stats.scan_time or 0.0) + (
+                        time.perf_counter() - start)
+                part = chunk[position:end]
+                output_handles[0].write(part)
+                if mate_reader is not None:
+                    output_handles[1].write(mate_reader.read_matching(
+                        part, at_eof=(end == len(chunk) and not next_chunk)))
+                position = end
+            if tuner is not None:
+                buffer_size = tuner.update(len(chunk))
+            chunk = next_chunk
+        if mate_reader is not None:
+            mate_reader.check_eof()
+    return written_files
+
+
+def split_fastqs_sequentially(
+        input_file: InputFiles,
+        max_size: int,
+        prefix: str = "split.",
+        suffix: str = DEFAULT_SUFFIX,
+        buffer_size: BufferSize = DEFAULT_BUFFER_SIZE,
+        compression_level: int = DEFAULT_COMPRESSION_LEVEL,
+        threads_per_file: int = DEFAULT_THREADS_PER_FILE,
+        input_file_r2: Optional[InputFiles] = None,
+        compression_threads: int = 0,
+        bgzf: bool = False,
+        stats: Optional[SplitStatistics] = None,
+        compressed_max_size: bool = False,
+        journal: Optional[str] = None,
+        resume: bool = False,
+        passthrough: bool = False,
+        decompression_threads: int = 0) -> List[str]:
+    """
+    Read an input file and create a new split output file for every
+    max_size bytes read.
+    :param input_file: The input fastq. Or a list of files which are split as
+    if they were concatenated.
+    :param max_size: The maximum size of bytes that should be in the output
+    files.
+    :param prefix: Prefix for the output files.
+    :param suffix: Suffix for the output files.
+    :param buffer_size: How much data should be read at once. Or a
+    BufferSizeTuner to determine it during the run.
+    :param compression_level: The compression level if a '.gz' suffix is used.
+    :param threads_per_file: The number of compressen threads per file.
+    :param input_file_r2: Optional R2 file of a paired-end pair. It is split
+    in lockstep with input_file. Output files are named
+    <prefix><number>.R1<suffix> and <prefix><number>.R2<suffix>. max_size
+    applies to the R1 files.
+    :param compression_threads: If larger than 0, '.gz' output files are
+    compressed on a shared pool of this many threads.
+    :param bgzf: Write '.gz' output files in BGZF format with a '.gzi' index
+    of record aligned block offsets.
+    :param stats: If given, statistics of the split are added to it.
+    :param compressed_max_size: max_size is the size of the compressed
+    output files on disk. The compression ratio is estimated from the start
+    of the input and updated with the real ratio of each written file.
+    :param journal: A file in which every completed output file is recorded
+    with its input offsets and number of records.
+    :param resume: Continue after the last output file in the journal
+    instead of starting over. Seekable inputs are seeked to the end of that
+    file, other inputs are read up to it without writing anything. The split
+    must be resumed with the same input files and settings.
+    :param passthrough: For a gzip input file with multiple members, such as
+    a BGZF file, and gzip output files: copy the members that are completely
+    inside an output file instead of decompressing and compressing them.
+    Only the members at the edges of the output files are compressed again
+    with compression_level. When the members are large compared with
+    max_size and buffer_size, for instance in a file with a single member,
+    a warning is given and the input is split normally. Cannot be combined
+    with stats or with compression or decompression threads.
+    :param decompression_threads: If larger than 0, BGZF input and bzip2
+    input of multiple streams, as written by pbzip2, is decompressed in
+    parallel on this many threads.
+    :return: A list of written files. For paired-end input the R1 and R2 file
+    of each part follow each other.
+    """
+    buffer_size, tuner = _buffer_size_tuner(buffer_size)
+    if tuner is not None:
+        # Files should still consist of several buffers.
+        tuner.limit(max_size // 4)
+        buffer_size = tuner.size
+    if max_size < buffer_size:
+        raise ValueError("Maximum size {0} should be larger than buffer size "
+                         "{1}.".format(max_size, buffer_size))
+    if resume and journal is None:
+        raise ValueError("Resuming a split requires a journal.")
+    if passthrough:
+        if (not isinstance(input_file, str) or
+                not input_file.endswith(".gz") or
+                not suffix.endswith(".gz") or input_file_r2 is not None or
+                journal is not None or compressed_max_size or bgzf):
+            raise ValueError("Passthrough requires a single gzip input file "
+                             "and gzip output files. It cannot be combined "
+                             "with paired-end input, a journal, compressed "
+                             "sizes or BGZF output.")
+        # The copied members are not counted or compressed on threads.
+        if (stats is not None or compression_threads > 0 or
+                decompression_threads > 0):
+            raise ValueError("Passthrough cannot be combined with "
+                             "statistics or compression and decompression "
+                             "threads.")
+        # The members at the edges of each output file are decompressed,
+        # which is only worthwhile when they are small compared to the file.
+        member_offsets = _gzip_member_offsets(input_file, max(
+            buffer_size, max_size // PASSTHROUGH_MIN_MEMBERS_PER_FILE))
+        if member_offsets is not None and len(member_offsets[0]) > 2:
+            return _split_sequentially_passthrough(
+                input_file, max_size, prefix, suffix, buffer_size,
+                compression_level, *member_offsets)
+        warnings.warn("The gzip members of {0} are too large to copy them "
+                      "to the output files. It is split without "
+                      "passthrough.".format(input_file))
+
+    with contextlib.ExitStack() as stack:
+        split_journal = None  # type: Optional[_SplitJournal]
+        journal_stats = None  # type: Optional[SplitStatistics]
+        if journal is not None:
+            split_journal = stack.enter_context(
+                _SplitJournal(journal, resume))
+            # Counts the records of each output file.
+            journal_stats = SplitStatistics()
+        if (isinstance(input_file, str) and input_file_r2 is None and
+                stats is None and _zero_copy_possible(input_file, [suffix])):
+            return _split_sequentially_zero_copy(
+                input_file, max_size, prefix, suffix, buffer_size,
+                split_journal)
+        compression_pool = _compression_pool(stack, compression_threads)
+        input_handle = stack.enter_context(
+            _open_input(input_file, threads_per_file, stats,
+                        decompression_threads=decompression_threads))
+        mate_reader = None  # type: Optional[_MateReader]
+        if input_file_r2 is not None:
+            mate_reader = _MateReader(stack.enter_context(
+                _open_input(input_file_r2, threads_per_file, stats,
+                            decompression_threads=decompression_threads)))
+        group_number = 0
+        written_files = []  # type: List[str]
+        offset = 0
+        if split_journal is not None:
+            group_number = len(split_journal.entries)
+            written_files = split_journal.files
+            offset = split_journal.end
+            _skip_input(input_handle, offset,
+                        _zero_copy_possible(input_file, []))
+            if mate_reader is not None and input_file_r2 is not None:
+                _skip_input(mate_reader.input_handle, split_journal.end_r2,
+                            _zero_copy_possible(input_file_r2, []))
+                mate_reader.offset = split_journal.end_r2
+        input_fastq = _FastqBlockReader(
+            input_handle, max(DEFAULT_READ_SIZE, buffer_size * 4), stats)
+        compressed = (compressed_max_size and
+                      suffix.endswith(COMPRESSED_EXTENSIONS))
+        file_max_size = max_size
+        ratio = 1.0
+        if compressed:
+            # Sample the data in the reader, so it also works for stdin.
+            input_fastq.at_eof()
+            ratio = _compression_ratio(
+                input_fastq.data[:COMPRESSION_SAMPLE_SIZE], suffix,
+                compression_level)
+        while True:
+            if compressed:
+                file_max_size = max(
+                    int(max_size / ratio * COMPRESSED_SIZE_MARGIN),
+                    2 * buffer_size)
+            if input_fastq.at_eof():  # Quit if there are no bytes left
+                if mate_reader is not None:
+                    mate_reader.check_eof()
+                return written_files
+            if mate_reader is None:
+                filenames = [prefix + str(group_number) + suffix]
+            else:
+                filenames = list(
+                    paired_filenames(prefix, group_number, suffix))
+            group_number += 1  # Increase group_number for the next file
+            with contextlib.ExitStack() as output_stack:
+                output_fastqs = [output_stack.enter_context(_open_output(
+                    filename, compression_level, threads_per_file,
+                    compression_pool, max(2, 2 * compression_threads), bgzf,
+                    stats))
+                    for filename in filenames]
+                if journal_stats is not None:
+                    output_fastqs[0] = _CountingWriter(
+                        output_fastqs[0], journal_stats.output(filenames[0]))
+                written = _sequential_splitter(
+                    input_fastq, output_fastqs[0],
+                    file_max_size,
+                    buffer_size=buffer_size,
+                    mate_reader=mate_reader,
+                    mate_output_handle=(output_fastqs[1] if mate_reader
+                                        else None),
+                    tuner=tuner)
+                if tuner is not None:
+                    buffer_size = tuner.size
+                written_files.extend(filenames)
+            if split_journal is not None and journal_stats is not None:
+                split_journal.add(
+                    filenames, offset, offset + written,
+                    journal_stats.output(filenames[0])["records"],
+                    mate_reader.offset if mate_reader is not None else None)
+            offset += written
+            if compressed and written:
+                # Use the real ratio of this file for the next file.
+                ratio = os.path.getsize(filenames[0]) / written
+
+
+def _record_lines(block: bytes) -> List[bytes]:
+    """
+    Split a record aligned block into lines without newlines. Every four
+    lines form a record.
+    """
+    lines = block.split(b"\n")
+    if lines[-1] == b"":
+        lines.pop()
+    if len(lines) % 4 != 0:
+        raise ValueError("The input ends with an incomplete record.")
+    return lines
+
+
+def read_barcode_table(barcode_table: str) -> Dict[bytes, str]:
+    """
+    Read a table with a barcode and a sample name on each line, separated by
+    whitespace. Empty lines and lines starting with '#' are skipped. Dual
+    indexes are written as they appear in the FASTQ header, for example
+    ACGTACGT+TTGCAAGC. A sample can have multiple barcodes. Sample names are
+    used in the output filenames, so they cannot contain a path separator or
+    '..'.
+    :return: A dictionary from barcode to sample name.
+    """
+    barcodes = {}  # type: Dict[bytes, str]
+    with open(barcode_table, "rt") as table_handle:
+        for line_number, line in enumerate(table_handle, start=1):
+            fields = line.split()
+            if not fields or fields[0].startswith("#"):
+                continue
+            if len(fields) != 2:
+                raise ValueError(
+                    "Line {0} of {1} should contain a barcode and a sample "
+                    "name.".format(line_number, barcode_table))
+            barcode, sample = fields[0].encode("ascii"), fields[1]
+            if ".." in sample or any(separator in sample for separator in
+                                     ("/", os.sep, os.altsep) if separator):
+                raise ValueError(
+                    "Sample name {0} on line {1} of {2} cannot contain a "
+                    "path separator or '..'.".format(
+                        sample, line_number, barcode_table))
+            if barcodes.get(barcode, sample) != sample:
+                raise ValueError("Barcode {0} is used for samples {1} and "
+                                 "{2}.".format(fields[0], barcodes[barcode],
+                                               sample))
+            barcodes[barcode] = sample
+    return barcodes
+
+
+class _SampleShards(object):
+    """
+    The output files of one sample. Data is written round-robin over number
+    files, or to consecutive files of at most max_size bytes.
+    """
+
+    def __init__(self, stack: contextlib.ExitStack, prefix: str, suffix: str,
+                 open_output: Callable[[str], Any],
+                 number: Optional[int] = None,
+                 max_size: Optional[int] = None):
+        self.prefix = prefix
+        self.suffix = suffix
+        self.open_output = open_output
+        self.max_size = max_size
+        self.filenames = []  # type: List[str]
+        self.output_handles = []  # type: List[Any]
+        self.group_number = 0
+        self.written = 0
+        if number is not None:
+            for _ in range(number):
+                self._open_next(stack)
+        else:
+            # Only the current file is open.
+            self.output_stack = stack.enter_context(contextlib.ExitStack())
+
+    def _open_next(self, stack: contextlib.ExitStack) -> None:
+        filename = self.prefix + str(len(self.filenames)) + self.suffix
+        self.output_handles.append(
+            stack.enter_context(self.open_output(filename)))
+        self.filenames.append(filename)
+
+    def write(self, data: bytes) -> None:
+        """Write data which consists of complete records."""
+        if self.max_size is None:
+            self.output_handles[self.group_number].write(data)
+            self.group_number += 1
+            if self.group_number == len(self.output_handles):
+                self.group_number = 0
+            return
+        if not self.filenames or (self.written and
+                                  self.written + len(data) > self.max_size):
+            self.output_stack.close()
+            self.output_handles = []
+            self._open_next(self.output_stack)
+            self.written = 0
+        self.output_handles[-1].write(data)
+        self.written += len(data)
+
+
+def split_fastqs_by_barcode(
+        input_file: InputFiles,
+        barcodes: Dict[bytes, str],
+        prefix: str = "split.",
+        suffix: str = DEFAULT_SUFFIX,
+        number: Optional[int] = None,
+        max_size: Optional[int] = None,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        compression_level: int = DEFAULT_COMPRESSION_LEVEL,
+        threads_per_file: int = DEFAULT_THREADS_PER_FILE,
+        compression_threads: int = 0,
+        bgzf: bool = False,
+        stats: Optional[SplitStatistics] = None,
+        decompression_threads: int = 0) -> List[str]:
+    """
+    Demultiplex and split a fastq file in one pass. The barcode of each
+    record is read from the last ':' separated field of the header, as in
+    Illumina headers such as '@name 1:N:0:ACGTACGT'. Each sample gets its own
+    output files named <prefix><sample>.<number><suffix>. Records with an
+    unknown barcode go to the sample UNDETERMINED_SAMPLE.
+    :param input_file: The input fastq. Or a list of files which are split as
+    if they were concatenated.
+    :param barcodes: A dictionary from barcode to sample name.
+    :param prefix: Prefix for the output files.
+    :param suffix: Suffix for the output files.
+    :param number: Distribute the records of each sample round-robin over
+    this number of files.
+    :param max_size: Write the records of each sample to consecutive files
+    of at most max_size bytes. Used when number is not given.
+    :param buffer_size: The size of the blocks which are demultiplexed at
+    once.
+    :param compression_level: The compression level if a '.gz' suffix is used.
+    :param threads_per_file: The number of compression threads per file.
+    :param compression_threads: If larger than 0, '.gz' output files are
+    compressed on a shared pool of this many threads.
+    :param bgzf: Write '.gz' output files in BGZF format with a '.gzi' index
+    of record aligned block offsets.
+    :param stats: If given, statistics of the split are added to it.
+    :param decompression_threads: If larger than 0, BGZF input and bzip2
+    input of multiple streams, as written by pbzip2, is decompressed in
+    parallel on this many threads.
+    :return: A list of written files, grouped by sample.
+    """
+    if number is None and max_size is None:
+        raise ValueError("Either a number of files or a maximum size must be "
+                         "defined.")
+    if number is not None and number < 1:
+        raise ValueError("The number of output files should be at least 1.")
+    if max_size is not None and max_size < buffer_size:
+        raise ValueError("Maximum size {0} should be larger than buffer size "
+                         "{1}.".format(max_size, buffer_size))
+    samples = sorted(set(barcodes.values()) | {UNDETERMINED_SAMPLE})
+    with contextlib.ExitStack() as stack:
+        compression_pool = _compression_pool(stack, compression_threads)
+        block_reader = _FastqBlockReader(
+            stack.enter_context(_open_input(
+                input_file, threads_per_file, stats,
+                decompression_threads=decompression_threads)),
+            max(DEFAULT_READ_SIZE, buffer_size * 4), stats)
+
+        def open_output(filename: str) -> Any:
+            return _open_output(filename, compression_level,
+                                threads_per_file, compression_pool,
+                                max(2, 2 * compression_threads), bgzf,
+                                stats)
+
+        shards = {sample: _SampleShards(stack, prefix + sample + ".", suffix,
+                                        open_output, number, max_size)
+                  for sample in samples}
+        while True:
+            block = block_reader.read_block(buffer_size)
+            if block == b"":
+                break
+            lines = _record_lines(block)
+            sample_lines = collections.defaultdict(
+                list)  # type: Dict[str, List[bytes]]
+            for i in range(0, len(lines), 4):
+                header = lines[i]
+                sample = barcodes.get(header[header.rfind(b":") + 1:],
+                                      UNDETERMINED_SAMPLE)
+                sample_lines[sample].extend(lines[i:i + 4])
+            for sample, record_lines in sample_lines.items():
+                # Add the final newline.
+                record_lines.append(b"")
+                shards[sample].write(b"\n".join(record_lines))
+    return [filename for sample in samples
+            for filename in shards[sample].filenames]
+
+
+def _name_hashes(headers: List[bytes]) -> List[int]:
+    """
+    Return a hash of the read name in each header. The name ends at the
+    first whitespace. A '/1' or '/2' mate suffix is ignored, so mates get the
+    same hash. crc32 is used because it is fast and the same on every machine
+    and Python process. Mate suffixes are removed from all names at once,
+    which is much faster than checking every name.
+    """
+    names = [header.split(None, 1)[0] for header in headers]
+    joined_names = b"\n".join(names)
+    if (b"/1\n" in joined_names or b"/2\n" in joined_names or
+            joined_names.endswith((b"/1", b"/2"))):
+        names = MATE_SUFFIX.sub(b"", joined_names).split(b"\n")
+    return list(map(zlib.crc32, names))
+
+
+def split_fastqs_by_name_hash(
+        input_file: InputFiles, output_files: List[str],
+        compression_level: int = DEFAULT_COMPRESSION_LEVEL,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        threads_per_file: int = DEFAULT_THREADS_PER_FILE,
+        compression_threads: int = 0,
+        bgzf: bool = False,
+        stats: Optional[SplitStatistics] = None,
+        decompression_threads: int = 0) -> None:
+    """
+    Split a fastq file by writing each record to output number
+    crc32(read name) % len(output_files). A read always ends up in the same
+    output number, so R1 and R2 files, or the same file on different
+    machines, can be split independently and still match.
+    :param input_file: The file to be split. Or a list of files which are
+    split as if they were concatenated.
+    :param output_files: The files receiving the split parts
+    :param compression_level: Which compression level to use if applicable
+    :param buffer_size: The size of the blocks which are distributed at once.
+    :param threads_per_file: How many threads xopen should use to open the
+    file.
+    :param compression_threads: If larger than 0, '.gz' output files are
+    compressed on a shared pool of this many threads.
+    :param bgzf: Write '.gz' output files in BGZF format with a '.gzi' index
+    of record aligned block offsets.
+    :param stats: If given, statistics of the split are added to it.
+    :param decompression_threads: If larger than 0, BGZF input and bzip2
+    input of multiple streams, as written by pbzip2, is decompressed in
+    parallel on this many threads.
+    """
+    if len(output_files) < 1:
+        raise ValueError("The number of output files should be at least 1.")
+    number_of_output_files = len(output_files)
+    with contextlib.ExitStack() as stack:
+        compression_pool = _compression_pool(stack, compression_threads)
+        block_reader = _FastqBlockReader(
+            stack.enter_context(
+                _open_input(input_file, threads_per_file, stats,
+                            decompression_threads=decompression_threads)),
+            max(DEFAULT_READ_SIZE, buffer_size * 4), stats)
+        output_handles = [stack.enter_context(_open_output(
+                output_file, compression_level, threads_per_file,
+                compression_pool, max(2, 2 * compression_threads), bgzf,
+                stats)
+            ) for output_file in output_files
+        ]  # type: List[Any]
+        while True:
+            block = block_reader.read_block(buffer_size)
+            if block == b"":
+                return
+            lines = _record_lines(block)
+            # The records are grouped per output as tuples of four lines.
+            # Each group is joined once, so there is little work per record.
+            output_records = [[] for _ in output_files
+                              ]  # type: List[List[Tuple[bytes, ...]]]
+            append_to = [records.append for records in output_records]
+            line_iterator = iter(lines)
+            for name_hash, record in zip(
+                    _name_hashes(lines[0::4]),
+                    zip(line_iterator, line_iterator, line_iterator,
+                        line_iterator)):
+                append_to[name_hash % number_of_output_files](record)
+            for output_handle, records in zip(output_handles,
+                                              output_records):
+                if records:
+                    output_handle.write(b"\n".join(
+                        itertools.chain.from_iterable(records)) + b"\n")
+
+
+def fastqsplitter(input: InputFiles,
+                  output: Optional[List[str]] = None,
+                  number: Optional[int] = None,
+                  max_size: Optional[int] = None,
+                  prefix: Optional[str] = None,
+                  suffix: str = DEFAULT_SUFFIX,
+                  buffer_size: BufferSize = DEFAULT_BUFFER_SIZE,
+                  compression_level: int = DEFAULT_COMPRESSION_LEVEL,
+                  threads_per_file: int = DEFAULT_THREADS_PER_FILE,
+                  round_robin: bool = True,
+                  input_r2: Optional[InputFiles] = None,
+                  output_r2: Optional[List[str]] = None,
+                  compression_threads: int = 0,
+                  byte_ranges: bool = False,
+                  bgzf: bool = False,
+                  use_index: bool = False,
+                  records: Optional[int] = None,
+                  queue_depth: int = 0,
+                  least_busy: bool = False,
+                  balance_tolerance: float = DEFAULT_BALANCE_TOLERANCE,
+                  stats: Optional[SplitStatistics] = None,
+                  barcodes: Optional[str] = None,
+                  hash_by_name: bool = False,
+                  compressed_max_size: bool = False,
+                  fifo: bool = False,
+                  exec_command: Optional[str] = None,
+                  journal: Optional[str] = None,
+                  resume: bool = False,
+                  passthrough: bool = False,
+                  decompression_threads: int = 0,
+                  max_open_files: int = 0) -> List[str]:
+    """
+    Splits fastq files sequentially or round_robin depending on the given
+    parameters. Creates files of the from <prefix><number><suffix>.
+    In paired-end mode files of the form <prefix><number>.R1<suffix> and
+    <prefix><number>.R2<suffix> are created.
+    :param input: The input fastq file. Or a list of input files which are
+    split as if they were concatenated.
+    :param output: An optional list of output files if filenames should be
+    determined before hand.
+    :param number: Optional number of output files.
+    :param max_size: Try to determine the number of output files by the size
+    of the input file and the maximum size. Or if round_robin = false this is
+    the maximum amount of bytes written.
+    :param prefix: The prefix for the output files.
+    :param suffix: The suffix for the output files. ".gz" files are gzip
+    compressed, ".xz" xz compressed and ".bzip2" bzip2 compressed.
+    :param buffer_size: The granularity with which the fastq files should be
+    distributed. Or a BufferSizeTuner to determine the fastest buffer size
+    during the run. The tuner is not used for byte ranges or index based
+    splitting, as these write in separate processes.
+    :param compression_level: The compression level to use, if applicable.
+    :param threads_per_file: The amount of threads xopen should use to open
+    the file.
+    :param round_robin: If set to false will force the sequential method if
+    a file is given.
+    :param input_r2: The optional R2 file of a paired-end pair. It is split in
+    lockstep with input. A list when input is a list.
+    :param output_r2: The R2 output files if output is given in paired-end
+    mode.
+    :param compression_threads: If larger than 0, '.gz' output files are
+    compressed in-process on a shared pool of this many threads.
+    :param byte_ranges: Split an uncompressed input file into contiguous
+    parts which are written in parallel instead of using round-robin. Raises
+    a ValueError when combined with a sequential split.
+    :param bgzf: Write '.gz' output files in BGZF format with a '.gzi' index
+    of record aligned block offsets.
+    :param use_index: Use the index of the input file (<input>.fqi) to split
+    it into parts with an equal number of records. The number of records and
+    the uncompressed size in the index are used to determine the number of
+    files from max_size. In round-robin mode with max_size, compressed input
+    is split sequentially in files of whole index intervals that are at most
+    max_size. Otherwise the index is not used for compressed input.
+    :param records: Create output files sequentially with this number of
+    records each.
+    :param queue_depth: If larger than 0, each output file is written by its
+    own thread from a queue of at most this many blocks in round-robin mode.
+    Raises a ValueError outside round-robin mode.
+    :param least_busy: Write each block to the output with the least blocks
+    waiting instead of using round-robin. Raises a ValueError outside
+    round-robin mode.
+    :param balance_tolerance: With least_busy, how far the number of records
+    in the outputs may differ, as a fraction of the mean.
+    :param stats: If given, statistics of the split, such as the bytes and
+    records written per output and the time spent reading, finding record
+    boundaries and writing, are added to it.
+    :param barcodes: A barcode table as read by read_barcode_table. The
+    records are demultiplexed by the barcode in their header and the records
+    of each sample are split over number files, or files of at most max_size
+    bytes.
+    :param hash_by_name: Write each record to output number
+    crc32(read name) % number of outputs. In paired-end mode, the R1 and R2
+    files are split independently.
+    :param compressed_max_size: max_size is the size of the output files on
+    disk after compression. In round-robin mode the number of files is
+    based on compression ratios estimated from the start of the input. In
+    sequential mode the ratio is also updated after each written file.
+    Raises a ValueError if max_size is not given.
+    :param fifo: Create the output files as named pipes and write to them
+    in round-robin mode. Each pipe is written by its own thread, so the
+    processes reading the pipes can connect in any order.
+    :param exec_command: A shell command in which {} is replaced with the
+    output number. Instead of writing output files, one command is started
+    per output and the records are written uncompressed to its stdin in
+    round-robin mode.
+    :param journal: In sequential mode, record every completed output file
+    in this file.
+    :param resume: In sequential mode, continue after the last output file
+    in the journal instead of starting over.
+    :param passthrough: In sequential mode, copy the gzip members of a
+    multi-member or BGZF input file that are completely inside an output
+    file instead of decompressing and compressing them.
+    :param decompression_threads: If larger than 0, BGZF input and bzip2
+    input of multiple streams is decompressed in parallel on this many
+    threads.
+    :param max_open_files: If larger than 0, keep at most this many output
+    files open in round-robin mode. The least recently written output is
+    closed and opened again in append mode when it is needed, so
+    compressed outputs then consist of multiple gzip members.
+    :raises subprocess.CalledProcessError: if a command fails.
+    :return: The list of output files written. In paired-end mode the R1 and
+    R2 files of each part follow each other.
+    """
+    start_time = time.perf_counter()
+
+    def finish(written_files: List[str]) -> List[str]:
+        if stats is not None:
+            stats.finish(written_files, time.perf_counter() - start_time)
+            stats.buffer_size = (
+                buffer_size.chosen_size
+                if isinstance(buffer_size, BufferSizeTuner) else buffer_size)
+        return written_files
+
+    if not isinstance(input, str) and len(input) == 1:
+        input = input[0]
+    if input_r2 is not None and not isinstance(input_r2, str) and len(
+            input_r2) == 1:
+        input_r2 = input_r2[0]
+    input_files = [input] if isinstance(input, str) else input
+    default_prefix = os.path.basename(
+        input_files[0]).rstrip(".gz").rstrip(".fastq").rstrip(".fq") + "."
+    prefix = prefix if prefix is not None else default_prefix
+
+    sequential = not round_robin or (STDIN in input_files and
+                                     max_size is not None)
+    # Compressed input cannot be split in ranges. In round-robin mode with
+    # max_size it is split in files of whole index intervals that are at most
+    # max_size. This is done before the options are checked, because it turns
+    # the split into a split by records.
+    if (use_index and isinstance(input, str) and
+            not _zero_copy_possible(input, []) and max_size is not None and
+            records is None and barcodes is None and not output and
+            not sequential and not compressed_max_size):
+        compressed_index = read_index(input)
+        records = compressed_index["interval"] * _indexed_intervals_per_file(
+            compressed_index, max_size)
+    if (fifo or exec_command is not None) and (
+            barcodes is not None or records is not None or sequential or
+            use_index or byte_ranges or hash_by_name):
+        raise ValueError("Named pipes and commands can only be written in "
+                         "round-robin mode.")
+    if exec_command is not None and input_r2 is not None:
+        raise ValueError("Commands cannot be executed in paired-end mode.")
+    if journal is not None and (barcodes is not None or records is not None
+                                or not sequential):
+        raise ValueError("A journal can only be used when splitting "
+                         "sequentially.")
+    if resume and journal is None:
+        raise ValueError("Resuming a split requires a journal.")
+    if max_open_files and (barcodes is not None or records is not None or
+                           sequential or use_index or byte_ranges or
+                           hash_by_name):
+        raise ValueError("A maximum number of open files can only be used "
+                         "in round-robin mode.")
+    if passthrough and (barcodes is not None or records is not None or
+                        not sequential):
+        raise ValueError("Passthrough can only be used when splitting "
+                         "sequentially.")
+    if compressed_max_size and (max_size is None or barcodes is not None or
+                                records is not None or output):
+        raise ValueError("A compressed maximum size requires a maximum "
+                         "size. It cannot be combined with barcodes, records "
+                         "or output files.")
+    if byte_ranges and (barcodes is not None or records is not None or
+                        sequential or use_index):
+        raise ValueError("Byte ranges can only be used instead of "
+                         "round-robin. They cannot be combined with a "
+                         "sequential split, barcodes, records or an index.")
+    if queue_depth and (barcodes is not None or records is not None or
+                        sequential or use_index or byte_ranges or
+                        hash_by_name):
+        raise ValueError("A queue depth can only be used in round-robin "
+                         "mode.")
+    if least_busy and (barcodes is not None or records is not None or
+                       sequential or use_index or byte_ranges):
+        raise ValueError("The least busy distribution can only be used in "
+                         "round-robin mode.")
+    if hash_by_name and (barcodes is not None or records is not None or
+                         sequential or least_busy or use_index or
+                         byte_ranges):
+        raise ValueError("Splitting by read name hash can only be used in "
+                         "round-robin mode. It cannot be combined with "
+                         "barcodes, records, the least busy distribution, "
+                         "an index or byte ranges.")
+    index = {}  # type: dict
+    if use_index:
+        if not isinstance(input, str):
+            raise ValueError("Splitting with an index or in byte ranges "
+                             "requires a single input file.")
+        index = read_index(input)
+        if not _zero_copy_possible(input, []):
+            # Otherwise compressed input is split as if there was no index.
+            use_index = False
+
+    if barcodes is not None:
+        if input_r2 is not None or records is not None or output:
+            raise ValueError("Demultiplexing cannot be combined with "
+                             "paired-end input, records or output files.")
+        return finish(split_fastqs_by_barcode(
+            input_file=input,
+            barcodes=read_barcode_table(barcodes),
+            prefix=prefix,
+            suffix=suffix,
+            number=number,
+            max_size=max_size if number is None else None,
+            buffer_size=_buffer_size_tuner(buffer_size)[0],
+            compression_level=compression_level,
+            threads_per_file=threads_per_file,
+            compression_threads=compression_threads,
+            bgzf=bgzf,
+            stats=stats,
+            decompression_threads=decompression_threads))
+
+    if records is not None:
+        return finish(split_fastqs_by_records(
+            input_file=input,
+            records=records,
+            prefix=prefix,
+            suffix=suffix,
+            buffer_size=buffer_size,
+            compression_level=compression_level,
+            threads_per_file=threads_per_file,
+            input_file_r2=input_r2,
+            compression_threads=compression_threads,
+            bgzf=bgzf,
+            stats=stats,
+            decompression_threads=decompression_threads))
+
+    if sequential:
+        if max_size is None:
+            raise ValueError("Maximum size must be set when splitting files "
+                             "sequentially (not using round-robin).")
+        return finish(split_fastqs_sequentially(
+            input_file=input,
+            max_size=max_size,
+            prefix=prefix,
+            suffix=suffix,
+            buffer_size=buffer_size,
+            compression_level=compression_level,
+            threads_per_file=threads_per_file,
+            input_file_r2=input_r2,
+            compression_threads=compression_threads,
+            bgzf=bgzf,
+            stats=stats,
+            compressed_max_size=compressed_max_size,
+            journal=journal,
+            resume=resume,
+            passthrough=passthrough,
+            decompression_threads=decompression_threads))
+
+    output_files_r2 = None  # type: Optional[List[str]]
+    if output:
+        output_files = output
+        if input_r2 is not None:
+            if not output_r2 or len(output_r2) != len(output):
+                raise ValueError("In paired-end mode an R2 output file must "
+                                 "be given for every output file.")
+            output_files_r2 = output_r2
+    else:
+        if max_size is not None:
+            if use_index:
+                input_size = index["uncompressed_size"]
+            else:
+                input_size = sum(os.stat(input_file).st_size
+                                 for input_file in input_files)
+            if input_size == 0:
+                raise OSError("Cannot determine size of input file or "
+                              "empty input file: {0}.".format(input))
+            if compressed_max_size:
+                # Estimate the size of all output files together. The file
+                # size of compressed input is converted to the uncompressed
+                # size by compressing a sample the same way.
+                sample = _compression_sample(input_files)
+                input_ratio = 1.0 if use_index else _compression_ratio(
+                    sample, input_files[0], INPUT_COMPRESSION_LEVEL)
+                input_size = int(input_size / input_ratio * _compression_ratio(
+                    sample, suffix, compression_level))
+            if use_index and not compressed_max_size:
+                # The parts get the same number of records, so use the real
+                # number of records to keep them below max_size.
+                number = -(-index["records"] // _indexed_records_per_file(
+                    index, max_size))
+            else:
+                number = input_size // max_size + 1
+        elif not number:
+            raise ValueError("Either a maximum size or a number of files or "
+                             "a list of output files must be defined.")
+        if input_r2 is not None:
+            pairs = [paired_filenames(prefix, i, suffix)
+                     for i in range(number)]
+            output_files = [r1 for r1, _ in pairs]
+            output_files_r2 = [r2 for _, r2 in pairs]
+        else:
+            output_files = [prefix + str(i) + suffix for i in range(number)]
+    if exec_command is not None:
+        output_files = [exec_command.replace("{}", str(i))
+                        for i in range(len(output_files))]
+
+    # Processes cannot share a tuner.
+    fixed_buffer_size = _buffer_size_tuner(buffer_size)[0]
+    if (use_index or byte_ranges) and not isinstance(input, str):
+        raise ValueError("Splitting with an index or in byte ranges requires "
+                         "a single input file.")
+    if use_index:
+        if input_r2 is not None or compression_threads > 0:
+            raise ValueError("Splitting with an index cannot be combined "
+                             "with paired-end input or compression threads.")
+        split_fastqs_with_index(input_files[0], output_files,
+                                compression_level=compression_level,
+                                buffer_size=fixed_buffer_size,
+                                threads_per_file=threads_per_file,
+                                bgzf=bgzf)
+        return finish(output_files)
+
+    if byte_ranges:
+        if input_r2 is not None or compression_threads > 0:
+            raise ValueError("Splitting in byte ranges cannot be combined "
+                             "with paired-end input or compression threads.")
+        split_fastqs_byte_ranges(input_files[0], output_files,
+                                 compression_level=compression_level,
+                                 buffer_size=fixed_buffer_size,
+                                 threads_per_file=threads_per_file,
+                                 bgzf=bgzf)
+        return finish(output_files)
+
+    if hash_by_name:
+        # The R1 and R2 files are split independently.
+        for input_file, files in ((input, output_files),
+                                  (input_r2, output_files_r2)):
+            if input_file is not None and files is not None:
+                split_fastqs_by_name_hash(
+                    input_file, files,
+                    compression_level=compression_level,
+                    buffer_size=fixed_buffer_size,
+                    threads_per_file=threads_per_file,
+                    compression_threads=compression_threads,
+                    bgzf=bgzf,
+                    stats=stats,
+                    decompression_threads=decompression_threads)
+    else:
+        split_fastqs_round_robin(input, output_files,
+                                 compression_level=compression_level,
+                                 threads_per_file=threads_per_file,
                                  buffer_size=buffer_size,
-                                 **kwargs)
+                                 input_file_r2=input_r2,
+                                 output_files_r2=output_files_r2,
+                                 compression_threads=compression_threads,
+                                 bgzf=bgzf,
+                                 queue_depth=queue_depth,
+                                 least_busy=least_busy,
+                                 balance_tolerance=balance_tolerance,
+                                 stats=stats,
+                                 fifo=fifo,
+                                 execute=exec_command is not None,
+                                 decompression_threads=decompression_threads,
+                                 max_open_files=max_open_files)
+    if output_files_r2 is not None:
+        return finish([filename for pair in zip(output_files, output_files_r2)
+                       for filename in pair])
+    return finish(output_files)
+
+
+def index_main(args: Optional[List[str]] = None):
+    """Fastqsplitter index program"""
+    parsed_args = index_argument_parser().parse_args(args)
+    create_index(parsed_args.input, index_file=parsed_args.output,
+                 interval=parsed_args.interval, threads=parsed_args.threads)
+
+
+def plan_main(args: Optional[List[str]] = None):
+    """Fastqsplitter plan program"""
+    parsed_args = plan_argument_parser().parse_args(args)
+    max_size = (human_readable_to_int(parsed_args.max_size)
+                if parsed_args.max_size is not None else None)
+    plan_split(parsed_args.input, parsed_args.output,
+               number=parsed_args.number, max_size=max_size,
+               threads=parsed_args.threads)
+
+
+def extract_main(args: Optional[List[str]] = None):
+    """Fastqsplitter extract program"""
+    parsed_args = extract_argument_parser().parse_args(args)
+    extract_shard(parsed_args.manifest, parsed_args.shard, parsed_args.output,
+                  compression_level=parsed_args.compression_level,
+                  threads_per_file=parsed_args.threads_per_file,
+                  bgzf=parsed_args.bgzf,
+                  passthrough=parsed_args.passthrough)
+
+
+# Subcommands are checked before the normal arguments are parsed.
+SUBCOMMANDS = {"index": index_main, "plan": plan_main,
+               "extract": extract_main}
+
+
+def main():
+    """Fastqsplitter program"""
+    if len(sys.argv) > 1 and sys.argv[1] in SUBCOMMANDS:
+        return SUBCOMMANDS[sys.argv[1]](sys.argv[2:])
+    parser = argument_parser()
+    # convert argparse.Namespace to dictionary
+    kwargs = vars(parser.parse_args())
+    max_size = kwargs.pop("max_size")
+    if max_size is not None:
+        max_size = human_readable_to_int(max_size)
+    buffer_size_string = kwargs.pop("buffer_size")
+    if buffer_size_string == "auto":
+        buffer_size = BufferSizeTuner()  # type: BufferSize
+    else:
+        buffer_size = human_readable_to_int(buffer_size_string)
+    print_to_stdout = kwargs.pop("print")
+    stats_file = kwargs.pop("stats")
+    stats = SplitStatistics() if stats_file else None
+    # kwargs correspond to fastqsplitter function inputs.
+    try:
+        output_files = fastqsplitter(max_size=max_size,
+                                     buffer_size=buffer_size,
+                                     stats=stats,
+                                     **kwargs)
+    except subprocess.CalledProcessError as error:
+        print("Command failed with exit status {0}: {1}".format(
+            error.returncode, error.cmd), file=sys.stderr)
+        # A command killed by a signal exits like it would in a shell.
+        sys.exit(error.returncode if error.returncode > 0
+                 else 128 - error.returncode)
+    if stats is not None:
+        with open(stats_file, "wt") as stats_handle:
+            json.dump(stats.to_dict(), stats_handle, indent=2)
+    if isinstance(buffer_size, BufferSizeTuner):
+        if buffer_size.tuned:
+            print("Chosen buffer size: {0}".format(buffer_size.chosen_size),
+                  file=sys.stderr)
+        else:
+            print("The buffer size was not tuned, because the input was too "
+                  "small or was not read through a buffer.", file=sys.stderr)
     if print_to_stdout:
         print("\n".join(output_files))
 
@@ -18,16 +18,40 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import bz2
+import gzip
+import io
+import itertools
+import json
 import os
+import random
+import stat
+import struct
+import subprocess
 import sys
 import tempfile
+import threading
+import time
+import zlib
+from concurrent import futures
 from pathlib import Path
-from typing import Union
+from typing import List, Optional, Union
 
 from Bio.SeqIO.QualityIO import FastqPhredIterator
 
-from fastqsplitter import fastqsplitter, human_readable_to_int, main, \
-    split_fastqs_round_robin, split_fastqs_sequentially
+import fastqsplitter as fastqsplitter_module
+from fastqsplitter import BGZF_BLOCK_SIZE, BufferSizeTuner, \
+    DEFAULT_BUFFER_SIZE, SplitStatistics, _BgzfWriter, _ConcatenatedReader, \
+    _FastqBlockReader, _FifoWriter, _ParallelDecompressingReader, \
+    _QueuedWriter, _WriterPool, _find_record_boundary, _least_busy_output, \
+    _name_hashes, _read_until_new_fastq_record, create_index, \
+    estimate_compression_ratio, extract_shard, fastqsplitter, \
+    human_readable_to_int, iter_fastq_chunks, main, paired_filenames, \
+    plan_split, read_barcode_table, read_index, read_manifest, \
+    split_fastqs_by_barcode, split_fastqs_by_name_hash, \
+    split_fastqs_by_records, split_fastqs_byte_ranges, \
+    split_fastqs_round_robin, split_fastqs_sequentially, \
+    split_fastqs_with_index
 
 import pytest
 
@@ -55,6 +79,34 @@ with xopen.xopen(TEST_FILE, "rb") as fastq_handle:
     BYTES_IN_TEST_FILE = len(fastq_handle.read())
 
 
+def uncompressed_test_file() -> str:
+    """Write an uncompressed copy of TEST_FILE and return its path."""
+    uncompressed_file = tempfile.mktemp(suffix=".fastq")
+    with xopen.xopen(TEST_FILE, "rb") as input_handle:
+        with open(uncompressed_file, "wb") as output_handle:
+            output_handle.write(input_handle.read())
+    return uncompressed_file
+
+
+def read_names(fastq: Union[str, Path]) -> List[str]:
+    """Return the read names in a fastq file without the comment part."""
+    with xopen.xopen(fastq, 'rt') as fastq_handle:
+        return [record.id for record in FastqPhredIterator(fastq_handle)]
+
+
+def create_mate_file(length: int = 50) -> str:
+    """Create an R2 file for TEST_FILE with reads of a different length."""
+    mate_file = tempfile.mktemp(suffix=".fq.gz")
+    with xopen.xopen(TEST_FILE, "rb") as input_handle:
+        lines = input_handle.read().splitlines()
+    with xopen.xopen(mate_file, "wb") as output_handle:
+        for i in range(0, len(lines), 4):
+            output_handle.write(b"\n".join([
+                lines[i].replace(b" 1:N:", b" 2:N:"), lines[i + 1][:length],
+                b"+", lines[i + 3][:length]]) + b"\n")
+    return mate_file
+
+
 def test_invalid_test_file():
     # We need to make sure our test function indeed fails when a fastq file is
     # invalid.
@@ -242,3 +294,1600 @@ def test_main_human_readable_conversion(capsys):
     for output_file in output_files:
         validate_fastq_gz(output_file)
         os.remove(output_file)
+
+
+@pytest.mark.parametrize("mate_length", [30, 101, 300])
+def test_split_fastqs_round_robin_paired(mate_length: int):
+    mate_file = create_mate_file(mate_length)
+    number_of_splits = 3
+    output_files = [str(tempfile.mkstemp(suffix=".fq")[1])
+                    for _ in range(number_of_splits)]
+    output_files_r2 = [str(tempfile.mkstemp(suffix=".fq")[1])
+                       for _ in range(number_of_splits)]
+    split_fastqs_round_robin(TEST_FILE, output_files, buffer_size=1024,
+                             input_file_r2=mate_file,
+                             output_files_r2=output_files_r2)
+    total_records = 0
+    for r1_file, r2_file in zip(output_files, output_files_r2):
+        r1_names = read_names(r1_file)
+        assert r1_names == read_names(r2_file)
+        total_records += len(r1_names)
+    assert total_records == RECORDS_IN_TEST_FILE
+
+
+def test_split_fastqs_sequentially_paired():
+    mate_file = create_mate_file()
+    prefix = tempfile.mktemp()
+    split_files = split_fastqs_sequentially(TEST_FILE, max_size=16 * 1024,
+                                            prefix=prefix, suffix=".fastq",
+                                            buffer_size=1024,
+                                            input_file_r2=mate_file)
+    assert split_files[:2] == list(paired_filenames(prefix, 0, ".fastq"))
+    total_records = 0
+    for r1_file, r2_file in zip(split_files[::2], split_files[1::2]):
+        r1_names = read_names(r1_file)
+        assert r1_names == read_names(r2_file)
+        total_records += len(r1_names)
+        assert os.stat(r1_file).st_size <= 16 * 1024
+    assert total_records == RECORDS_IN_TEST_FILE
+
+
+def test_split_fastqs_paired_record_count_differs():
+    mate_file = tempfile.mktemp(suffix=".fq.gz")
+    with xopen.xopen(TEST_FILE, "rb") as input_handle:
+        lines = input_handle.read().splitlines(keepends=True)
+    with xopen.xopen(mate_file, "wb") as output_handle:
+        output_handle.write(b"".join(lines[:-8]))
+    output_files = [tempfile.mktemp(suffix=".fq") for _ in range(2)]
+    with pytest.raises(ValueError) as error:
+        split_fastqs_round_robin(TEST_FILE, output_files, buffer_size=1024,
+                                 input_file_r2=mate_file,
+                                 output_files_r2=output_files[::-1])
+    error.match("R2 file contains fewer records")
+    with pytest.raises(ValueError) as error:
+        split_fastqs_round_robin(mate_file, output_files, buffer_size=1024,
+                                 input_file_r2=TEST_FILE,
+                                 output_files_r2=output_files[::-1])
+    error.match("R2 file contains more records")
+
+
+def test_fastqsplitter_paired_number_of_files():
+    mate_file = create_mate_file()
+    prefix = tempfile.mktemp()
+    output_files = fastqsplitter(TEST_FILE, prefix=prefix, number=2,
+                                 buffer_size=1024, suffix=".fastq",
+                                 input_r2=mate_file)
+    assert output_files == [prefix + "0.R1.fastq", prefix + "0.R2.fastq",
+                            prefix + "1.R1.fastq", prefix + "1.R2.fastq"]
+    for r1_file, r2_file in zip(output_files[::2], output_files[1::2]):
+        assert read_names(r1_file) == read_names(r2_file)
+
+
+def test_fastqsplitter_paired_output_r2_missing():
+    with pytest.raises(ValueError) as error:
+        fastqsplitter(TEST_FILE, output=["a.fq", "b.fq"],
+                      input_r2=create_mate_file(), output_r2=["c.fq"])
+    error.match("R2 output file must be given")
+
+
+@pytest.mark.parametrize("compression_threads", [1, 4])
+def test_split_fastqs_round_robin_compression_threads(
+        compression_threads: int):
+    number_of_splits = 3
+    output_files = [str(tempfile.mkstemp(suffix=".fq.gz")[1])
+                    for _ in range(number_of_splits)]
+    split_fastqs_round_robin(TEST_FILE, output_files, buffer_size=1024,
+                             compression_threads=compression_threads)
+    total_records = 0
+    for output_file in output_files:
+        with open(output_file, "rb") as output_handle:
+            assert output_handle.read(2) == b"\x1f\x8b"
+        total_records += validate_fastq_gz(output_file)
+    assert total_records == RECORDS_IN_TEST_FILE
+    # Output should be the same as when splitting without compression.
+    uncompressed_files = [str(tempfile.mkstemp(suffix=".fq")[1])
+                          for _ in range(number_of_splits)]
+    split_fastqs_round_robin(TEST_FILE, uncompressed_files, buffer_size=1024)
+    for output_file, uncompressed_file in zip(output_files,
+                                              uncompressed_files):
+        with xopen.xopen(output_file, "rb") as output_handle:
+            with open(uncompressed_file, "rb") as uncompressed_handle:
+                assert output_handle.read() == uncompressed_handle.read()
+
+
+def test_split_fastqs_sequentially_compression_threads():
+    prefix = tempfile.mktemp()
+    split_files = split_fastqs_sequentially(TEST_FILE, max_size=32 * 1024,
+                                            prefix=prefix, buffer_size=1024,
+                                            compression_threads=2)
+    assert sum(validate_fastq_gz(split_file) for split_file in split_files
+               ) == RECORDS_IN_TEST_FILE
+
+
+@pytest.mark.parametrize("number_of_splits", [1, 2, 5, 7])
+def test_split_fastqs_byte_ranges(number_of_splits: int):
+    input_file = uncompressed_test_file()
+    output_files = [str(tempfile.mkstemp(suffix=".fq")[1])
+                    for _ in range(number_of_splits)]
+    split_fastqs_byte_ranges(input_file, output_files, workers=2)
+    expected_size = BYTES_IN_TEST_FILE / number_of_splits
+    split_data = b""
+    for output_file in output_files:
+        validate_fastq_gz(output_file)
+        with open(output_file, "rb") as output_handle:
+            data = output_handle.read()
+        # Each part is at most one record (about 256 bytes) off.
+        assert abs(len(data) - expected_size) <= 512
+        split_data += data
+    with open(input_file, "rb") as input_handle:
+        assert split_data == input_handle.read()
+
+
+def test_split_fastqs_byte_ranges_compressed_input():
+    with pytest.raises(ValueError) as error:
+        split_fastqs_byte_ranges(TEST_FILE, ["a.fq"])
+    error.match("uncompressed regular file")
+
+
+def test_fastqsplitter_byte_ranges():
+    prefix = tempfile.mktemp()
+    output_files = fastqsplitter(uncompressed_test_file(), prefix=prefix,
+                                 number=3, byte_ranges=True)
+    assert sum(validate_fastq_gz(output_file) for output_file in output_files
+               ) == RECORDS_IN_TEST_FILE
+
+
+@pytest.mark.parametrize("kwargs", [
+    dict(max_size=100000, round_robin=False), dict(records=1000),
+    dict(number=3, use_index=True), dict(number=3, barcodes="barcodes.tsv")])
+def test_fastqsplitter_byte_ranges_conflicts(kwargs):
+    with pytest.raises(ValueError) as error:
+        fastqsplitter(uncompressed_test_file(), prefix=tempfile.mktemp(),
+                      byte_ranges=True, **kwargs)
+    error.match("Byte ranges")
+
+
+@pytest.mark.parametrize("kernel_copy", ["copy_file_range", "sendfile",
+                                         None])
+def test_split_fastqs_zero_copy(kernel_copy, monkeypatch):
+    # Make sure all copy methods are tested.
+    for copy_method in ("copy_file_range", "sendfile"):
+        if copy_method != kernel_copy:
+            monkeypatch.delattr(os, copy_method, raising=False)
+    input_file = uncompressed_test_file()
+    # The gzipped input uses the normal method.
+    for split_input in (input_file, TEST_FILE):
+        output_files = [tempfile.mktemp(suffix=".fq") for _ in range(3)]
+        split_fastqs_round_robin(split_input, output_files, buffer_size=1024)
+        prefix = tempfile.mktemp()
+        split_files = split_fastqs_sequentially(
+            split_input, max_size=10 * 1024, prefix=prefix, suffix=".fastq",
+            buffer_size=1024)
+        contents = []
+        for output_file in output_files + split_files:
+            with open(output_file, "rb") as output_handle:
+                contents.append(output_handle.read())
+        if split_input == input_file:
+            zero_copy_contents = contents
+    assert zero_copy_contents == contents
+
+
+# Quality lines that start with '@' or '+' and lines with invalid lengths.
+TRICKY_FASTQ = (b"@r1\nACGT\n+\n@@@@\n@r2\nACGT\n+r2\n+@@@\n"
+                b"@r3\nAC\n+\nIIII\n@r4\nNNNN\n+\nIIII\n@r5\nA\n+\nI")
+
+
+@pytest.mark.parametrize("data", [TRICKY_FASTQ, TRICKY_FASTQ + b"\n"])
+def test_find_record_boundary_tricky(data: bytes):
+    for position in range(len(data) + 1):
+        handle = io.BufferedReader(io.BytesIO(data))
+        handle.seek(position)
+        expected = position + len(_read_until_new_fastq_record(handle))
+        assert _find_record_boundary(data, position) == expected
+        # Without EOF a boundary is either found or more data is requested.
+        assert _find_record_boundary(data, position, eof=False) in (
+            expected, -1)
+
+
+def test_find_record_boundary_test_file():
+    with xopen.xopen(TEST_FILE, "rb") as input_handle:
+        data = input_handle.read()
+    random.seed(0)
+    for position in random.sample(range(len(data)), 500):
+        handle = io.BufferedReader(io.BytesIO(data))
+        handle.seek(position)
+        assert _find_record_boundary(data, position) == (
+            position + len(_read_until_new_fastq_record(handle)))
+
+
+@pytest.mark.parametrize("read_size", [100, 1000, 1024 * 1024])
+def test_fastq_block_reader(read_size: int):
+    with xopen.xopen(TEST_FILE, "rb") as input_handle:
+        data = input_handle.read()
+    expected_handle = io.BufferedReader(io.BytesIO(data))
+    block_reader = _FastqBlockReader(io.BytesIO(data), read_size)
+    while True:
+        expected = expected_handle.read(1024)
+        expected += _read_until_new_fastq_record(expected_handle)
+        assert block_reader.read_block(1024) == expected
+        assert block_reader.read(500) == expected_handle.read(500)
+        if expected == b"":
+            break
+    assert block_reader.at_eof()
+
+
+def validate_bgzf(bgzf_file: str) -> int:
+    """
+    Check the BGZF blocks and that the index points to fastq records. Return
+    the number of index entries.
+    """
+    with open(bgzf_file, "rb") as bgzf_handle:
+        compressed = bgzf_handle.read()
+    uncompressed = gzip.decompress(compressed)
+    offset = 0
+    block_starts = set()
+    while offset < len(compressed):
+        block_starts.add(offset)
+        # Check the 'BC' extra field and use it to get to the next block.
+        assert compressed[offset + 12:offset + 16] == b"BC\x02\x00"
+        block_size = struct.unpack("<H", compressed[offset + 16:offset + 18])
+        offset += block_size[0] + 1
+    assert offset == len(compressed)
+    # The file ends with an empty EOF block.
+    assert gzip.decompress(compressed[-28:]) == b""
+    with open(bgzf_file + ".gzi", "rb") as index_handle:
+        index = index_handle.read()
+    number_of_entries = struct.unpack("<Q", index[:8])[0]
+    assert len(index) == 8 + 16 * number_of_entries
+    for i in range(number_of_entries):
+        compressed_offset, uncompressed_offset = struct.unpack(
+            "<QQ", index[8 + 16 * i: 24 + 16 * i])
+        assert compressed_offset in block_starts
+        assert (gzip.decompress(compressed[compressed_offset:]) ==
+                uncompressed[uncompressed_offset:])
+        assert uncompressed[:uncompressed_offset].count(b"\n") % 4 == 0
+        assert uncompressed[uncompressed_offset:].startswith(b"@")
+    return number_of_entries
+
+
+@pytest.mark.parametrize("compression_threads", [0, 2])
+def test_split_fastqs_round_robin_bgzf(compression_threads):
+    output_files = [tempfile.mktemp(suffix=".fq.gz") for _ in range(2)]
+    split_fastqs_round_robin(TEST_FILE, output_files, buffer_size=1024,
+                             compression_threads=compression_threads,
+                             bgzf=True)
+    assert sum(validate_fastq_gz(output_file) for output_file in output_files
+               ) == RECORDS_IN_TEST_FILE
+    for output_file in output_files:
+        assert validate_bgzf(output_file) > 0
+
+
+def test_bgzf_writer_small_writes(tmp_path):
+    with xopen.xopen(TEST_FILE, "rb") as input_handle:
+        data = input_handle.read()
+    output_file = str(tmp_path / "output.fq.gz")
+    with _BgzfWriter(output_file, 1) as writer:
+        # Writes that are much smaller than a block are packed together.
+        for start in range(0, len(data), 1000):
+            writer.write(data[start:start + 1000])
+    with gzip.open(output_file, "rb") as output_handle:
+        assert output_handle.read() == data
+    assert validate_bgzf(output_file) > 0
+    # Only the last block and the empty EOF block are not nearly full.
+    number_of_blocks = Path(output_file).read_bytes().count(b"BC\x02\x00")
+    assert number_of_blocks <= -(-len(data) // (BGZF_BLOCK_SIZE - 1000)) + 1
+
+
+def test_split_fastqs_sequentially_bgzf():
+    # Blocks written in sequential mode do not start at a record.
+    split_files = split_fastqs_sequentially(
+        TEST_FILE, max_size=100 * 1024, prefix=tempfile.mktemp(),
+        buffer_size=1000, bgzf=True)
+    index_entries = 0
+    for split_file in split_files:
+        validate_fastq_gz(split_file)
+        index_entries += validate_bgzf(split_file)
+    assert index_entries > 0
+
+
+@pytest.mark.parametrize("interval", [1, 7, 10000])
+def test_create_index(interval: int):
+    index_file = tempfile.mktemp(suffix=".fqi")
+    index = create_index(TEST_FILE, index_file, interval=interval)
+    assert index == read_index(TEST_FILE, index_file)
+    assert index["records"] == RECORDS_IN_TEST_FILE
+    assert index["uncompressed_size"] == BYTES_IN_TEST_FILE
+    with xopen.xopen(TEST_FILE, "rb") as input_handle:
+        lines = input_handle.read().splitlines(keepends=True)
+    record_offsets = [len(b"".join(lines[:i]))
+                      for i in range(0, len(lines), 4 * interval)]
+    assert index["offsets"] == record_offsets
+
+
+def test_read_index_out_of_date():
+    input_file = uncompressed_test_file()
+    create_index(input_file)
+    with open(input_file, "ab") as input_handle:
+        input_handle.write(b"@extra\nA\n+\nI\n")
+    with pytest.raises(ValueError) as error:
+        read_index(input_file)
+    error.match("out of date")
+
+
+@pytest.mark.parametrize("number_of_splits", [1, 3, 4, 6])
+def test_split_fastqs_with_index(number_of_splits: int):
+    input_file = uncompressed_test_file()
+    create_index(input_file, interval=10)
+    output_files = [tempfile.mktemp(suffix=".fq") for _ in
+                    range(number_of_splits)]
+    split_fastqs_with_index(input_file, output_files, workers=2)
+    split_data = b""
+    for output_file in output_files:
+        records = validate_fastq_gz(output_file)
+        assert abs(records - RECORDS_IN_TEST_FILE / number_of_splits) < 1
+        with open(output_file, "rb") as output_handle:
+            split_data += output_handle.read()
+    with open(input_file, "rb") as input_handle:
+        assert split_data == input_handle.read()
+
+
+def test_main_index_and_use_index(capsys):
+    input_file = uncompressed_test_file()
+    sys.argv = ["fastqsplitter", "index", input_file, "-i", "100"]
+    main()
+    assert read_index(input_file)["interval"] == 100
+    prefix = tempfile.mktemp()
+    sys.argv = ["fastqsplitter", input_file, "-I", "-m", "100K", "-P",
+                "-p", prefix]
+    main()
+    output_files = capsys.readouterr().out.split()
+    # The uncompressed size of the test file is about 253K.
+    assert len(output_files) == 3
+    assert [validate_fastq_gz(output_file) for output_file in output_files
+            ] == [336, 337, 337]
+
+
+def test_main_use_index_compressed_input(capsys):
+    input_file = tempfile.mktemp(suffix=".fq.gz")
+    with open(input_file, "wb") as output_handle:
+        output_handle.write(Path(TEST_FILE).read_bytes())
+    index = create_index(input_file, interval=100)
+    sys.argv = ["fastqsplitter", input_file, "-I", "-m", "100K", "-P",
+                "-p", tempfile.mktemp()]
+    main()
+    output_files = capsys.readouterr().out.split()
+    # Whole intervals of the index that are at most 100K each.
+    assert [validate_fastq_gz(output_file) for output_file in output_files
+            ] == [300, 300, 300, 110]
+    assert index["offsets"][3] <= 100 * 1024 < index["offsets"][4]
+    assert all(os.path.getsize(output_file) <= 100 * 1024
+               for output_file in output_files)
+
+
+def test_main_use_index_compressed_input_sequential(capsys):
+    input_file = tempfile.mktemp(suffix=".fq.gz")
+    with open(input_file, "wb") as output_handle:
+        output_handle.write(Path(TEST_FILE).read_bytes())
+    create_index(input_file)
+    journal = tempfile.mktemp(suffix=".json")
+    sys.argv = ["fastqsplitter", input_file, "-I", "-S", "-m", "100K", "-P",
+                "--journal", journal, "-p", tempfile.mktemp()]
+    main()
+    output_files = capsys.readouterr().out.split()
+    # The index is not used, the input is split by size with the journal.
+    assert sum(validate_fastq_gz(output_file) for output_file in output_files
+               ) == RECORDS_IN_TEST_FILE
+    assert all(os.path.getsize(output_file) <= 100 * 1024
+               for output_file in output_files)
+    assert os.path.exists(journal)
+
+
+def test_main_use_index_compressed_input_coarse_index():
+    input_file = tempfile.mktemp(suffix=".fq.gz")
+    with open(input_file, "wb") as output_handle:
+        output_handle.write(Path(TEST_FILE).read_bytes())
+    create_index(input_file)
+    sys.argv = ["fastqsplitter", input_file, "-I", "-m", "100K", "-P",
+                "-p", tempfile.mktemp()]
+    with pytest.raises(ValueError) as error:
+        main()
+    error.match("smaller interval")
+
+
+@pytest.mark.parametrize(["records", "suffix"], [
+    (1, ".fastq"), (100, ".fastq"), (100, ".fastq.gz"), (337, ".fastq.gz"),
+    (1010, ".fastq"), (5000, ".fastq.gz")])
+def test_split_fastqs_by_records(records: int, suffix: str):
+    prefix = tempfile.mktemp()
+    # Uncompressed to uncompressed uses the zero-copy method.
+    for input_file in (TEST_FILE, uncompressed_test_file()):
+        split_files = split_fastqs_by_records(input_file, records, prefix,
+                                              suffix=suffix, buffer_size=1024)
+        assert len(split_files) == -(-RECORDS_IN_TEST_FILE // records)
+        for split_file in split_files[:-1]:
+            assert validate_fastq_gz(split_file) == records
+        assert validate_fastq_gz(split_files[-1]) == (
+            RECORDS_IN_TEST_FILE - records * (len(split_files) - 1))
+
+
+def test_split_fastqs_by_records_paired():
+    split_files = split_fastqs_by_records(
+        TEST_FILE, 300, tempfile.mktemp(), buffer_size=1024,
+        input_file_r2=create_mate_file())
+    assert len(split_files) == 8
+    for r1_file, r2_file in zip(split_files[::2], split_files[1::2]):
+        r1_names = read_names(r1_file)
+        assert r1_names == read_names(r2_file)
+    assert len(r1_names) == 110
+
+
+def test_main_records(capsys):
+    prefix = tempfile.mktemp()
+    sys.argv = ["fastqsplitter", TEST_FILE, "-R", "500", "-P", "-p", prefix]
+    main()
+    output_files = capsys.readouterr().out.split()
+    assert [validate_fastq_gz(output_file) for output_file in output_files
+            ] == [500, 500, 10]
+
+
+def lane_files() -> List[str]:
+    """Split TEST_FILE into three files, one of which is uncompressed."""
+    with xopen.xopen(TEST_FILE, "rb") as input_handle:
+        lines = input_handle.read().splitlines(keepends=True)
+    lane_files = []
+    for lane, suffix in enumerate((".fq.gz", ".fastq", ".fq.gz")):
+        lane_file = tempfile.mktemp(suffix=suffix)
+        with xopen.xopen(lane_file, "wb") as output_handle:
+            # Lanes of different sizes: 1000, 8 and 2 records.
+            start, end = [(0, 4000), (4000, 4032), (4032, None)][lane]
+            output_handle.write(b"".join(lines[start:end]))
+        lane_files.append(lane_file)
+    return lane_files
+
+
+@pytest.mark.parametrize("read_size", [1, 100, 1500, 1024 * 1024])
+def test_concatenated_reader(read_size: int):
+    with xopen.xopen(TEST_FILE, "rb") as input_handle:
+        expected = input_handle.read()
+    with _ConcatenatedReader(lane_files(), chunk_size=1000) as reader:
+        parts = []
+        while True:
+            data = reader.read(read_size)
+            if data == b"":
+                break
+            parts.append(data)
+    assert b"".join(parts) == expected
+
+
+def test_concatenated_reader_missing_file():
+    with _ConcatenatedReader([TEST_FILE, "non-existing.fq"]) as reader:
+        with pytest.raises(FileNotFoundError):
+            reader.read()
+
+
+@pytest.mark.parametrize("round_robin", [True, False])
+def test_fastqsplitter_multiple_inputs(round_robin: bool):
+    # Round robin splits in 3 files, sequential in files of 80000 bytes.
+    expected = fastqsplitter(uncompressed_test_file(), number=3,
+                             max_size=None if round_robin else 80000,
+                             prefix=tempfile.mktemp(), suffix=".fq",
+                             buffer_size=1024, round_robin=round_robin)
+    output_files = fastqsplitter(lane_files(), number=3,
+                                 max_size=None if round_robin else 80000,
+                                 prefix=tempfile.mktemp(), suffix=".fq",
+                                 buffer_size=1024, round_robin=round_robin)
+    assert len(output_files) == len(expected) > 1
+    for output_file, expected_file in zip(output_files, expected):
+        assert Path(output_file).read_bytes() == Path(
+            expected_file).read_bytes()
+
+
+def test_fastqsplitter_multiple_inputs_paired():
+    output_files = fastqsplitter(lane_files(), number=3,
+                                 prefix=tempfile.mktemp(),
+                                 input_r2=[create_mate_file()])
+    assert len(output_files) == 6
+    for r1_file, r2_file in zip(output_files[::2], output_files[1::2]):
+        assert read_names(r1_file) == read_names(r2_file)
+    # The R2 files contain the test file twice.
+    with pytest.raises(ValueError) as error:
+        fastqsplitter(lane_files(), number=3, prefix=tempfile.mktemp(),
+                      input_r2=[create_mate_file(), TEST_FILE])
+    error.match("more records")
+
+
+def test_fastqsplitter_multiple_inputs_byte_ranges():
+    with pytest.raises(ValueError) as error:
+        fastqsplitter(lane_files(), number=3, byte_ranges=True)
+    error.match("single input file")
+
+
+def test_main_multiple_inputs(capsys):
+    prefix = tempfile.mktemp()
+    sys.argv = ["fastqsplitter", *lane_files(), "-R", "500", "-P",
+                "-p", prefix]
+    main()
+    output_files = capsys.readouterr().out.split()
+    assert [validate_fastq_gz(output_file) for output_file in output_files
+            ] == [500, 500, 10]
+
+
+def test_main_paired_multiple_inputs(capsys):
+    # The R2 files do not swallow the positional R1 files.
+    sys.argv = ["fastqsplitter", "-2", create_mate_file(), "-2",
+                create_mate_file(), TEST_FILE, TEST_FILE, "-n", "2", "-P",
+                "-p", tempfile.mktemp()]
+    main()
+    output_files = capsys.readouterr().out.split()
+    assert len(output_files) == 4
+    assert sum(validate_fastq_gz(output_file) for output_file in output_files
+               ) == 4 * RECORDS_IN_TEST_FILE
+
+
+@pytest.mark.parametrize(["input_file", "paired"],
+                         [(TEST_FILE, False), (TEST_FILE, True),
+                          (uncompressed_test_file(), False)])
+def test_split_fastqs_round_robin_queue_depth(input_file: str, paired: bool):
+    number_of_splits = 3
+    expected_files = [tempfile.mktemp(suffix=".fq")
+                      for _ in range(number_of_splits)]
+    output_files = [tempfile.mktemp(suffix=".fq")
+                    for _ in range(number_of_splits)]
+    mate_file = create_mate_file() if paired else None
+    output_files_r2 = [tempfile.mktemp(suffix=".fq")
+                       for _ in range(number_of_splits)] if paired else None
+    split_fastqs_round_robin(input_file, expected_files, buffer_size=1024)
+    split_fastqs_round_robin(input_file, output_files, buffer_size=1024,
+                             input_file_r2=mate_file,
+                             output_files_r2=output_files_r2,
+                             queue_depth=2)
+    for output_file, expected_file in zip(output_files, expected_files):
+        assert Path(output_file).read_bytes() == Path(
+            expected_file).read_bytes()
+    if output_files_r2 is not None:
+        for r1_file, r2_file in zip(output_files, output_files_r2):
+            assert read_names(r1_file) == read_names(r2_file)
+
+
+def test_queued_writer_error():
+    class FailingWriter(io.BytesIO):
+        def write(self, data):
+            raise OSError("No space left on device")
+
+    writer = _QueuedWriter(FailingWriter(), 1)
+    with pytest.raises(OSError) as error:
+        for _ in range(100):
+            writer.write(b"@r1\nA\n+\nA\n")
+        writer.close()
+    error.match("No space left")
+
+
+@pytest.mark.parametrize(["pending", "records", "tolerance", "expected"], [
+    ([0, 0, 0], [0, 0, 0], 0.05, 0),
+    ([3, 0, 1], [10, 10, 10], 0.05, 1),
+    # Output 1 is more than 5% of the mean ahead.
+    ([3, 0, 1], [100, 120, 100], 0.05, 2),
+    ([3, 0, 1], [100, 120, 100], 0.5, 1),
+    # Ties go to the output with the least records.
+    ([1, 1, 1], [100, 102, 99], 0.05, 2),
+])
+def test_least_busy_output(pending: List[int], records: List[int],
+                           tolerance: float, expected: int):
+    assert _least_busy_output(pending, records, tolerance, 1) == expected
+
+
+@pytest.mark.parametrize("tolerance", [0.05, 0.5])
+def test_split_fastqs_least_busy(tolerance: float, monkeypatch):
+    class SlowWriter(io.FileIO):
+        def write(self, data):
+            time.sleep(0.005)
+            return super().write(data)
+
+    output_files = [tempfile.mktemp(suffix=".fq") for _ in range(3)]
+    open_output = fastqsplitter_module._open_output
+
+    def open_slow_output(filename, *args):
+        if filename == output_files[0]:
+            return SlowWriter(filename, "wb")
+        return open_output(filename, *args)
+
+    monkeypatch.setattr(fastqsplitter_module, "_open_output",
+                        open_slow_output)
+    split_fastqs_round_robin(TEST_FILE, output_files, buffer_size=1024,
+                             queue_depth=2, least_busy=True,
+                             balance_tolerance=tolerance)
+    records = [validate_fastq_gz(output_file) for output_file in output_files]
+    assert sum(records) == RECORDS_IN_TEST_FILE
+    # The slow output receives less records, but within the tolerance.
+    assert records[0] < min(records[1:])
+    # One block of 1024 bytes contains at most 6 records.
+    assert max(records) - min(records) <= (
+        tolerance * RECORDS_IN_TEST_FILE / 3 + 6)
+
+
+@pytest.mark.parametrize("kwargs", [
+    dict(max_size=100000, round_robin=False), dict(records=1000),
+    dict(number=3, byte_ranges=True), dict(number=3, hash_by_name=True),
+    dict(number=3, barcodes="barcodes.tsv")])
+def test_fastqsplitter_queue_depth_round_robin_only(kwargs):
+    with pytest.raises(ValueError) as error:
+        fastqsplitter(TEST_FILE, prefix=tempfile.mktemp(), queue_depth=2,
+                      **kwargs)
+    error.match("queue depth")
+
+
+@pytest.mark.parametrize("kwargs", [
+    dict(max_size=100000, round_robin=False), dict(records=1000),
+    dict(number=3, byte_ranges=True),
+    dict(number=3, barcodes="barcodes.tsv")])
+def test_fastqsplitter_least_busy_round_robin_only(kwargs):
+    with pytest.raises(ValueError) as error:
+        fastqsplitter(TEST_FILE, prefix=tempfile.mktemp(), least_busy=True,
+                      **kwargs)
+    error.match("least busy distribution")
+
+
+@pytest.mark.parametrize("suffix", [".fq", ".fq.gz"])
+def test_split_fastqs_round_robin_fifo(suffix: str, tmp_path):
+    number_of_splits = 3
+    expected_files = [str(tmp_path / "expected{0}{1}".format(i, suffix))
+                      for i in range(number_of_splits)]
+    output_files = [str(tmp_path / "split{0}{1}".format(i, suffix))
+                    for i in range(number_of_splits)]
+    split_fastqs_round_robin(TEST_FILE, expected_files, buffer_size=1024)
+    received = {}
+
+    def read_pipe(filename: str, delay: float):
+        # Wait until the pipe is created, connect late and read slowly.
+        while not os.path.exists(filename):
+            time.sleep(0.001)
+        time.sleep(delay)
+        with open(filename, "rb") as pipe:
+            received[filename] = pipe.read()
+
+    # The readers connect in reverse order.
+    readers = [threading.Thread(target=read_pipe, args=(filename, delay))
+               for filename, delay in zip(output_files, [0.3, 0.2, 0.1])]
+    for reader in readers:
+        reader.start()
+    split_fastqs_round_robin(TEST_FILE, output_files, buffer_size=1024,
+                             fifo=True)
+    for reader in readers:
+        reader.join()
+    for output_file, expected_file in zip(output_files, expected_files):
+        assert stat.S_ISFIFO(os.stat(output_file).st_mode)
+        data = received[output_file]
+        if suffix.endswith(".gz"):
+            data = gzip.decompress(data)
+        assert data == xopen.xopen(expected_file, "rb").read()
+
+
+def test_split_fastqs_round_robin_fifo_existing_file(tmp_path):
+    output_file = tmp_path / "split.fq"
+    output_file.write_bytes(b"")
+    with pytest.raises(FileExistsError):
+        split_fastqs_round_robin(TEST_FILE, [str(output_file)], fifo=True)
+
+
+def test_queued_fifo_writer_error_without_reader(tmp_path):
+    output_file = str(tmp_path / "split.fq")
+    os.mkfifo(output_file)
+    raised = []
+
+    def open_output(filename: str):
+        return open(filename, "wb")
+
+    def write_and_fail():
+        try:
+            with _QueuedWriter(_FifoWriter(output_file, open_output), 2,
+                               close_output=True) as writer:
+                writer.write(b"data")
+                raise RuntimeError("splitting failed")
+        except RuntimeError as error:
+            raised.append(error)
+
+    # Without a reader, the error must not wait for the pipe to be opened.
+    writing_thread = threading.Thread(target=write_and_fail, daemon=True)
+    writing_thread.start()
+    writing_thread.join(10)
+    assert not writing_thread.is_alive()
+    assert len(raised) == 1
+
+
+def test_fifo_writer_close_without_data(tmp_path):
+    output_file = str(tmp_path / "split.fq")
+    os.mkfifo(output_file)
+    _FifoWriter(output_file, open).close()
+    # A reader that comes later must not wait for a writer forever.
+    assert not os.path.exists(output_file)
+
+
+def test_fifo_writer_close_without_data_waiting_reader(tmp_path):
+    output_file = str(tmp_path / "split.fq")
+    os.mkfifo(output_file)
+    received = []
+
+    def read_pipe():
+        with open(output_file, "rb") as pipe:
+            received.append(pipe.read())
+
+    reading_thread = threading.Thread(target=read_pipe, daemon=True)
+    reading_thread.start()
+    time.sleep(0.2)
+    _FifoWriter(output_file, open).close()
+    reading_thread.join(10)
+    assert received == [b""]
+    assert stat.S_ISFIFO(os.stat(output_file).st_mode)
+
+
+def test_fastqsplitter_fifo_sequential():
+    with pytest.raises(ValueError) as error:
+        fastqsplitter(TEST_FILE, max_size=10000, round_robin=False,
+                      fifo=True)
+    error.match("round-robin")
+
+
+@pytest.mark.parametrize(["input_file", "memoryviews"],
+                         [(TEST_FILE, False), (TEST_FILE, True),
+                          (uncompressed_test_file(), False),
+                          (uncompressed_test_file(), True)])
+def test_iter_fastq_chunks(input_file: str, memoryviews: bool):
+    chunks = list(iter_fastq_chunks(input_file, buffer_size=4096,
+                                    count_records=True,
+                                    memoryviews=memoryviews))
+    assert len(chunks) > 1
+    for chunk, records in chunks:
+        assert isinstance(chunk, memoryview if memoryviews else bytes)
+        assert bytes(chunk[:1]) == b"@"
+        assert records == len(list(FastqPhredIterator(
+            io.StringIO(bytes(chunk).decode("ascii")))))
+    assert sum(records for _, records in chunks) == RECORDS_IN_TEST_FILE
+    with xopen.xopen(TEST_FILE, "rb") as input_handle:
+        assert b"".join(chunk for chunk, _ in chunks) == input_handle.read()
+
+
+def test_iter_fastq_chunks_process_pool():
+    chunks = iter_fastq_chunks(TEST_FILE, buffer_size=4096)
+    with futures.ProcessPoolExecutor(2) as pool:
+        lines = sum(pool.map(bytes.count, chunks, itertools.repeat(b"\n")))
+    assert lines == RECORDS_IN_TEST_FILE * 4
+
+
+def test_fastqsplitter_exec(tmp_path):
+    expected_files = [str(tmp_path / "expected{0}.fq".format(i))
+                      for i in range(3)]
+    split_fastqs_round_robin(TEST_FILE, expected_files, buffer_size=1024)
+    command = "cat > {0}/out.{{}}.fq".format(tmp_path)
+    commands = fastqsplitter(TEST_FILE, number=3, buffer_size=1024,
+                             exec_command=command)
+    assert commands == [command.replace("{}", str(i)) for i in range(3)]
+    for i, expected_file in enumerate(expected_files):
+        assert (tmp_path / "out.{0}.fq".format(i)).read_bytes() == Path(
+            expected_file).read_bytes()
+
+
+def test_fastqsplitter_exec_stops_reading(tmp_path):
+    # The commands exit successfully before they have read all their input.
+    command = "head -c 10 > {0}/out.{{}}.fq".format(tmp_path)
+    fastqsplitter(TEST_FILE, number=2, buffer_size=1024,
+                  exec_command=command)
+    with xopen.xopen(TEST_FILE, "rb") as input_handle:
+        start = input_handle.read(10)
+    assert (tmp_path / "out.0.fq").read_bytes() == start
+
+
+def test_main_exec_failure(capsys):
+    # The command exits before it has read all its input.
+    sys.argv = ["fastqsplitter", TEST_FILE, "-n", "2", "--exec",
+                "head -c 10 > /dev/null; exit 3"]
+    with pytest.raises(SystemExit) as error:
+        main()
+    assert error.value.code == 3
+    assert "exit status 3" in capsys.readouterr().err
+
+
+@pytest.mark.parametrize(["input_file", "suffix", "paired"], [
+    (TEST_FILE, ".fq.gz", False),
+    (TEST_FILE, ".fq.gz", True),
+    (uncompressed_test_file(), ".fq.gz", False),
+    # Zero-copy splitting.
+    (uncompressed_test_file(), ".fq", False)])
+def test_split_fastqs_sequentially_resume(input_file: str, suffix: str,
+                                          paired: bool, tmp_path):
+    mate_file = create_mate_file() if paired else None
+    journal = tmp_path / "journal.jsonl"
+    prefix = str(tmp_path / "split.")
+    written_files = split_fastqs_sequentially(
+        input_file, max_size=40000, prefix=prefix, suffix=suffix,
+        buffer_size=1024, input_file_r2=mate_file, journal=str(journal))
+    expected = {filename: xopen.xopen(filename, "rb").read()
+                for filename in written_files}
+    entries = [json.loads(line) for line in journal.read_text().splitlines()]
+    assert [filename for entry in entries
+            for filename in entry["files"]] == written_files
+    assert sum(entry["records"] for entry in entries) == RECORDS_IN_TEST_FILE
+    assert [entry["start"] for entry in entries[1:]] == [
+        entry["end"] for entry in entries[:-1]]
+    assert entries[-1]["end"] == BYTES_IN_TEST_FILE
+
+    # Interrupt the split while the third part and its journal line were
+    # written.
+    lines = journal.read_text().splitlines(keepends=True)
+    journal.write_text("".join(lines[:2]) + lines[2][:10])
+    for filename in written_files[len(entries[0]["files"]) * 2:]:
+        os.remove(filename)
+    Path(written_files[-1]).write_bytes(b"incomplete")
+    assert split_fastqs_sequentially(
+        input_file, max_size=40000, prefix=prefix, suffix=suffix,
+        buffer_size=1024, input_file_r2=mate_file, journal=str(journal),
+        resume=True) == written_files
+    for filename in written_files:
+        assert xopen.xopen(filename, "rb").read() == expected[filename]
+    assert journal.read_text().splitlines() == [
+        json.dumps(entry) for entry in entries]
+
+
+def test_split_fastqs_sequentially_resume_missing_file(tmp_path):
+    journal = str(tmp_path / "journal.jsonl")
+    written_files = split_fastqs_sequentially(
+        TEST_FILE, max_size=40000, prefix=str(tmp_path / "split."),
+        buffer_size=1024, journal=journal)
+    os.remove(written_files[0])
+    with pytest.raises(ValueError) as error:
+        split_fastqs_sequentially(
+            TEST_FILE, max_size=40000, prefix=str(tmp_path / "split."),
+            buffer_size=1024, journal=journal, resume=True)
+    error.match("does not exist")
+
+
+def test_fastqsplitter_journal_round_robin():
+    with pytest.raises(ValueError) as error:
+        fastqsplitter(TEST_FILE, number=3, journal="journal.jsonl")
+    error.match("sequentially")
+    with pytest.raises(ValueError) as error:
+        fastqsplitter(TEST_FILE, number=3, resume=True)
+    error.match("requires a journal")
+
+
+@pytest.mark.parametrize("input_file", [TEST_FILE, uncompressed_test_file()])
+def test_split_fastqs_sequentially_journal_fsync(input_file: str, tmp_path,
+                                                 monkeypatch):
+    journal = tmp_path / "journal.jsonl"
+    synced = []
+
+    def fsync_path(path: str) -> None:
+        # The journal lists the files that were synced before.
+        lines = journal.read_text().splitlines() if journal.exists() else []
+        assert len(lines) == len(synced) // 2
+        synced.append(path)
+
+    monkeypatch.setattr(fastqsplitter_module, "_fsync_path", fsync_path)
+    written_files = split_fastqs_sequentially(
+        input_file, max_size=40000, prefix=str(tmp_path / "split."),
+        suffix=".fq", buffer_size=1024, journal=str(journal))
+    # Every file and its directory entry.
+    assert synced == [path for filename in written_files
+                      for path in (filename, str(tmp_path))]
+
+
+def bgzf_test_file() -> str:
+    """Write TEST_FILE as a BGZF file and return its path."""
+    bgzf_file = tempfile.mktemp(suffix=".fq.gz")
+    split_fastqs_round_robin(TEST_FILE, [bgzf_file], buffer_size=1024,
+                             bgzf=True)
+    return bgzf_file
+
+
+@pytest.mark.parametrize(["input_file", "input_format"], [
+    (uncompressed_test_file(), "uncompressed"),
+    (bgzf_test_file(), "bgzf"),
+    (TEST_FILE, "stream")])
+@pytest.mark.parametrize("suffix", [".fq", ".fq.gz"])
+def test_plan_split_and_extract_shard(input_file: str, input_format: str,
+                                      suffix: str, tmp_path):
+    manifest_file = str(tmp_path / "manifest.json")
+    manifest = plan_split(input_file, manifest_file, number=3)
+    assert manifest["format"] == input_format
+    assert manifest["uncompressed_size"] == BYTES_IN_TEST_FILE
+    assert len(manifest["shards"]) == 3
+    data = b""
+    for shard, shard_range in enumerate(manifest["shards"]):
+        output_file = str(tmp_path / "shard{0}{1}".format(shard, suffix))
+        written = extract_shard(manifest_file, shard, output_file)
+        assert written == shard_range["end"] - shard_range["start"]
+        records = validate_fastq_gz(output_file)
+        # The shards have about the same size. Compressed input is cut
+        # in blocks of 16K, which contain about 64 records.
+        assert abs(records - RECORDS_IN_TEST_FILE / 3) < 70
+        if input_format == "stream":
+            assert records == shard_range["records"]
+        data += xopen.xopen(output_file, "rb").read()
+    assert data == xopen.xopen(TEST_FILE, "rb").read()
+
+
+def test_plan_split_max_size(tmp_path):
+    manifest = plan_split(TEST_FILE, str(tmp_path / "manifest.json"),
+                          max_size=100 * 1024)
+    # The uncompressed size of the test file is about 253K.
+    assert len(manifest["shards"]) == 3
+
+
+def test_plan_split_limited_positions(monkeypatch, tmp_path):
+    monkeypatch.setattr(fastqsplitter_module, "MAX_PLAN_POSITIONS", 4)
+    manifest = plan_split(TEST_FILE, str(tmp_path / "manifest.json"),
+                          number=2)
+    shards = manifest["shards"]
+    assert shards[0]["start"] == 0
+    assert shards[0]["end"] == shards[1]["start"]
+    assert shards[1]["end"] == BYTES_IN_TEST_FILE
+    assert shards[0]["records"] + shards[1]["records"] == RECORDS_IN_TEST_FILE
+
+
+def test_extract_shard_out_of_date(tmp_path):
+    input_file = uncompressed_test_file()
+    manifest_file = str(tmp_path / "manifest.json")
+    plan_split(input_file, manifest_file, number=2)
+    os.utime(input_file, (0, 0))
+    with pytest.raises(ValueError) as error:
+        extract_shard(manifest_file, 0, str(tmp_path / "shard.fq"))
+    error.match("out of date")
+
+
+def test_main_plan_and_extract(tmp_path):
+    manifest_file = str(tmp_path / "manifest.json")
+    sys.argv = ["fastqsplitter", "plan", TEST_FILE, "-n", "2", "-o",
+                manifest_file]
+    main()
+    output_file = str(tmp_path / "shard.fq.gz")
+    sys.argv = ["fastqsplitter", "extract", "--manifest", manifest_file,
+                "--shard", "1", "-o", output_file]
+    main()
+    assert validate_fastq_gz(output_file) == read_manifest(
+        manifest_file)["shards"][1]["records"]
+    sys.argv = ["fastqsplitter", "extract", "--manifest", manifest_file,
+                "--shard", "2", "-o", output_file]
+    with pytest.raises(ValueError) as error:
+        main()
+    error.match("does not exist")
+
+
+def multi_member_test_file(member_size: int = 3000, bgzf: bool = False
+                           ) -> str:
+    """
+    Write TEST_FILE as gzip members that do not start at records. With bgzf
+    the members are BGZF blocks.
+    """
+    multi_member_file = tempfile.mktemp(suffix=".fq.gz")
+    with xopen.xopen(TEST_FILE, "rb") as input_handle:
+        data = input_handle.read()
+    with open(multi_member_file, "wb") as output_handle:
+        for start in range(0, len(data), member_size):
+            member = data[start:start + member_size]
+            output_handle.write(
+                fastqsplitter_module._compress_bgzf_block(member, 1) if bgzf
+                else gzip.compress(member))
+        if bgzf:
+            output_handle.write(fastqsplitter_module.BGZF_EOF)
+    return multi_member_file
+
+
+@pytest.mark.filterwarnings("error")
+@pytest.mark.parametrize("input_file", [
+    multi_member_test_file(bgzf=True), multi_member_test_file()])
+def test_split_fastqs_sequentially_passthrough(input_file: str, monkeypatch):
+    expected_files = split_fastqs_sequentially(
+        input_file, max_size=80000, prefix=tempfile.mktemp(),
+        buffer_size=1024)
+    compress_gzip_member = fastqsplitter_module._compress_gzip_member
+    compressed = []
+
+    def count_compressed(data, compression_level):
+        compressed.append(len(data))
+        return compress_gzip_member(data, compression_level)
+
+    monkeypatch.setattr(fastqsplitter_module, "_compress_gzip_member",
+                        count_compressed)
+    output_files = split_fastqs_sequentially(
+        input_file, max_size=80000, prefix=tempfile.mktemp(),
+        buffer_size=1024, passthrough=True)
+    assert len(output_files) == len(expected_files)
+    for output_file, expected_file in zip(output_files, expected_files):
+        assert xopen.xopen(output_file, "rb").read() == xopen.xopen(
+            expected_file, "rb").read()
+    # Only the members at the edges of each output file are compressed.
+    assert len(compressed) <= 2 * len(output_files)
+    assert sum(compressed) < BYTES_IN_TEST_FILE / 4
+
+
+@pytest.mark.parametrize("input_file", [
+    TEST_FILE, multi_member_test_file(member_size=20000)])
+def test_split_fastqs_sequentially_passthrough_large_members(
+        input_file: str):
+    expected_files = split_fastqs_sequentially(
+        input_file, max_size=40000, prefix=tempfile.mktemp(),
+        buffer_size=1024)
+    # The members are too large compared to the output files.
+    with pytest.warns(UserWarning, match="too large"):
+        output_files = split_fastqs_sequentially(
+            input_file, max_size=40000, prefix=tempfile.mktemp(),
+            buffer_size=1024, passthrough=True)
+    assert len(output_files) == len(expected_files)
+    for output_file, expected_file in zip(output_files, expected_files):
+        assert xopen.xopen(output_file, "rb").read() == xopen.xopen(
+            expected_file, "rb").read()
+
+
+def test_plan_split_relative_path(tmp_path, monkeypatch):
+    input_file = tmp_path / "input.fq.gz"
+    input_file.write_bytes(Path(TEST_FILE).read_bytes())
+    manifest_file = str(tmp_path / "manifest.json")
+    monkeypatch.chdir(str(tmp_path))
+    manifest = plan_split("input.fq.gz", manifest_file, number=2)
+    assert manifest["input"] == str(input_file)
+    # Extract from another working directory.
+    monkeypatch.chdir(str(Path(TEST_FILE).parent))
+    output_file = str(tmp_path / "shard0.fq")
+    extract_shard(manifest_file, 0, output_file)
+    assert Path(output_file).stat().st_size == manifest["shards"][0]["end"]
+
+
+def test_extract_shard_passthrough(tmp_path):
+    manifest_file = str(tmp_path / "manifest.json")
+    manifest = plan_split(bgzf_test_file(), manifest_file, number=3)
+    data = b""
+    for shard in range(3):
+        output_file = str(tmp_path / "shard{0}.fq.gz".format(shard))
+        extract_shard(manifest_file, shard, output_file, passthrough=True)
+        data += xopen.xopen(output_file, "rb").read()
+    assert data == xopen.xopen(TEST_FILE, "rb").read()
+    assert manifest["shards"][1]["block_offset"] > 0
+
+
+def test_main_passthrough_threads_per_file(capsys):
+    sys.argv = ["fastqsplitter", multi_member_test_file(), "-S", "-m", "80K",
+                "--passthrough", "-t", "2", "-P", "-p", tempfile.mktemp()]
+    main()
+    output_files = capsys.readouterr().out.split()
+    assert sum(validate_fastq_gz(output_file) for output_file in output_files
+               ) == RECORDS_IN_TEST_FILE
+
+
+def test_split_fastqs_sequentially_passthrough_uncompressed_output():
+    with pytest.raises(ValueError) as error:
+        split_fastqs_sequentially(TEST_FILE, max_size=400000,
+                                  suffix=".fq", passthrough=True)
+    error.match("gzip")
+
+
+@pytest.mark.parametrize("kwargs", [
+    dict(stats=SplitStatistics()), dict(compression_threads=2),
+    dict(decompression_threads=2)])
+def test_split_fastqs_sequentially_passthrough_unsupported(kwargs):
+    with pytest.raises(ValueError) as error:
+        split_fastqs_sequentially(multi_member_test_file(), max_size=80000,
+                                  passthrough=True, **kwargs)
+    error.match("Passthrough cannot be combined")
+
+
+def pbzip2_test_file(stream_size: int = 10000) -> str:
+    """Write TEST_FILE as concatenated bzip2 streams, like pbzip2 does."""
+    pbzip2_file = tempfile.mktemp(suffix=".fq.bz2")
+    with xopen.xopen(TEST_FILE, "rb") as input_handle:
+        data = input_handle.read()
+    with open(pbzip2_file, "wb") as output_handle:
+        for start in range(0, len(data), stream_size):
+            output_handle.write(bz2.compress(data[start:start + stream_size]))
+    return pbzip2_file
+
+
+@pytest.mark.parametrize("input_file", [bgzf_test_file(), pbzip2_test_file()])
+def test_parallel_decompressing_reader(input_file: str, monkeypatch):
+    # Small reads and batches, so streams and blocks are cut between reads.
+    monkeypatch.setattr(fastqsplitter_module, "DEFAULT_READ_SIZE", 1000)
+    monkeypatch.setattr(fastqsplitter_module,
+                        "PARALLEL_DECOMPRESSION_BATCH_SIZE", 10000)
+    with _ParallelDecompressingReader(input_file, 3) as reader:
+        data = b"".join(iter(lambda: reader.read(5000), b""))
+    assert data == xopen.xopen(TEST_FILE, "rb").read()
+
+
+def test_parallel_decompression_format():
+    single_stream_file = tempfile.mktemp(suffix=".fq.bz2")
+    with open(single_stream_file, "wb") as output_handle:
+        output_handle.write(bz2.compress(xopen.xopen(TEST_FILE, "rb").read()))
+    parallel_decompression_format = (
+        fastqsplitter_module._parallel_decompression_format)
+    assert parallel_decompression_format(bgzf_test_file()) == "bgzf"
+    assert parallel_decompression_format(pbzip2_test_file()) == "bzip2"
+    for input_file in (TEST_FILE, multi_member_test_file(),
+                       uncompressed_test_file(), single_stream_file,
+                       "/dev/stdin"):
+        assert parallel_decompression_format(input_file) is None
+
+
+def test_parallel_decompressing_reader_corrupt_block(tmp_path):
+    data = bytearray(Path(bgzf_test_file()).read_bytes())
+    # Change the crc32 of the first block.
+    block_size = struct.unpack_from("<H", data, 16)[0] + 1
+    data[block_size - 8] ^= 0xff
+    corrupt_file = tmp_path / "corrupt.fq.gz"
+    corrupt_file.write_bytes(bytes(data))
+    with _ParallelDecompressingReader(str(corrupt_file), 2) as reader:
+        with pytest.raises(ValueError) as error:
+            reader.read()
+    error.match("checksum")
+
+
+def test_parallel_decompressing_reader_truncated(tmp_path):
+    truncated_file = tmp_path / "truncated.fq.gz"
+    truncated_file.write_bytes(Path(bgzf_test_file()).read_bytes()[:-10])
+    with _ParallelDecompressingReader(str(truncated_file), 2) as reader:
+        with pytest.raises(EOFError):
+            reader.read()
+
+
+@pytest.mark.parametrize("input_file", [bgzf_test_file(), pbzip2_test_file()])
+@pytest.mark.parametrize("round_robin", [True, False])
+def test_fastqsplitter_decompression_threads(input_file: str,
+                                             round_robin: bool):
+    max_size = None if round_robin else 80000
+    expected = fastqsplitter(TEST_FILE, number=3, max_size=max_size,
+                             prefix=tempfile.mktemp(), buffer_size=1024,
+                             round_robin=round_robin)
+    output_files = fastqsplitter(input_file, number=3, max_size=max_size,
+                                 prefix=tempfile.mktemp(), buffer_size=1024,
+                                 round_robin=round_robin,
+                                 decompression_threads=2)
+    assert len(output_files) == len(expected) > 1
+    for output_file, expected_file in zip(output_files, expected):
+        assert xopen.xopen(output_file, "rb").read() == xopen.xopen(
+            expected_file, "rb").read()
+
+
+def test_writer_pool(tmp_path):
+    open_files = []
+    opened = []
+
+    class RecordingWriter(io.BytesIO):
+        def __init__(self, filename: str, append: bool):
+            super().__init__()
+            self.output_handle = open(filename, "ab" if append else "wb")
+            open_files.append(filename)
+            opened.append((filename, append))
+
+        def write(self, data: bytes) -> int:
+            return self.output_handle.write(data)
+
+        def close(self) -> None:
+            self.output_handle.close()
+            open_files.remove(self.output_handle.name)
+
+    pool = _WriterPool(RecordingWriter, 2)
+    filenames = [str(tmp_path / str(i)) for i in range(4)]
+    writers = [pool.output(filename) for filename in filenames]
+    for i in (0, 1, 0, 2, 0, 1):
+        writers[i].write(str(i).encode())
+        assert len(open_files) <= 2
+    for writer in writers:
+        writer.close()
+    assert open_files == []
+    # Output 0 was written most recently each time, so it stayed open.
+    assert opened == [(filenames[0], False), (filenames[1], False),
+                      (filenames[2], False), (filenames[1], True),
+                      (filenames[3], False)]
+    assert [Path(filename).read_bytes() for filename in filenames] == [
+        b"000", b"11", b"2", b""]
+
+
+@pytest.mark.parametrize("suffix", [".fq", ".fq.gz"])
+@pytest.mark.parametrize("paired", [False, True])
+def test_split_fastqs_round_robin_max_open_files(suffix: str, paired: bool):
+    input_file_r2 = TEST_FILE if paired else None
+    expected_files = [tempfile.mktemp(suffix=suffix) for _ in range(5)]
+    expected_files_r2 = [tempfile.mktemp(suffix=suffix) for _ in range(5)]
+    split_fastqs_round_robin(uncompressed_test_file(), expected_files,
+                             buffer_size=1024, input_file_r2=input_file_r2,
+                             output_files_r2=expected_files_r2)
+    output_files = [tempfile.mktemp(suffix=suffix) for _ in range(5)]
+    output_files_r2 = [tempfile.mktemp(suffix=suffix) for _ in range(5)]
+    stats = SplitStatistics()
+    split_fastqs_round_robin(uncompressed_test_file(), output_files,
+                             buffer_size=1024, input_file_r2=input_file_r2,
+                             output_files_r2=output_files_r2, stats=stats,
+                             max_open_files=2)
+    pairs = list(zip(output_files, expected_files))
+    if paired:
+        pairs += list(zip(output_files_r2, expected_files_r2))
+    for output_file, expected_file in pairs:
+        assert xopen.xopen(output_file, "rb").read() == xopen.xopen(
+            expected_file, "rb").read()
+    assert sum(stats.outputs[output_file]["records"]
+               for output_file in output_files) == RECORDS_IN_TEST_FILE
+    if suffix == ".fq.gz":
+        # Every block was written after reopening the file.
+        compressed_offsets, _ = fastqsplitter_module._gzip_member_offsets(
+            output_files[0])
+        assert len(compressed_offsets) > 10
+
+
+def test_split_fastqs_round_robin_max_open_files_errors():
+    output_files = [tempfile.mktemp(suffix=".fq.gz") for _ in range(3)]
+    with pytest.raises(ValueError) as error:
+        split_fastqs_round_robin(TEST_FILE, output_files, max_open_files=-1)
+    error.match("negative")
+    with pytest.raises(ValueError) as error:
+        split_fastqs_round_robin(TEST_FILE, output_files, bgzf=True,
+                                 max_open_files=2)
+    error.match("BGZF")
+    with pytest.raises(ValueError) as error:
+        fastqsplitter(TEST_FILE, max_size=100000, prefix=tempfile.mktemp(),
+                      round_robin=False, max_open_files=2)
+    error.match("round-robin")
+
+
+def test_sequential_splitter_growing_buffer_size():
+    class GrowingTuner(object):
+        def update(self, size: int) -> int:
+            return 16384
+
+    block_reader = _FastqBlockReader(xopen.xopen(TEST_FILE, "rb"),
+                                     DEFAULT_BUFFER_SIZE)
+    output_handle = io.BytesIO()
+    # The buffer size grows from 1024 to 16384 after the first buffer.
+    written = fastqsplitter_module._sequential_splitter(
+        block_reader, output_handle, 20000, 1024,
+        tuner=GrowingTuner())  # type: ignore
+    assert written == len(output_handle.getvalue()) <= 20000
+    assert output_handle.getvalue().endswith(b"\n")
+
+
+BENCHMARK = str(Path(__file__).parent.parent / "benchmarks" / "benchmark.py")
+
+
+def test_benchmark_suite(tmp_path):
+    results_file = str(tmp_path / "results.json")
+    command = [sys.executable, BENCHMARK, "--size", "200K", "--profile",
+               "long", "--buffer-sizes", "16K", "--numbers", "2",
+               "--threads-per-file", "0", "-r", "1", "-o", results_file]
+    subprocess.run(command, check=True)
+    with open(results_file, "rt") as results_handle:
+        results = json.load(results_handle)
+    # Round-robin and sequential, uncompressed and compressed.
+    assert len(results["results"]) == 4
+    assert results["input"]["size"] >= 200 * 1024
+    # Everything is slower than an impossibly fast baseline.
+    for result in results["results"]:
+        result["best"] = 1e-9
+    baseline_file = str(tmp_path / "baseline.json")
+    with open(baseline_file, "wt") as baseline_handle:
+        json.dump(results, baseline_handle)
+    process = subprocess.run(command + ["--baseline", baseline_file])
+    assert process.returncode == 1
+
+
+@pytest.mark.parametrize("round_robin", [True, False])
+def test_fastqsplitter_stats(round_robin: bool):
+    stats = SplitStatistics()
+    output_files = fastqsplitter(TEST_FILE, number=3, max_size=100000,
+                                 prefix=tempfile.mktemp(), buffer_size=1024,
+                                 round_robin=round_robin, stats=stats)
+    result = stats.to_dict()
+    assert result["input_bytes"] == BYTES_IN_TEST_FILE
+    assert result["input_records"] == RECORDS_IN_TEST_FILE
+    assert result["output_bytes"] == BYTES_IN_TEST_FILE
+    assert [output["filename"] for output in result["outputs"]
+            ] == output_files
+    for output in result["outputs"]:
+        assert output["records"] == validate_fastq_gz(output["filename"])
+        assert output["compressed_bytes"] == os.path.getsize(
+            output["filename"])
+        assert output["blocks"] > 0
+    assert result["scan_time"] > 0
+    assert result["wall_time"] >= result["read_time"]
+    assert result["throughput_mb_s"] > 0
+    json.dumps(result)
+
+
+@pytest.mark.parametrize("kwargs", [
+    dict(number=3), dict(max_size=100000, round_robin=False),
+    dict(records=500)])
+def test_fastqsplitter_stats_uncompressed(kwargs):
+    stats = SplitStatistics()
+    output_files = fastqsplitter(uncompressed_test_file(), suffix=".fq",
+                                 prefix=tempfile.mktemp(), stats=stats,
+                                 **kwargs)
+    result = stats.to_dict()
+    # The data is not copied by the kernel, so the records are counted.
+    assert result["input_bytes"] == BYTES_IN_TEST_FILE
+    assert result["input_records"] == RECORDS_IN_TEST_FILE
+    assert result["read_time"] is not None
+    assert result["scan_time"] is not None
+    assert result["write_time"] is not None
+    assert [output["records"] for output in result["outputs"]] == [
+        validate_fastq_gz(output_file) for output_file in output_files]
+    assert all(output["bytes"] == output["compressed_bytes"]
+               for output in result["outputs"])
+
+
+def test_main_stats(capsys):
+    stats_file = tempfile.mktemp(suffix=".json")
+    sys.argv = ["fastqsplitter", TEST_FILE, "-R", "500", "-P",
+                "-p", tempfile.mktemp(), "--stats", stats_file]
+    main()
+    with open(stats_file, "rt") as stats_handle:
+        result = json.load(stats_handle)
+    assert [output["records"] for output in result["outputs"]
+            ] == [500, 500, 10]
+    assert [output["filename"] for output in result["outputs"]
+            ] == capsys.readouterr().out.split()
+
+
+def test_buffer_size_tuner(monkeypatch):
+    tuner = BufferSizeTuner(candidates=(1024, 2048, 4096), sample_size=100)
+    clock = [0.0]
+    monkeypatch.setattr(time, "perf_counter", lambda: clock[0])
+    # Seconds per 100 bytes when using each size. 2048 is the fastest.
+    seconds = {DEFAULT_BUFFER_SIZE: 1.0, 1024: 2.0, 2048: 0.5, 4096: 1.0}
+    assert tuner.update(0) == DEFAULT_BUFFER_SIZE
+    sizes = []
+    while not tuner.done:
+        clock[0] += seconds[tuner.size]
+        sizes.append(tuner.update(100))
+    assert sizes == [1024, 2048, 4096, 2048]
+    assert tuner.chosen_size == 2048
+    assert tuner.update(100) == 2048
+
+
+@pytest.mark.parametrize("round_robin", [True, False])
+@pytest.mark.parametrize("input_file", [TEST_FILE, uncompressed_test_file()])
+def test_fastqsplitter_buffer_size_tuner(round_robin: bool, input_file: str):
+    tuner = BufferSizeTuner(candidates=(1024, 2048, 4096),
+                            sample_size=16 * 1024)
+    stats = SplitStatistics()
+    output_files = fastqsplitter(input_file, number=3, max_size=100000,
+                                 round_robin=round_robin,
+                                 prefix=tempfile.mktemp(), buffer_size=tuner,
+                                 stats=stats)
+    assert sum(validate_fastq_gz(output_file)
+               for output_file in output_files) == RECORDS_IN_TEST_FILE
+    # Sequential mode on an uncompressed file does not use the buffer size.
+    if round_robin or input_file == TEST_FILE:
+        assert tuner.done
+        assert tuner.chosen_size in (1024, 2048, 4096)
+    assert stats.to_dict()["buffer_size"] == tuner.chosen_size
+
+
+def test_main_buffer_size_auto(capsys, monkeypatch):
+    class SmallSampleTuner(BufferSizeTuner):
+        def __init__(self):
+            super().__init__(candidates=(1024, 2048), sample_size=16 * 1024)
+
+    monkeypatch.setattr(fastqsplitter_module, "BufferSizeTuner",
+                        SmallSampleTuner)
+    sys.argv = ["fastqsplitter", TEST_FILE, "-n", "3", "-b", "auto",
+                "-p", tempfile.mktemp()]
+    main()
+    assert capsys.readouterr().err.startswith("Chosen buffer size: ")
+
+
+def test_main_buffer_size_auto_zero_copy(capsys):
+    # The kernel copies uncompressed input, so no buffer size is chosen.
+    sys.argv = ["fastqsplitter", uncompressed_test_file(), "-S", "-m", "100K",
+                "-b", "auto", "-p", tempfile.mktemp(), "-s", ".fq"]
+    main()
+    error = capsys.readouterr().err
+    assert "Chosen buffer size" not in error
+    assert error.startswith("The buffer size was not tuned")
+
+
+def create_multiplexed_file() -> str:
+    """Give the records of TEST_FILE one of three barcodes."""
+    multiplexed_file = tempfile.mktemp(suffix=".fq.gz")
+    with xopen.xopen(TEST_FILE, "rb") as input_handle:
+        lines = input_handle.read().splitlines()
+    barcodes = [b"AAAAAA", b"CCCCCC", b"GGGGGG+TTTTTT"]
+    with xopen.xopen(multiplexed_file, "wb") as output_handle:
+        for i in range(0, len(lines), 4):
+            header = lines[i].replace(b"TTCCAA", barcodes[(i // 4) % 3])
+            output_handle.write(b"\n".join([header] + lines[i + 1:i + 4]) +
+                                b"\n")
+    return multiplexed_file
+
+
+def write_barcode_table(content: str) -> str:
+    barcode_table = tempfile.mktemp(suffix=".tsv")
+    with open(barcode_table, "wt") as table_handle:
+        table_handle.write(content)
+    return barcode_table
+
+
+def test_read_barcode_table():
+    barcode_table = write_barcode_table(
+        "# barcode\tsample\n\nAAAAAA\tsample1\nCCCCCC sample1\n"
+        "GGGGGG+TTTTTT\tsample2\n")
+    assert read_barcode_table(barcode_table) == {
+        b"AAAAAA": "sample1", b"CCCCCC": "sample1",
+        b"GGGGGG+TTTTTT": "sample2"}
+
+
+@pytest.mark.parametrize(["content", "message"], [
+    ("AAAAAA\tsample1\nAAAAAA\tsample2\n", "used for samples"),
+    ("AAAAAA\n", "Line 1"),
+    ("AAAAAA\t../sample1\n", "path separator"),
+    ("AAAAAA\tdir/sample1\n", "path separator"),
+])
+def test_read_barcode_table_errors(content: str, message: str):
+    with pytest.raises(ValueError) as error:
+        read_barcode_table(write_barcode_table(content))
+    error.match(message)
+
+
+@pytest.mark.parametrize(["number", "max_size"], [(3, None), (None, 20000)])
+def test_split_fastqs_by_barcode(number: Optional[int],
+                                 max_size: Optional[int]):
+    prefix = tempfile.mktemp()
+    output_files = split_fastqs_by_barcode(
+        create_multiplexed_file(), {b"AAAAAA": "a", b"GGGGGG+TTTTTT": "g"},
+        prefix, suffix=".fq", number=number, max_size=max_size,
+        buffer_size=1024)
+    records = {}
+    for output_file in output_files:
+        sample = output_file[len(prefix):].split(".")[0]
+        records[sample] = records.get(sample, 0) + validate_fastq_gz(
+            output_file)
+        with open(output_file, "rb") as output_handle:
+            headers = output_handle.read().splitlines()[::4]
+        expected_barcode = {"a": b":AAAAAA", "g": b":GGGGGG+TTTTTT",
+                            "undetermined": b":CCCCCC"}[sample]
+        assert all(header.endswith(expected_barcode) for header in headers)
+        if max_size is not None:
+            assert os.path.getsize(output_file) <= max_size
+    assert records == {"a": 337, "undetermined": 337, "g": 336}
+    if number is not None:
+        assert len(output_files) == 9
+    else:
+        assert len(output_files) > 9
+
+
+def test_split_fastqs_by_barcode_stats():
+    input_file = create_multiplexed_file()
+    stats = SplitStatistics()
+    output_files = split_fastqs_by_barcode(
+        input_file, {b"AAAAAA": "a"}, tempfile.mktemp(), number=2,
+        buffer_size=1024, stats=stats)
+    statistics = stats.to_dict()
+    assert statistics["input_bytes"] == len(
+        xopen.xopen(input_file, "rb").read())
+    assert statistics["input_records"] == RECORDS_IN_TEST_FILE
+    assert [output["filename"] for output in statistics["outputs"]
+            ] == output_files
+
+
+def test_main_barcodes(capsys):
+    barcode_table = write_barcode_table("AAAAAA\ta\nCCCCCC\tc\n")
+    sys.argv = ["fastqsplitter", create_multiplexed_file(), "-n", "2", "-P",
+                "-p", tempfile.mktemp() + ".", "--barcodes", barcode_table]
+    main()
+    output_files = capsys.readouterr().out.split()
+    assert [os.path.basename(output_file).split(".", 1)[1]
+            for output_file in output_files] == [
+        "a.0.fastq.gz", "a.1.fastq.gz", "c.0.fastq.gz", "c.1.fastq.gz",
+        "undetermined.0.fastq.gz", "undetermined.1.fastq.gz"]
+    assert sum(validate_fastq_gz(output_file)
+               for output_file in output_files) == RECORDS_IN_TEST_FILE
+
+
+def test_name_hashes():
+    hashes = _name_hashes([
+        b"@read1/1", b"@read1/2 comment", b"@read1 1:N:0:ACGT",
+        b"@read1\t2:N:0:ACGT", b"@read2", b"@read2/2/1", b"@read2/1/2"])
+    assert len(set(hashes[:4])) == 1
+    assert hashes[4] != hashes[0]
+    # Only the last mate suffix is removed.
+    assert hashes[5] == zlib.crc32(b"@read2/2")
+    assert hashes[6] == zlib.crc32(b"@read2/1")
+
+
+def test_split_fastqs_by_name_hash():
+    r1_files = [tempfile.mktemp(suffix=".fq") for _ in range(3)]
+    r2_files = [tempfile.mktemp(suffix=".fq.gz") for _ in range(3)]
+    # The mates are split independently.
+    split_fastqs_by_name_hash(TEST_FILE, r1_files, buffer_size=1024)
+    split_fastqs_by_name_hash(create_mate_file(), r2_files,
+                              buffer_size=4096)
+    total_records = 0
+    for r1_file, r2_file in zip(r1_files, r2_files):
+        r1_names = read_names(r1_file)
+        assert r1_names == read_names(r2_file)
+        assert len(r1_names) > RECORDS_IN_TEST_FILE / 6
+        total_records += len(r1_names)
+    assert total_records == RECORDS_IN_TEST_FILE
+
+
+def test_fastqsplitter_hash_by_name_paired():
+    prefix = tempfile.mktemp()
+    output_files = fastqsplitter(TEST_FILE, number=3, prefix=prefix,
+                                 input_r2=create_mate_file(),
+                                 hash_by_name=True)
+    assert len(output_files) == 6
+    names = [read_names(output_file) for output_file in output_files]
+    assert names[0::2] == names[1::2]
+    # The result is the same when splitting again with another buffer size.
+    assert output_files == fastqsplitter(TEST_FILE, number=3, prefix=prefix,
+                                         input_r2=create_mate_file(),
+                                         buffer_size=2048, hash_by_name=True)
+    assert names == [read_names(output_file) for output_file in output_files]
+
+
+@pytest.mark.parametrize("kwargs", [
+    dict(max_size=100000, round_robin=False), dict(records=1000),
+    dict(number=3, least_busy=True), dict(number=3, use_index=True)])
+def test_fastqsplitter_hash_by_name_conflicts(kwargs):
+    with pytest.raises(ValueError) as error:
+        fastqsplitter(TEST_FILE, prefix=tempfile.mktemp(), hash_by_name=True,
+                      **kwargs)
+    error.match("read name hash")
+
+
+def test_estimate_compression_ratio():
+    assert estimate_compression_ratio(TEST_FILE, ".fastq") == 1.0
+    gzip_ratio = estimate_compression_ratio(TEST_FILE, ".fastq.gz")
+    assert 0.1 < gzip_ratio < 0.6
+    # The compressed size of the input itself is estimated reasonably.
+    assert estimate_compression_ratio(TEST_FILE, TEST_FILE, 6) == (
+        pytest.approx(os.path.getsize(TEST_FILE) / BYTES_IN_TEST_FILE,
+                      rel=0.2))
+    assert estimate_compression_ratio(
+        TEST_FILE, ".fastq.xz") < gzip_ratio
+
+
+def test_estimate_compression_ratio_zstd_without_zstandard(monkeypatch):
+    monkeypatch.setattr(fastqsplitter_module, "zstandard", None)
+    assert 0.1 < estimate_compression_ratio(TEST_FILE, ".fastq.zst") < 0.6
+
+
+@pytest.mark.parametrize("max_size", [10000, 20000])
+def test_fastqsplitter_compressed_max_size_sequentially(max_size: int):
+    output_files = fastqsplitter(TEST_FILE, max_size=max_size,
+                                 prefix=tempfile.mktemp(), buffer_size=1024,
+                                 round_robin=False, compressed_max_size=True)
+    sizes = [os.path.getsize(output_file) for output_file in output_files]
+    # The ratio differs a bit between these small files.
+    assert max(sizes) <= max_size * 1.06
+    # All files but the last are close to the maximum size.
+    assert min(sizes[:-1]) > max_size * 0.8
+    assert sum(validate_fastq_gz(output_file)
+               for output_file in output_files) == RECORDS_IN_TEST_FILE
+
+
+@pytest.mark.parametrize("kwargs", [
+    dict(number=3), dict(max_size=10000, records=1000),
+    dict(max_size=10000, barcodes="barcodes.tsv")])
+def test_fastqsplitter_compressed_max_size_conflicts(kwargs):
+    with pytest.raises(ValueError) as error:
+        fastqsplitter(TEST_FILE, prefix=tempfile.mktemp(),
+                      compressed_max_size=True, **kwargs)
+    error.match("compressed maximum size")
+
+
+@pytest.mark.parametrize("input_file", [TEST_FILE, uncompressed_test_file()])
+def test_fastqsplitter_compressed_max_size_round_robin(input_file: str,
+                                                       monkeypatch):
+    open_input = fastqsplitter_module._open_input
+    opened = []
+
+    def count_opened(input_file, *args, **kwargs):
+        opened.append(input_file)
+        return open_input(input_file, *args, **kwargs)
+
+    monkeypatch.setattr(fastqsplitter_module, "_open_input", count_opened)
+    max_size = 10000
+    output_files = fastqsplitter(input_file, max_size=max_size,
+                                 prefix=tempfile.mktemp(), buffer_size=1024,
+                                 compressed_max_size=True)
+    sizes = [os.path.getsize(output_file) for output_file in output_files]
+    # Once for the sample that gives both compression ratios, once to split.
+    assert opened == [input_file, input_file]
+    # The number of files is based on an estimate.
+    assert max(sizes) <= max_size * 1.1
+    assert sum(sizes) / len(sizes) > max_size * 0.7